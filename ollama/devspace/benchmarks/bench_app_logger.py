@@ -0,0 +1,134 @@
+"""
+Application logger benchmark.
+
+Compares the calls per second of `AppLogger` against the previous implementation,
+which looked the logger up and checked its handlers on every call, with the level
+disabled and enabled. The callers are measured both with lazy arguments and with the
+f-string messages they used to build before the level check. Enabled records are
+written to a handler that drops them, so the numbers reflect the logging calls only.
+
+Usage:
+    python -m benchmarks.bench_app_logger [--calls 200000]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Any, Callable, Dict
+
+from src.prompts.utils.logger import AppLogger
+
+
+class LegacyAppLogger:
+    """The previous logger, initialized on demand on every call."""
+
+    logger = AppLogger.logger
+
+    @classmethod
+    def get_logger(cls) -> logging.Logger:
+        if cls.logger.handlers is None or len(cls.logger.handlers) == 0:
+            AppLogger.initialize_logger()
+        return cls.logger
+
+    @classmethod
+    def debug(cls, message: str, *args: Any, **kwargs: Any) -> None:
+        cls.get_logger()
+        if cls.logger.isEnabledFor(logging.DEBUG):
+            cls.logger.debug(message, *args, **kwargs)
+
+
+class DropHandler(logging.Handler):
+    """Handler formatting the records and dropping them."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.format(record)
+
+
+def calls_per_second(call: Callable[[int], None], calls: int, rounds: int = 5) -> float:
+    """
+    Measure the throughput of a logging call, keeping the best of several rounds.
+
+    Args:
+        call (Callable[[int], None]): The logging call, given the iteration number.
+        calls (int): The number of calls per round.
+        rounds (int): The number of rounds.
+
+    Returns:
+        float: Calls per second.
+    """
+    for index in range(1000):
+        call(index)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for index in range(calls):
+            call(index)
+        best = min(best, time.perf_counter() - start)
+    return calls / best
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Measure both loggers with the debug level disabled, then enabled."""
+    filename = "logging.json"
+    loggers = {"legacy_app_logger": LegacyAppLogger, "app_logger": AppLogger}
+    calls: Dict[str, Callable[[Any], Callable[[int], None]]] = {
+        "lazy": lambda log: lambda index: log.debug(
+            "Loaded %s in %d attempts", filename, index
+        ),
+        "f_string": lambda log: lambda index: log.debug(
+            f"Loaded {filename} in {index} attempts"
+        ),
+    }
+
+    logger = AppLogger.get_logger()
+    handlers, level = logger.handlers[:], logger.level
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(DropHandler())
+
+    results: Dict[str, Dict[str, float]] = {name: {} for name in loggers}
+    try:
+        for state, log_level in (
+            ("disabled", logging.INFO),
+            ("enabled", logging.DEBUG),
+        ):
+            logger.setLevel(log_level)
+            for name, log in loggers.items():
+                for style, make_call in calls.items():
+                    results[name][f"{state}_{style}_calls_per_second"] = (
+                        calls_per_second(make_call(log), args.calls)
+                    )
+    finally:
+        logger.handlers[:] = handlers
+        logger.setLevel(level)
+    return results
+
+
+def main() -> None:
+    """Parse the arguments, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    metrics = list(next(iter(results.values())).keys())
+    print(f"{'metric':<36}" + "".join(f"{name:>20}" for name in results))
+    for metric in metrics:
+        print(
+            f"{metric:<36}"
+            + "".join(f"{results[name][metric]:>20,.0f}" for name in results)
+        )
+
+
+if __name__ == "__main__":
+    main()
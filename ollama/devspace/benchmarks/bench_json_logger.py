@@ -0,0 +1,146 @@
+"""
+JSON log formatter benchmark.
+
+Compares the records per second of `FastJsonFormatter` against the `JsonFormatter`
+it replaces, with the format of `logging.json`, on a mix of records shaped like the
+service logs: uvicorn access logs, application messages, records with extra fields and
+exceptions. The outputs of both formatters are checked to be identical first.
+
+Usage:
+    python -m benchmarks.bench_json_logger [--records 100000]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Dict, List
+
+from src.prompts.utils.file_utils import load_json_file
+from src.prompts.utils.json_logger import FastJsonFormatter, JsonFormatter
+
+# Share of each record shape in the mix, access logs dominate the service logs
+MIX = {"access": 16, "message": 3, "extra": 1}
+
+
+def build_records() -> Dict[str, logging.LogRecord]:
+    """
+    Build one record of each shape.
+
+    Returns:
+        Dict[str, logging.LogRecord]: The records by shape.
+    """
+    access = logging.LogRecord(
+        "uvicorn.access",
+        logging.INFO,
+        "h11_impl.py",
+        477,
+        '%s - "%s %s HTTP/%s" %d',
+        ("10.0.0.12:51234", "POST", "/ollama/stream", "1.1", 200),
+        None,
+    )
+    message = logging.LogRecord(
+        "app",
+        logging.INFO,
+        "ollama_chat.py",
+        120,
+        "Response cache disk tier opened at %s",
+        ("/data/responses.sqlite",),
+        None,
+    )
+    extra = logging.LogRecord(
+        "app", logging.WARNING, "backend_pool.py", 300, "Ejected backend", None, None
+    )
+    extra.__dict__.update({"backend": "http://ollama-0:11434", "failures": 3})
+    try:
+        raise ValueError("Ollama call failed with status code 500.")
+    except ValueError:
+        error = logging.LogRecord(
+            "app",
+            logging.ERROR,
+            "handler.py",
+            80,
+            "Error handler",
+            None,
+            sys.exc_info(),
+        )
+    return {"access": access, "message": message, "extra": extra, "error": error}
+
+
+def records_per_second(
+    formatter: logging.Formatter, records: List[logging.LogRecord]
+) -> float:
+    """
+    Measure the formatting throughput.
+
+    Args:
+        formatter (logging.Formatter): The formatter.
+        records (List[logging.LogRecord]): The records to format, in order.
+
+    Returns:
+        float: Formatted records per second.
+    """
+    format_record = formatter.format
+    for record in records[:1000]:
+        format_record(record)
+    start = time.perf_counter()
+    for record in records:
+        format_record(record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Check that the outputs match, then measure both formatters."""
+    config = load_json_file("logging.json")["formatters"]["json"]
+    formatters = {
+        "json_formatter": JsonFormatter(config["format"]),
+        "fast_json_formatter": FastJsonFormatter(config["format"]),
+    }
+
+    shapes = build_records()
+    for name, record in shapes.items():
+        outputs = {formatter.format(record) for formatter in formatters.values()}
+        if len(outputs) != 1:
+            raise SystemExit(f"Formatter outputs differ for the {name} record")
+
+    cycle = [shapes[name] for name, weight in MIX.items() for _ in range(weight)]
+    mixed = (cycle * (args.records // len(cycle) + 1))[: args.records]
+    errors = [shapes["error"]] * max(1, args.records // 20)
+
+    return {
+        name: {
+            "mixed_records_per_second": records_per_second(formatter, mixed),
+            "error_records_per_second": records_per_second(formatter, errors),
+        }
+        for name, formatter in formatters.items()
+    }
+
+
+def main() -> None:
+    """Parse the arguments, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    metrics = list(next(iter(results.values())).keys())
+    print(f"{'metric':<28}" + "".join(f"{name:>22}" for name in results))
+    for metric in metrics:
+        print(
+            f"{metric:<28}"
+            + "".join(f"{results[name][metric]:>22,.0f}" for name in results)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+Load test benchmark.
+
+Drives `/ollama/invoke`, `/ollama/batch` and `/ollama/stream` at a target concurrency
+and reports, per endpoint, the p50/p95/p99 latency, the p50/p95/p99 time to first token
+of the streams, the throughput, the errors and the memory of the service.
+
+By default the stub Ollama server of `tests.stubs.ollama` and the service are started
+as subprocesses on free local ports, so the load generator does not share the
+interpreter of the server it measures. The stub is configured with a time to first
+token, a token rate and an error rate. With `--target`, an already running service is
+load tested instead, and its memory is not measured.
+
+The results are saved as JSON, named after the current commit by default, and can be
+compared with the results of a previous run with `--compare`.
+
+Usage:
+    python -m benchmarks.bench_load [--concurrency 16] [--requests 200]
+        [--endpoints invoke,batch,stream] [--tokens 64] [--ttft 0.2]
+        [--tokens-per-second 50] [--error-rate 0] [--output results.json]
+        [--compare baseline.json] [--target http://localhost:3000]
+        [--server-env ADMISSION_MAX_CONCURRENCY=16]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+ENDPOINTS = ("invoke", "batch", "stream")
+
+# Inputs sent in each batch request
+BATCH_SIZE = 4
+
+
+def free_port() -> int:
+    """
+    Find a free local port.
+
+    Returns:
+        int: The port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def current_commit() -> str:
+    """
+    Identify the current commit.
+
+    Returns:
+        str: The short hash of the current commit, or "unknown" outside of git.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def wait_until_ready(url: str, timeout: float = 60) -> None:
+    """
+    Wait for a URL to answer 200.
+
+    Args:
+        url (str): The URL.
+        timeout (float): Seconds to wait.
+
+    Raises:
+        SystemExit: If the URL does not answer 200 in time.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(httpx.HTTPError):
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        time.sleep(0.2)
+    raise SystemExit(f"{url} was not ready within {timeout}s")
+
+
+@contextlib.contextmanager
+def process(command: List[str], env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    """
+    Run a subprocess, terminating it on exit.
+
+    Args:
+        command (List[str]): The command.
+        env (Dict[str, str]): The environment variables.
+
+    Yields:
+        subprocess.Popen: The running process.
+    """
+    proc = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def memory_kb(pid: int, field: str) -> Optional[int]:
+    """
+    Read a memory field of a process, on Linux.
+
+    Args:
+        pid (int): The process ID.
+        field (str): The field of /proc/<pid>/status, such as "VmRSS" or "VmHWM".
+
+    Returns:
+        Optional[int]: The value in kB, or None if it cannot be read.
+    """
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Compute the p50, p95 and p99 of measurements.
+
+    Args:
+        values (List[float]): The measurements.
+
+    Returns:
+        Dict[str, Optional[float]]: The percentiles, None without enough measurements.
+    """
+    if len(values) < 2:
+        value = values[0] if values else None
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, index: int) -> Dict[str, Any]:
+    """
+    Send one request to an endpoint.
+
+    Args:
+        client (httpx.AsyncClient): The client, with the base URL of the service.
+        endpoint (str): One of "invoke", "batch" or "stream".
+        index (int): The request number, which makes every input unique.
+
+    Returns:
+        Dict[str, Any]: Whether the request succeeded, its latency and time to first token.
+    """
+    prompt = f"Load test request {index}: describe a Kubernetes pod."
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if endpoint == "stream":
+            async with client.stream(
+                "POST", "/ollama/stream", json={"input": prompt}
+            ) as response:
+                ok = response.status_code == 200
+                async for line in response.aiter_lines():
+                    if line.startswith("event: error"):
+                        ok = False
+                    elif ttft is None and line.startswith("event: data"):
+                        ttft = time.perf_counter() - start
+        elif endpoint == "batch":
+            inputs = [f"{prompt} ({item})" for item in range(BATCH_SIZE)]
+            response = await client.post("/ollama/batch", json={"inputs": inputs})
+            ok = response.status_code == 200
+        else:
+            response = await client.post("/ollama/invoke", json={"input": prompt})
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return {"ok": ok, "latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def sample_memory(pid: int, samples: List[int]) -> None:
+    """
+    Sample the resident memory of a process until cancelled.
+
+    Args:
+        pid (int): The process ID.
+        samples (List[int]): The list the samples, in kB, are appended to.
+    """
+    while True:
+        rss = memory_kb(pid, "VmRSS")
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.1)
+
+
+async def load_endpoint(
+    base_url: str, endpoint: str, args: argparse.Namespace, pid: Optional[int]
+) -> Dict[str, Any]:
+    """
+    Load an endpoint with the target concurrency and summarize the measurements.
+
+    Args:
+        base_url (str): The base URL of the service.
+        endpoint (str): One of "invoke", "batch" or "stream".
+        args (argparse.Namespace): The benchmark options.
+        pid (Optional[int]): The process ID of the service, to measure its memory.
+
+    Returns:
+        Dict[str, Any]: The summary of the measurements.
+    """
+    counter = itertools.count()
+    results: List[Dict[str, Any]] = []
+    memory: List[int] = []
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=args.timeout,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+
+        async def worker() -> None:
+            while (index := next(counter)) < args.requests:
+                results.append(await send(client, endpoint, index))
+
+        sampler = asyncio.create_task(sample_memory(pid, memory)) if pid else None
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        if sampler is not None:
+            sampler.cancel()
+
+    succeeded = [result for result in results if result["ok"]]
+    latencies = [result["latency"] for result in succeeded]
+    ttfts = [result["ttft"] for result in succeeded if result["ttft"] is not None]
+    summary: Dict[str, Any] = {
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "seconds": elapsed,
+        "throughput_rps": len(succeeded) / elapsed,
+        "latency_seconds": percentiles(latencies),
+        "ttft_seconds": percentiles(ttfts) if endpoint == "stream" else None,
+    }
+    if memory:
+        summary["memory_mb"] = {
+            "rss_start": memory[0] / 1024,
+            "rss_peak": max(memory) / 1024,
+            "rss_end": memory[-1] / 1024,
+        }
+    return summary
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Start the stub and the service, unless targeting a service, and load them."""
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",")]
+    with contextlib.ExitStack() as stack:
+        pid = None
+        base_url = args.target
+        if base_url is None:
+            stub_port, service_port = free_port(), free_port()
+            stub_url = f"http://127.0.0.1:{stub_port}"
+            stack.enter_context(
+                process(
+                    [
+                        sys.executable,
+                        "-m",
+                        "tests.stubs.ollama",
+                        f"--port={stub_port}",
+                        f"--tokens={args.tokens}",
+                        f"--ttft={args.ttft}",
+                        f"--tokens-per-second={args.tokens_per_second}",
+                        f"--error-rate={args.error_rate}",
+                        "--seed=0",
+                    ],
+                    dict(os.environ),
+                )
+            )
+            wait_until_ready(stub_url + "/api/version")
+
+            env = {
+                **os.environ,
+                "OLLAMA_URL": stub_url,
+                "READINESS_PROBE_INTERVAL": "1",
+                **dict(item.split("=", 1) for item in args.server_env),
+            }
+            service = stack.enter_context(
+                process(
+                    [
+                        sys.executable,
+                        "-m",
+                        "uvicorn",
+                        "run:application",
+                        "--host=127.0.0.1",
+                        f"--port={service_port}",
+                        "--log-level=warning",
+                        "--no-access-log",
+                    ],
+                    env,
+                )
+            )
+            base_url = f"http://127.0.0.1:{service_port}"
+            wait_until_ready(base_url + "/readyz")
+            pid = service.pid
+
+        results = {
+            endpoint: asyncio.run(load_endpoint(base_url, endpoint, args, pid))
+            for endpoint in endpoints
+        }
+        peak = memory_kb(pid, "VmHWM") if pid else None
+
+    return {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "compare", "json")
+        },
+        "server_peak_rss_mb": peak / 1024 if peak else None,
+        "results": results,
+    }
+
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Flatten the numeric results of a run, for comparisons.
+
+    Args:
+        results (Dict[str, Any]): The results of a run.
+
+    Returns:
+        Dict[str, float]: The numeric results by dotted name.
+    """
+    flat: Dict[str, float] = {}
+
+    def visit(prefix: str, value: Any) -> None:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                visit(f"{prefix}.{key}" if prefix else key, item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    visit("", results["results"])
+    return flat
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    """
+    Print the results, and their change from a baseline run.
+
+    Args:
+        results (Dict[str, Any]): The results of the run.
+        baseline (Optional[Dict[str, Any]]): The results of a previous run.
+    """
+    current = flatten(results)
+    previous = flatten(baseline) if baseline else {}
+    header = f"{'metric':<36}{results['commit']:>14}"
+    if baseline:
+        header += f"{baseline['commit']:>14}{'change':>10}"
+    print(header)
+    for name, value in current.items():
+        line = f"{name:<36}{value:>14,.3f}"
+        if name in previous:
+            change = (
+                f"{(value - previous[name]) / previous[name]:>+10.1%}"
+                if previous[name]
+                else f"{'n/a':>10}"
+            )
+            line += f"{previous[name]:>14,.3f}{change}"
+        print(line)
+
+
+def main() -> None:
+    """Parse the arguments, run the load test, then save and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Per endpoint")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per reply")
+    parser.add_argument(
+        "--ttft", type=float, default=0.2, help="Stub time to first token"
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--target", help="Base URL of a running service to load test")
+    parser.add_argument(
+        "--server-env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Setting of the started service, may be repeated",
+    )
+    parser.add_argument("--output", help="Results file, load-<commit>.json by default")
+    parser.add_argument("--compare", help="Results file of a previous run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = args.output or f"load-{results['commit']}.json"
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
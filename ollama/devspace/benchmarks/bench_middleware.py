@@ -0,0 +1,249 @@
+"""
+Middleware benchmark.
+
+Compares the raw ASGI `TimeoutMiddleware` and `RequestIDMiddleware` against the
+previous `BaseHTTPMiddleware` implementations on the `create_app()` stack. The ASGI
+application is driven directly, without a server or sockets, so the numbers reflect
+the cost of the middleware stack only.
+
+Measurements:
+- per-request overhead on `/healthcheck`
+- per-chunk latency of an SSE stream, from the moment a chunk is produced by the
+  route until it reaches the server `send` channel
+- memory allocated per concurrent streaming connection
+
+Usage:
+    python -m benchmarks.bench_middleware [--requests 2000] [--streams 50] [--chunks 200]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+from fastapi import FastAPI
+from src.prompts import create_app
+from sse_starlette.sse import EventSourceResponse
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+
+class LegacyTimeoutMiddleware(BaseHTTPMiddleware):
+    """The previous `BaseHTTPMiddleware` based timeout middleware."""
+
+    def __init__(self, app: Any, timeout: int):
+        super().__init__(app)
+        self.timeout = timeout
+
+    async def dispatch(
+        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
+    ) -> Response:
+        try:
+            return await asyncio.wait_for(call_next(request), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return JSONResponse({"detail": "Request timed out"}, status_code=504)
+
+
+class LegacyRequestIDMiddleware(BaseHTTPMiddleware):
+    """The previous `BaseHTTPMiddleware` based request ID middleware."""
+
+    async def dispatch(
+        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
+    ) -> Response:
+        request_id = str(uuid.uuid4())
+        request.state.request_id = request_id
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
+
+LEGACY_MIDDLEWARE = {
+    "TimeoutMiddleware": LegacyTimeoutMiddleware,
+    "RequestIDMiddleware": LegacyRequestIDMiddleware,
+}
+
+
+def build_app(legacy: bool, chunks: int) -> FastAPI:
+    """
+    Build the application under test with a synthetic SSE route.
+
+    Args:
+        legacy (bool): Swap in the previous `BaseHTTPMiddleware` implementations.
+        chunks (int): Number of chunks emitted by the streaming route.
+
+    Returns:
+        FastAPI: The application with `/bench/stream` registered.
+    """
+    app = create_app()
+    app.state.produced = {}
+
+    @app.get("/bench/stream")
+    async def bench_stream(stream_id: int):
+        produced: List[float] = []
+        app.state.produced[stream_id] = produced
+
+        async def events():
+            for index in range(chunks):
+                produced.append(time.perf_counter())
+                yield {"event": "data", "data": str(index)}
+                await asyncio.sleep(0)
+
+        return EventSourceResponse(events(), ping=3600)
+
+    if legacy:
+        app.user_middleware = [
+            (
+                Middleware(
+                    LEGACY_MIDDLEWARE[middleware.cls.__name__],
+                    *middleware.args,
+                    **middleware.kwargs,
+                )
+                if middleware.cls.__name__ in LEGACY_MIDDLEWARE
+                else middleware
+            )
+            for middleware in app.user_middleware
+        ]
+        app.middleware_stack = None
+    return app
+
+
+async def call(app: FastAPI, path: str, query: str = "", on_body: Any = None) -> None:
+    """
+    Drive a single GET request through the ASGI application.
+
+    Args:
+        app (FastAPI): The application.
+        path (str): The request path.
+        query (str): The raw query string.
+        on_body (Any): Optional callback invoked for every response body chunk.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+    disconnect = asyncio.Event()
+
+    async def receive() -> Dict[str, Any]:
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.body":
+            if on_body is not None and message.get("body"):
+                on_body(time.perf_counter())
+            if not message.get("more_body", False):
+                disconnect.set()
+
+    await app(scope, receive, send)
+
+
+async def bench_requests(app: FastAPI, requests: int) -> Dict[str, float]:
+    """Measure the per-request latency of `/healthcheck`."""
+    for _ in range(50):
+        await call(app, "/healthcheck")
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call(app, "/healthcheck")
+        samples.append((time.perf_counter() - start) * 1e6)
+    return {
+        "request_mean_us": statistics.fmean(samples),
+        "request_p50_us": percentile(samples, 50),
+        "request_p99_us": percentile(samples, 99),
+    }
+
+
+async def bench_streams(app: FastAPI, streams: int) -> Dict[str, float]:
+    """Measure chunk latency and memory for concurrent SSE streams."""
+    received: Dict[int, List[float]] = {}
+
+    async def one_stream(stream_id: int) -> None:
+        arrivals: List[float] = []
+        received[stream_id] = arrivals
+        await call(app, "/bench/stream", f"stream_id={stream_id}", arrivals.append)
+
+    await one_stream(-1)
+    tracemalloc.start()
+    await asyncio.gather(*(one_stream(stream_id) for stream_id in range(streams)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    for stream_id in range(streams):
+        produced = app.state.produced[stream_id]
+        # Align the arrivals with the chunks produced by the route.
+        arrivals = received[stream_id][-len(produced) :]
+        latencies.extend(
+            (arrived - made) * 1e6 for made, arrived in zip(produced, arrivals)
+        )
+    return {
+        "chunk_mean_us": statistics.fmean(latencies),
+        "chunk_p50_us": percentile(latencies, 50),
+        "chunk_p99_us": percentile(latencies, 99),
+        "peak_kib_per_stream": peak / 1024 / streams,
+    }
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the given percentile of the samples."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Run the benchmark for both middleware implementations."""
+    results = {}
+    for name, legacy in (("base_http_middleware", True), ("raw_asgi", False)):
+        app = build_app(legacy, args.chunks)
+        results[name] = {
+            **(await bench_requests(app, args.requests)),
+            **(await bench_streams(app, args.streams)),
+        }
+    return results
+
+
+def main() -> None:
+    """Parse the arguments, run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    metrics = list(next(iter(results.values())).keys())
+    print(f"{'metric':<22}" + "".join(f"{name:>22}" for name in results))
+    for metric in metrics:
+        print(
+            f"{metric:<22}"
+            + "".join(f"{results[name][metric]:>22.1f}" for name in results)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Application startup profile.
+
+Reports how long each step of the application startup takes, in a fresh interpreter:
+importing `src.prompts`, each `setup_*` step of `create_app`, the lifespan startup, and
+the background integration of the ChatOllama model. Also lists the slow model
+integration modules already loaded when the application starts serving, which should
+be none with lazy route integration.
+
+Combine with `python -X importtime` to break the import step down by module.
+
+Usage:
+    python -m benchmarks.profile_startup [--json]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import sys
+import time
+from typing import Any, Dict
+
+# Modules only needed by the ChatOllama model integration
+MODEL_INTEGRATION_MODULES = ("langserve", "langchain_community", "langchain_core")
+
+
+async def profile_lifespan(fast_api: Any) -> Dict[str, Any]:
+    """
+    Start the application, wait for the model integration, and stop the application.
+
+    Args:
+        fast_api (FastAPI): The FastAPI application instance.
+
+    Returns:
+        Dict[str, Any]: The model integration modules loaded once the application started.
+    """
+    async with fast_api.router.lifespan_context(fast_api):
+        loaded = [name for name in MODEL_INTEGRATION_MODULES if name in sys.modules]
+        if fast_api.state.model_integration is not None:
+            await fast_api.state.model_integration
+    return {"modules_loaded_at_startup": loaded}
+
+
+def run() -> Dict[str, Any]:
+    """Profile the startup steps of the application."""
+    # The application logs go to stderr, so the results can be parsed from stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        prompts = importlib.import_module("src.prompts")
+        import_seconds = time.perf_counter() - start
+
+        fast_api = prompts.create_app()
+        result = asyncio.run(profile_lifespan(fast_api))
+
+    steps = {"import": import_seconds, **fast_api.state.startup_profile.steps}
+    integration = ("import_model_integration", "setup_model_integration")
+    startup = sum(seconds for name, seconds in steps.items() if name not in integration)
+    return {
+        "steps": steps,
+        "startup_seconds": startup,
+        "model_ready_seconds": sum(steps.values()),
+        **result,
+    }
+
+
+def main() -> None:
+    """Parse the arguments, run the profile and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, seconds in results["steps"].items():
+        print(f"{name:<28}{seconds * 1000:>12,.1f} ms")
+    print(f"{'startup':<28}{results['startup_seconds'] * 1000:>12,.1f} ms")
+    print(f"{'model ready':<28}{results['model_ready_seconds'] * 1000:>12,.1f} ms")
+    loaded = ", ".join(results["modules_loaded_at_startup"]) or "none"
+    print(f"model integration modules loaded at startup: {loaded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ Author: Patryk Golabek
 Company: Translucent Computing Inc.
 Copyright: 2024 Translucent Computing Inc.
 """
+from typing import Dict, List, Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -17,11 +19,180 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 3000
 
+    # Worker processes of the production server started by serve.py
+    workers: int = 1
+    # Seconds an idle client connection is kept open, longer than the load balancer idle timeout
+    server_keep_alive: int = 75
+    # Connections waiting to be accepted
+    server_backlog: int = 2048
+    # Seconds the in-flight requests may take to finish on SIGTERM, before they are cancelled
+    server_drain_timeout: int = 30
+    # Directory of the metrics files shared by the workers, cleaned at startup
+    prometheus_multiproc_dir: str = "/tmp/prometheus-multiproc"
+
     server_log_level: str = "info"
     app_log_level: str = "debug"
     logging_path: str = "logging.json"
+    # Format and write the logs on a background thread, through a bounded queue
+    log_queue_enabled: bool = True
+    log_queue_size: int = 10000
+    # Either "drop" the records logged to a full queue, or "block" until there is room
+    log_queue_policy: Literal["drop", "block"] = "drop"
+    # Access log paths never logged, paths ending with "*" are prefixes, e.g. "/static/*"
+    access_log_suppressed_paths: List[str] = ["/metrics"]
+    # Share of the access logs kept by path, e.g. {"/healthcheck": 0.01}; 5xx are always kept
+    access_log_sample_rates: Dict[str, float] = {}
 
     ollama_model: str = "llama3.1:8b"
+    # Models served in addition to ollama_model, each under /ollama/models/<slug>, where the
+    # slug is the model name with the characters other than letters, digits and dots as "-"
+    ollama_models: List[str] = []
+    # Comma separated Ollama URLs, requests are balanced across all of them
     ollama_url: str = "http://ollama.kubert-assistant.svc.cluster.local:11434"
+    # Sampling temperature, responses are only cached when it is 0
+    ollama_temperature: Optional[float] = None
+    # Import LangChain and add the model routes in the background after startup,
+    # the routes answer 503 until then
+    lazy_route_integration: bool = True
+    # Seconds the application may take to import, be created and start, checked by the tests
+    startup_budget: float = 2.0
+
+    # Generation requests admitted at the same time per model, and requests waiting for a slot
+    admission_max_concurrency: int = 4
+    admission_max_queue: int = 32
+    # Seconds a request may wait for a slot before it is rejected
+    admission_queue_timeout: float = 60
+    # Seconds after which a waiting request goes first, whatever its priority class
+    admission_aging_time: float = 20
+
+    # Priority classes, selected by the priority header, or else batch for the batch endpoint
+    priority_header: str = "X-Priority"
+    # Share of the freed slots of each class while both are waiting
+    interactive_weight: int = 4
+    batch_weight: int = 1
+    # Batch requests allowed to wait for a slot, interactive ones use admission_max_queue
+    batch_max_queue: int = 128
+
+    # Rate limit of the generation requests of each client, identified by the first of the
+    # identity headers forwarded by the OAuth2 proxy: requests and generated tokens per
+    # minute, and the bursts a client may use at once. A rate of 0 disables the budget.
+    rate_limit_enabled: bool = False
+    rate_limit_identity_headers: List[str] = ["X-Forwarded-User", "X-Forwarded-Email"]
+    rate_limit_requests_per_minute: float = 30
+    rate_limit_request_burst: float = 10
+    rate_limit_tokens_per_minute: float = 20000
+    rate_limit_token_burst: float = 8000
+    # Shards of the in-memory store of the token buckets, and clients kept across them
+    rate_limit_shards: int = 16
+    rate_limit_max_clients: int = 100000
+
+    # Time in seconds to start a response
+    request_timeout: float = 300
+    # Deadlines in seconds for the streamed LLM responses
+    stream_first_token_timeout: float = 120
+    stream_idle_timeout: float = 30
+    stream_total_timeout: float = 600
+    # Window of the streams coalesced on request, with the coalesce, coalesce_ms and
+    # coalesce_bytes query parameters, and the largest window a client may request
+    stream_coalesce_delay: float = 0.02
+    stream_coalesce_bytes: int = 4096
+    stream_coalesce_max_delay: float = 1
+    stream_coalesce_max_bytes: int = 65536
+
+    # Response cache for deterministic invoke and batch requests
+    response_cache_enabled: bool = False
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_ttl: float = 3600
+    # SQLite file of the disk tier, which keeps entries across restarts
+    response_cache_disk_path: Optional[str] = None
+
+    # Semantic cache, answering the deterministic requests whose last user message has an
+    # embedding with at least the cosine similarity threshold to a cached one, for the same
+    # model, parameters and earlier messages. The entries are embedded by the embedding model.
+    semantic_cache_enabled: bool = False
+    semantic_cache_embedding_model: str = "nomic-embed-text"
+    semantic_cache_embedding_timeout: float = 5
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_capacity: int = 10000
+    semantic_cache_ttl: float = 3600
+
+    # Coalesce identical concurrent deterministic requests into one generation
+    single_flight_enabled: bool = True
+
+    # Connection pool of the HTTP client shared by the Ollama requests
+    ollama_max_connections: int = 100
+    ollama_max_keepalive_connections: int = 20
+    ollama_keepalive_expiry: float = 60
+
+    # Seconds to connect to Ollama, and to wait for the next chunk of its response
+    ollama_connect_timeout: float = 5
+    ollama_read_timeout: float = 120
+
+    # Health probes of the Ollama backends, and ejection of the failing ones
+    ollama_probe_interval: float = 10
+    ollama_probe_timeout: float = 2
+    ollama_failure_threshold: int = 3
+    ollama_ejection_time: float = 30
+
+    # Models an Ollama backend keeps loaded at once, its OLLAMA_MAX_LOADED_MODELS, used to
+    # schedule the requests when several models are served. A backend that must load the
+    # model of a request costs as many outstanding requests as the load cost, twice that
+    # when it must unload another model first.
+    ollama_max_loaded_models: int = 1
+    model_load_cost: float = 4
+
+    # Route the requests carrying the conversation header to the same Ollama backend, by
+    # consistent hashing with virtual nodes per backend, while the backend has at most the
+    # load factor times the average outstanding requests
+    sticky_routing_enabled: bool = True
+    conversation_header: str = "X-Conversation-ID"
+    sticky_routing_replicas: int = 100
+    sticky_routing_load_factor: float = 1.25
+
+    # Circuit breaker of the Ollama generations: consecutive backend failures that open it,
+    # seconds it rejects requests before letting trial generations through, and trials at once
+    circuit_breaker_enabled: bool = True
+    circuit_breaker_failure_threshold: int = 5
+    circuit_breaker_reset_timeout: float = 30
+    circuit_breaker_half_open_max_calls: int = 1
+
+    # Hedged invoke requests, when there are several Ollama backends: a request still
+    # unanswered after the percentile of the recent response times, at least the minimum
+    # delay, is also sent to another backend. Requests are hedged once the window holds the
+    # minimum number of response times, and the budget caps the share of hedged requests.
+    hedging_enabled: bool = False
+    hedging_percentile: float = 95
+    hedging_min_delay: float = 0.5
+    hedging_min_samples: int = 20
+    hedging_window: int = 200
+    hedging_budget: float = 0.1
+
+    # Readiness of /readyz, probed in the background from the Ollama running models
+    readiness_probe_interval: float = 5
+    readiness_probe_timeout: float = 2
+    # Share of failed Ollama requests over the window that makes the service not ready,
+    # once the window has at least the minimum number of requests
+    readiness_max_error_rate: float = 0.5
+    readiness_min_requests: int = 10
+    readiness_error_window: float = 60
+    # Whether the model must be loaded in an Ollama backend for the service to be ready,
+    # only applies when the models are warmed up
+    readiness_require_model_loaded: bool = True
+
+    # Seconds Ollama keeps a model loaded after its last request, sent with every request
+    ollama_keep_alive: float = 1800
+    # Preload the models into the Ollama backends at startup, and keep them loaded
+    warmup_enabled: bool = True
+    # Models kept loaded in addition to ollama_model, up to ollama_max_loaded_models in all
+    warmup_models: List[str] = []
+    # Seconds between two checks of the loaded models, and before the keep-alive expiry
+    # of an idle model at which it is refreshed
+    warmup_check_interval: float = 30
+    warmup_refresh_margin: float = 300
 
     model_config = SettingsConfigDict(env_file=".env")
+
+    @property
+    def ollama_urls(self) -> List[str]:
+        """The Ollama backend URLs listed in `ollama_url`."""
+        return [url.strip() for url in self.ollama_url.split(",") if url.strip()]
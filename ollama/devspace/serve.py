@@ -0,0 +1,98 @@
+"""
+Run the FastAPI server in production.
+
+Unlike `run.py`, which reloads the code for development, this entry point runs the
+configured number of worker processes, with uvloop and httptools when they are installed,
+and drains on SIGTERM: the server stops accepting connections and waits for the in-flight
+requests, including the streamed responses, to finish up to the drain timeout before the
+application shuts down.
+
+    python serve.py
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import importlib.util
+import os
+import shutil
+from typing import Any, Dict
+
+from config import Settings
+from fastapi import FastAPI
+from sse_starlette.sse import unpatch_uvicorn_signal_handler
+
+from src.prompts import create_app
+
+# Environment variable selecting the multiprocess mode of the Prometheus client
+PROMETHEUS_MULTIPROC_DIR = "PROMETHEUS_MULTIPROC_DIR"
+
+# The SSE responses of LangServe stop their streams as soon as the server receives SIGTERM,
+# through a signal handler patched into Uvicorn on import. The handler is restored before
+# any server starts, so the streams in flight finish during the drain instead.
+unpatch_uvicorn_signal_handler()
+
+
+def create_application() -> FastAPI:
+    """
+    Create the application served by each worker.
+
+    Returns:
+        FastAPI: The configured FastAPI application instance.
+    """
+    return create_app()
+
+
+def server_options(settings: Settings) -> Dict[str, Any]:
+    """
+    Build the Uvicorn options of the production server from the settings.
+
+    Args:
+        settings (Settings): The application settings.
+
+    Returns:
+        Dict[str, Any]: The keyword arguments of `uvicorn.run`.
+    """
+    uvloop = importlib.util.find_spec("uvloop") is not None
+    httptools = importlib.util.find_spec("httptools") is not None
+    return {
+        "host": settings.host,
+        "port": settings.port,
+        "workers": settings.workers,
+        "loop": "uvloop" if uvloop else "asyncio",
+        "http": "httptools" if httptools else "h11",
+        "backlog": settings.server_backlog,
+        "timeout_keep_alive": settings.server_keep_alive,
+        "timeout_graceful_shutdown": settings.server_drain_timeout,
+        "log_level": settings.server_log_level,
+        "log_config": settings.logging_path,
+    }
+
+
+def setup_multiprocess_metrics(settings: Settings) -> None:
+    """
+    Share the Prometheus metrics of the workers through files in a clean directory.
+
+    Args:
+        settings (Settings): The application settings.
+    """
+    path = os.environ.setdefault(
+        PROMETHEUS_MULTIPROC_DIR, settings.prometheus_multiproc_dir
+    )
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def main() -> None:
+    """Serve the application with the production settings."""
+    import uvicorn
+
+    settings = Settings()  # type: ignore
+    if settings.workers > 1:
+        setup_multiprocess_metrics(settings)
+    uvicorn.run("serve:create_application", factory=True, **server_options(settings))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,29 +3,94 @@ This module provides a factory method to create and configure an instance of the
 complete with logging, routes, error handling, CORS, and middleware.
 
 The application integrates the ChatOllama model for handling AI-based chat routes and is designed to
-be flexible and extendable with additional functionality as needed.
+be flexible and extendable with additional functionality as needed. LangChain and LangServe are only
+imported when the model is integrated, in the background after startup by default, so the
+application starts and answers its health checks quickly.
 
 Author: Patryk Golabek
 Company: Translucent Computing Inc.
 Copyright: 2024 Translucent Computing Inc.
 """
 
+import asyncio
+import importlib
 import logging
 import logging.config
-from typing import Any, Dict, cast
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, cast
 
 from config import Settings
 from fastapi import FastAPI, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
-from langchain_community.chat_models import ChatOllama
-from langserve import add_routes
-
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+
+from .exceptions.custom_exceptions import ModelNotReadyError
 from .exceptions.fastapi_error_handler import ErrorHandler
+from .services.backend_pool import BackendPool
+from .services.circuit_breaker import CircuitBreaker
+from .services.hedging import HEDGE_REQUEST, HedgingPolicy
+from .services.model_scheduler import ModelScheduler
+from .services.model_warmer import ModelWarmer
+from .services.ollama_client import OllamaClient
+from .services.readiness import ReadinessProbe
+from .services.response_cache import ResponseCache
+from .services.single_flight import SingleFlight
+from .services.sticky_routing import CONVERSATION_ID, StickyRouting
+from .services.stream_coalescing import StreamCoalescing
+from .utils.admission import (
+    BATCH,
+    INTERACTIVE,
+    AdmissionController,
+    AdmissionMiddleware,
+    PriorityClass,
+)
 from .utils.file_utils import load_json_file
 from .utils.log_filter import SuppressSpecificLogEntries
+from .utils.log_queue import install_log_queue, stop_log_queue
+from .utils.logger import AppLogger
+from .utils.metrics import MetricsMiddleware
 from .utils.middleware import RequestIDMiddleware, TimeoutMiddleware
+from .utils.rate_limit import InMemoryRateLimitStore, RateLimitMiddleware
+from .utils.startup import StartupProfile
+
+# Path under which the ChatOllama routes are mounted
+OLLAMA_PATH = "/ollama"
+# Path under which the routes of the additional models are mounted, by model slug
+OLLAMA_MODELS_PATH = OLLAMA_PATH + "/models"
+
+# Seconds after which clients may retry the ChatOllama routes while the model is integrated
+MODEL_NOT_READY_RETRY_AFTER = 5
+
+
+def model_routes(settings: Settings) -> Dict[str, str]:
+    """
+    The models served by the application, by the path of their routes.
+
+    The model of the settings is served under "/ollama", and each additional model under
+    "/ollama/models/<slug>", where the slug is the model name in lower case with every
+    character other than letters, digits and dots replaced by "-".
+
+    Args:
+        settings (Settings): The application settings that contain configuration details.
+
+    Returns:
+        Dict[str, str]: The model names by route path.
+    """
+    routes = {OLLAMA_PATH: settings.ollama_model}
+    for model in settings.ollama_models:
+        slug = re.sub(r"[^a-z0-9.]+", "-", model.lower()).strip("-")
+        routes.setdefault(f"{OLLAMA_MODELS_PATH}/{slug}", model)
+    return routes
 
 
 def setup_logging(fast_api: FastAPI):
@@ -44,33 +109,70 @@ def setup_logging(fast_api: FastAPI):
     """
 
     # Load the logging configuration from JSON file
+    settings = fast_api.state.settings
     logging_config: Dict[str, Any] = cast(
-        Dict[str, Any], load_json_file(fast_api.state.settings.logging_path)
+        Dict[str, Any], load_json_file(settings.logging_path)
     )
 
+    # Stop the logging queue of a previous configuration, before its handlers are replaced
+    stop_log_queue()
+
     # Apply the logging configuration
     logging.config.dictConfig(logging_config)
 
     # Set the log level
     app_logger = logging.getLogger("app")
-    app_logger.setLevel(fast_api.state.settings.app_log_level.upper())
+    app_logger.setLevel(settings.app_log_level.upper())
+    AppLogger.apply_logging_config(logging_config, app_logger.level)
 
     # Add the filter to Uvicorn's access logger
-    endpoints_to_suppress = ["/metrics"]
     uvicorn_access_logger = logging.getLogger("uvicorn.access")
-    uvicorn_access_logger.addFilter(SuppressSpecificLogEntries(endpoints_to_suppress))
+    uvicorn_access_logger.addFilter(
+        SuppressSpecificLogEntries(
+            settings.access_log_suppressed_paths,
+            sample_rates=settings.access_log_sample_rates,
+        )
+    )
+
+    # Move the configured handlers behind a bounded queue, written by a background thread
+    fast_api.state.log_queue = None
+    if settings.log_queue_enabled:
+        loggers = [
+            logging.getLogger(None if name == "root" else name)
+            for name, config in logging_config.get("loggers", {}).items()
+            if config.get("handlers")
+        ]
+        fast_api.state.log_queue = install_log_queue(
+            loggers, settings.log_queue_size, settings.log_queue_policy
+        )
 
 
 def setup_metrics(fast_api: FastAPI):
     """
     Set up Prometheus middleware for collecting metrics in the application.
 
-    Currently, this function is a placeholder for future implementation.
+    This function adds the middleware that records the HTTP request metrics and
+    exposes all the metrics, including the Ollama model metrics, at "/metrics". When the
+    server runs several workers, the metrics of all of them are aggregated from the files
+    of the Prometheus multiprocess directory. The gauges only aggregate the live workers,
+    a worker removes its gauges when it shuts down.
 
     Args:
         fast_api (FastAPI): The FastAPI application instance.
     """
-    pass
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    @fast_api.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Endpoint for scraping the Prometheus metrics."""
+        return Response(
+            content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST
+        )
+
+    fast_api.add_middleware(MetricsMiddleware)
 
 
 def setup_error_handlers(fast_api: FastAPI):
@@ -91,8 +193,8 @@ def setup_routes(fast_api: FastAPI):
     """
     Define and register the general routes for the FastAPI application.
 
-    This function adds basic routes such as a health check endpoint and a root endpoint,
-    along with an endpoint for listing all routes available in the application.
+    This function adds basic routes such as a health check endpoint, a readiness endpoint and a root
+    endpoint, along with an endpoint for listing all routes available in the application.
 
     Args:
         fast_api (FastAPI): The FastAPI application instance.
@@ -103,6 +205,23 @@ def setup_routes(fast_api: FastAPI):
         """Endpoint for health checking the application."""
         return {"status": "Healthy"}
 
+    @fast_api.get("/readyz")
+    def readiness(request: Request):
+        """
+        Endpoint for the readiness of the application, from the cached background probe.
+
+        Args:
+            request (Request): The incoming HTTP request.
+
+        Returns:
+            JSONResponse: The readiness state, with status 200 if ready or 503 otherwise.
+        """
+        state = request.app.state.readiness.state
+        return JSONResponse(
+            content={"status": "Ready" if state["ready"] else "Not Ready", **state},
+            status_code=200 if state["ready"] else 503,
+        )
+
     @fast_api.get("/")
     def root():
         """Root endpoint that returns a welcome HTML page."""
@@ -145,50 +264,357 @@ def setup_route_integration(fast_api: FastAPI, settings: Settings):
     """
     Set up the integration of external services, such as AI models, with FastAPI routes.
 
-    This function integrates the ChatOllama model and adds the related routes under the "/ollama" path.
+    This function creates the resources shared by the ChatOllama model: a pooled HTTP client that
+    keeps connections to Ollama alive, balanced across the Ollama backends listed in the settings,
+    and a response cache, when enabled. The model and its routes under the "/ollama" path are set
+    up by `setup_model_integration`, right away or, with lazy route integration, by the lifespan
+    after startup. Until then, the "/ollama" routes answer 503 with a Retry-After header.
+    It also creates the readiness probe of the service, which probes the Ollama backends in the
+    background, and the model warmer, which keeps the models loaded in the backends.
 
     Args:
         fast_api (FastAPI): The FastAPI application instance.
         settings (Settings): The application settings that contain configuration details.
     """
 
-    # Create a ChatOllama model instance
-    model = ChatOllama(model=settings.ollama_model, base_url=settings.ollama_url)
+    # Create the pooled HTTP client shared by the Ollama requests, started by the lifespan
+    fast_api.state.ollama_client = OllamaClient(
+        max_connections=settings.ollama_max_connections,
+        max_keepalive_connections=settings.ollama_max_keepalive_connections,
+        keepalive_expiry=settings.ollama_keepalive_expiry,
+        connect_timeout=settings.ollama_connect_timeout,
+        read_timeout=settings.ollama_read_timeout,
+    )
 
-    # Add routes for the ChatOllama model to the FastAPI app at the "/ollama" path
-    add_routes(
-        fast_api,
-        model,
-        path="/ollama",
+    # Balance the requests across the Ollama backends, probed in the background by the lifespan
+    ollama_urls = settings.ollama_urls
+    fast_api.state.backend_pool = (
+        BackendPool(
+            ollama_urls,
+            client=fast_api.state.ollama_client,
+            probe_interval=settings.ollama_probe_interval,
+            probe_timeout=settings.ollama_probe_timeout,
+            failure_threshold=settings.ollama_failure_threshold,
+            ejection_time=settings.ollama_ejection_time,
+            # Track the models loaded in the backends when several models are served
+            scheduler=(
+                ModelScheduler(
+                    max_loaded_models=settings.ollama_max_loaded_models,
+                    load_cost=settings.model_load_cost,
+                )
+                if len(model_routes(settings)) > 1
+                else None
+            ),
+            # Route the turns of a conversation to the same backend
+            sticky_routing=(
+                StickyRouting(
+                    ollama_urls,
+                    replicas=settings.sticky_routing_replicas,
+                    load_factor=settings.sticky_routing_load_factor,
+                )
+                if settings.sticky_routing_enabled and len(ollama_urls) > 1
+                else None
+            ),
+        )
+        if ollama_urls
+        else None
     )
 
+    # Create the response cache, if enabled
+    fast_api.state.response_cache = (
+        ResponseCache(
+            max_bytes=settings.response_cache_max_bytes,
+            ttl=settings.response_cache_ttl,
+            disk_path=settings.response_cache_disk_path,
+        )
+        if settings.response_cache_enabled
+        else None
+    )
 
-def create_app() -> FastAPI:
+    # Fail the generations of each model fast while Ollama is failing them, by route path
+    fast_api.state.circuit_breakers = (
+        {
+            path: CircuitBreaker(
+                model=model,
+                failure_threshold=settings.circuit_breaker_failure_threshold,
+                reset_timeout=settings.circuit_breaker_reset_timeout,
+                half_open_max_calls=settings.circuit_breaker_half_open_max_calls,
+            )
+            for path, model in model_routes(settings).items()
+        }
+        if settings.circuit_breaker_enabled
+        else {}
+    )
+
+    fast_api.state.model = None
+    fast_api.state.models = {}
+    fast_api.state.model_placeholder = None
+    fast_api.state.model_integration = None
+
+    # Keep the models loaded in the Ollama backends, warmed up in the background by the lifespan
+    fast_api.state.model_warmer = (
+        ModelWarmer(
+            models=[settings.ollama_model, *settings.warmup_models],
+            backend_pool=fast_api.state.backend_pool,
+            client=fast_api.state.ollama_client,
+            keep_alive=settings.ollama_keep_alive,
+            refresh_margin=settings.warmup_refresh_margin,
+            check_interval=settings.warmup_check_interval,
+            timeout=settings.ollama_probe_timeout,
+            max_loaded_models=settings.ollama_max_loaded_models,
+        )
+        if settings.warmup_enabled and fast_api.state.backend_pool is not None
+        else None
+    )
+
+    # Probe the readiness of the service in the background, started by the lifespan
+    fast_api.state.readiness = ReadinessProbe(
+        model=settings.ollama_model,
+        backend_pool=fast_api.state.backend_pool,
+        client=fast_api.state.ollama_client,
+        is_integrated=lambda: fast_api.state.model is not None,
+        probe_interval=settings.readiness_probe_interval,
+        probe_timeout=settings.readiness_probe_timeout,
+        max_error_rate=settings.readiness_max_error_rate,
+        min_requests=settings.readiness_min_requests,
+        error_window=settings.readiness_error_window,
+        require_model_loaded=settings.readiness_require_model_loaded
+        and fast_api.state.model_warmer is not None,
+        circuit_breaker=fast_api.state.circuit_breakers.get(OLLAMA_PATH),
+    )
+
+    if not settings.lazy_route_integration:
+        setup_model_integration(fast_api, settings)
+        return
+
+    # Answer the ChatOllama routes until the model is integrated
+    async def model_not_ready(path: str):
+        """Placeholder of the ChatOllama routes while the model is integrated."""
+        raise ModelNotReadyError(retry_after=MODEL_NOT_READY_RETRY_AFTER)
+
+    fast_api.add_api_route(
+        OLLAMA_PATH + "/{path:path}",
+        model_not_ready,
+        methods=["GET", "POST"],
+        include_in_schema=False,
+    )
+    fast_api.state.model_placeholder = fast_api.router.routes[-1]
+
+
+def import_model_integration() -> None:
+    """Import the LangChain and LangServe modules used by the model integration."""
+    importlib.import_module("langserve")
+    importlib.import_module(".services.ollama_chat", __name__)
+
+
+def setup_model_integration(fast_api: FastAPI, settings: Settings):
     """
-    Factory method to create, configure, and return an instance of the FastAPI application.
+    Integrate the ChatOllama models and add their routes, under the "/ollama" path for the
+    model of the settings and under "/ollama/models/<slug>" for the additional models.
+
+    The model sends its requests through the pooled HTTP client and the backend pool. It is
+    instrumented with the Ollama metrics exposed by `setup_metrics`. Deterministic requests are
+    answered from the response cache and identical concurrent ones share a single generation,
+    when enabled. Deterministic requests similar to an earlier one are answered from the
+    semantic cache, when enabled. Stream requests may ask for their tokens to be coalesced
+    into fewer events with query parameters. While the circuit breaker of their model is open,
+    requests are rejected with 503 before they start, including the streamed ones. With
+    several Ollama backends, slow invoke requests may be hedged to a second backend. With
+    several models, the backend pool routes the requests to the backends that hold their
+    model. With several Ollama backends, the requests carrying the conversation header are
+    routed to the same backend.
 
-    The method sets up the application with logging, error handling, routing, middleware,
-    and external service integrations, ensuring the app is ready for deployment.
+    Args:
+        fast_api (FastAPI): The FastAPI application instance.
+        settings (Settings): The application settings that contain configuration details.
+    """
+    # Imported here, they are the slowest imports of the application
+    from langserve import add_routes
+
+    from .services.ollama_chat import KubertChatOllama
+    from .services.semantic_cache import OllamaEmbedder, SemanticCache
+
+    # Create a ChatOllama model instance per model, sharing the identical generations
+    ollama_urls = settings.ollama_urls
+    single_flight = SingleFlight() if settings.single_flight_enabled else None
+    semantic_cache = (
+        SemanticCache(
+            OllamaEmbedder(
+                model=settings.semantic_cache_embedding_model,
+                client=fast_api.state.ollama_client,
+                timeout=settings.semantic_cache_embedding_timeout,
+                base_url=ollama_urls[0] if ollama_urls else settings.ollama_url,
+                backend_pool=fast_api.state.backend_pool,
+            ),
+            capacity=settings.semantic_cache_capacity,
+            threshold=settings.semantic_cache_threshold,
+            ttl=settings.semantic_cache_ttl,
+        )
+        if settings.semantic_cache_enabled
+        else None
+    )
+    models = {
+        path: KubertChatOllama(
+            model=name,
+            base_url=ollama_urls[0] if ollama_urls else settings.ollama_url,
+            temperature=settings.ollama_temperature,
+            keep_alive=int(settings.ollama_keep_alive),
+            response_cache=fast_api.state.response_cache,
+            semantic_cache=semantic_cache,
+            single_flight=single_flight,
+            ollama_client=fast_api.state.ollama_client,
+            backend_pool=fast_api.state.backend_pool,
+            circuit_breaker=fast_api.state.circuit_breakers.get(path),
+            hedging=(
+                HedgingPolicy(
+                    model=name,
+                    percentile=settings.hedging_percentile,
+                    min_delay=settings.hedging_min_delay,
+                    min_samples=settings.hedging_min_samples,
+                    window=settings.hedging_window,
+                    budget=settings.hedging_budget,
+                )
+                if settings.hedging_enabled and len(ollama_urls) > 1
+                else None
+            ),
+        )
+        for path, name in model_routes(settings).items()
+    }
+
+    # Replace the placeholder by the routes of the ChatOllama models
+    if fast_api.state.model_placeholder is not None:
+        fast_api.router.routes.remove(fast_api.state.model_placeholder)
+        fast_api.state.model_placeholder = None
+    stream_coalescing = StreamCoalescing(
+        default_delay=settings.stream_coalesce_delay,
+        default_bytes=settings.stream_coalesce_bytes,
+        max_delay=settings.stream_coalesce_max_delay,
+        max_bytes=settings.stream_coalesce_max_bytes,
+    )
+    conversation_header = settings.conversation_header
 
-    Returns:
-        FastAPI: The configured FastAPI application instance.
+    def per_request_config(
+        circuit_breaker: Optional[CircuitBreaker],
+    ) -> Callable[[Dict[str, Any], Request], Dict[str, Any]]:
+        """Create the per request config modifier of the routes of a model."""
+
+        def modifier(config: Dict[str, Any], request: Request) -> Dict[str, Any]:
+            """
+            Reject the requests while the circuit breaker of the model is open, before they
+            start, mark the invoke requests, which may be hedged, and set the conversation
+            ID of the request.
+            """
+            if circuit_breaker is not None:
+                circuit_breaker.check()
+            HEDGE_REQUEST.set(request.url.path.endswith("/invoke"))
+            CONVERSATION_ID.set(request.headers.get(conversation_header))
+            return stream_coalescing.config_modifier(config, request)
+
+        return modifier
+
+    for path, model in models.items():
+        add_routes(
+            fast_api,
+            model,
+            path=path,
+            per_req_config_modifier=per_request_config(
+                fast_api.state.circuit_breakers.get(path)
+            ),
+        )
+    fast_api.openapi_schema = None
+    fast_api.state.models = models
+    fast_api.state.model = models[OLLAMA_PATH]
+
+
+async def integrate_model(fast_api: FastAPI) -> None:
     """
+    Integrate the ChatOllama model in the background, once the application is started.
 
-    # Create the FastAPI application
-    fast_api = FastAPI()
+    The modules are imported in a thread, so the event loop keeps serving requests, then the
+    routes are added on the event loop.
 
-    # Set up the settings
-    fast_api.state.settings = Settings()  # type: ignore
+    Args:
+        fast_api (FastAPI): The FastAPI application instance.
+    """
+    profile: StartupProfile = fast_api.state.startup_profile
+    try:
+        with profile.step("import_model_integration"):
+            await asyncio.to_thread(import_model_integration)
+        with profile.step("setup_model_integration"):
+            setup_model_integration(fast_api, fast_api.state.settings)
+    except Exception:
+        AppLogger.exception("Failed to integrate the ChatOllama model")
+        raise
+    AppLogger.info("Integrated the ChatOllama model: %s", profile.summary())
+
+    # Refresh the readiness now rather than at the next probe
+    await fast_api.state.readiness.probe()
+
+
+def setup_middleware(fast_api: FastAPI):
+    """
+    Add the admission control, rate limit, timeout, request ID and CORS middleware to the
+    application.
 
-    # Configure the FastAPI application
-    setup_logging(fast_api)
-    setup_metrics(fast_api)
-    setup_error_handlers(fast_api)
-    setup_routes(fast_api)
-    setup_route_integration(fast_api, fast_api.state.settings)
+    Args:
+        fast_api (FastAPI): The FastAPI application instance.
+    """
+    settings = fast_api.state.settings
 
-    # Add TimeoutMiddleware with a timeout of 300 seconds (5 minutes)
-    fast_api.add_middleware(TimeoutMiddleware, timeout=300)
+    # Add admission control of the ChatOllama generations of each model, inside the timeout
+    # of the requests
+    fast_api.add_middleware(
+        AdmissionMiddleware,
+        controllers={
+            path: AdmissionController(
+                model=model,
+                max_concurrency=settings.admission_max_concurrency,
+                classes=[
+                    PriorityClass(
+                        INTERACTIVE,
+                        weight=settings.interactive_weight,
+                        max_queue=settings.admission_max_queue,
+                    ),
+                    PriorityClass(
+                        BATCH,
+                        weight=settings.batch_weight,
+                        max_queue=settings.batch_max_queue,
+                    ),
+                ],
+                queue_timeout=settings.admission_queue_timeout,
+                aging_time=settings.admission_aging_time,
+            )
+            for path, model in model_routes(settings).items()
+        },
+        priority_header=settings.priority_header,
+    )
+
+    # Add the rate limit of the generations of each client, rejecting the requests over
+    # their budget before they wait for admission
+    if settings.rate_limit_enabled:
+        fast_api.add_middleware(
+            RateLimitMiddleware,
+            store=InMemoryRateLimitStore(
+                shards=settings.rate_limit_shards,
+                max_clients=settings.rate_limit_max_clients,
+            ),
+            paths=list(model_routes(settings)),
+            identity_headers=settings.rate_limit_identity_headers,
+            requests_per_minute=settings.rate_limit_requests_per_minute,
+            request_burst=settings.rate_limit_request_burst,
+            tokens_per_minute=settings.rate_limit_tokens_per_minute,
+            token_burst=settings.rate_limit_token_burst,
+        )
+
+    # Add TimeoutMiddleware, with stream deadlines for the ChatOllama routes
+    fast_api.add_middleware(
+        TimeoutMiddleware,
+        timeout=settings.request_timeout,
+        stream_paths=[OLLAMA_PATH],
+        first_token_timeout=settings.stream_first_token_timeout,
+        idle_timeout=settings.stream_idle_timeout,
+        total_timeout=settings.stream_total_timeout,
+    )
 
     # Add request Id middleware
     fast_api.add_middleware(RequestIDMiddleware)
@@ -203,4 +629,86 @@ def create_app() -> FastAPI:
         expose_headers=["*"],
     )
 
+
+@asynccontextmanager
+async def lifespan(fast_api: FastAPI) -> AsyncIterator[None]:
+    """
+    Start the shared resources of the application, and release them on shutdown.
+
+    Args:
+        fast_api (FastAPI): The FastAPI application instance.
+
+    Yields:
+        None: While the application is serving requests.
+    """
+    profile: StartupProfile = fast_api.state.startup_profile
+    with profile.step("lifespan_startup"):
+        await fast_api.state.ollama_client.start()
+        if fast_api.state.backend_pool is not None:
+            await fast_api.state.backend_pool.start()
+        if fast_api.state.model is None:
+            fast_api.state.model_integration = asyncio.create_task(
+                integrate_model(fast_api)
+            )
+        await fast_api.state.readiness.start()
+        if fast_api.state.model_warmer is not None:
+            await fast_api.state.model_warmer.start()
+    try:
+        yield
+    finally:
+        integration = fast_api.state.model_integration
+        if integration is not None and not integration.done():
+            integration.cancel()
+        await fast_api.state.readiness.aclose()
+        if fast_api.state.model_warmer is not None:
+            await fast_api.state.model_warmer.aclose()
+        if fast_api.state.backend_pool is not None:
+            await fast_api.state.backend_pool.aclose()
+        await fast_api.state.ollama_client.aclose()
+        if fast_api.state.response_cache is not None:
+            fast_api.state.response_cache.close()
+        if fast_api.state.log_queue is not None:
+            fast_api.state.log_queue.stop()
+        # Remove the live gauges of the worker from the metrics of the other workers
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            multiprocess.mark_process_dead(os.getpid())
+
+
+def create_app() -> FastAPI:
+    """
+    Factory method to create, configure, and return an instance of the FastAPI application.
+
+    The method sets up the application with logging, error handling, routing, middleware,
+    and external service integrations, ensuring the app is ready for deployment.
+
+    Returns:
+        FastAPI: The configured FastAPI application instance.
+    """
+
+    # Create the FastAPI application, timing each startup step
+    profile = StartupProfile()
+    fast_api = FastAPI(lifespan=lifespan)
+    fast_api.state.startup_profile = profile
+
+    # Set up the settings
+    with profile.step("settings"):
+        fast_api.state.settings = Settings()  # type: ignore
+
+    # Configure the FastAPI application
+    with profile.step("setup_logging"):
+        setup_logging(fast_api)
+    with profile.step("setup_error_handlers"):
+        setup_error_handlers(fast_api)
+    with profile.step("setup_routes"):
+        setup_routes(fast_api)
+    with profile.step("setup_route_integration"):
+        setup_route_integration(fast_api, fast_api.state.settings)
+    with profile.step("setup_middleware"):
+        setup_middleware(fast_api)
+
+    # Set up metrics last, so the metrics middleware is the outermost and also observes timeouts
+    with profile.step("setup_metrics"):
+        setup_metrics(fast_api)
+
+    AppLogger.info("Created the application: %s", profile.summary())
     return fast_api
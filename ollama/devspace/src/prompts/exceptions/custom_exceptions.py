@@ -7,7 +7,8 @@ Description:
 Custom exception classes for the project.
 """
 
-from typing import Any, Optional
+import logging
+from typing import Any, Dict, Optional
 
 
 class Error(Exception):
@@ -15,8 +16,16 @@ class Error(Exception):
 
     status_code: int = 500
     description: str = "An unexpected error occurred."
-
-    def __init__(self, *args: object, description: Optional[str] = None) -> None:
+    headers: Optional[Dict[str, str]] = None
+    # Level the error handler logs the error at
+    log_level: int = logging.ERROR
+
+    def __init__(
+        self,
+        *args: object,
+        description: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
         """
         Initialize Error instance.
 
@@ -25,10 +34,13 @@ class Error(Exception):
         Args:
             *args: Variable length argument list.
             description: An optional custom description of the error.
+            headers: Optional headers added to the error response.
         """
         super().__init__(*args)
         if description:
             self.description = description
+        if headers:
+            self.headers = headers
 
 
 class BusinessLogicError(Error):
@@ -116,3 +128,120 @@ class CommandNotAllowedError(Error):
 
     status_code = 403
     description = "Command Not Allowed"
+
+
+class InvalidRequestParameterError(Error):
+    """Exception raised when a query parameter of a request is malformed or out of bounds."""
+
+    status_code = 400
+    description = "Invalid Request Parameter"
+
+
+class ServiceOverloadedError(Error):
+    """Exception raised when a request is not admitted because the service is at capacity."""
+
+    status_code = 503
+    description = "Service Overloaded"
+
+    def __init__(self, retry_after: int, description: Optional[str] = None) -> None:
+        """
+        Initialize ServiceOverloadedError instance.
+
+        Args:
+            retry_after (int): Seconds after which the client may retry.
+            description (Optional[str]): An optional custom description of the error.
+        """
+        super().__init__(
+            description=description, headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+
+class ModelNotReadyError(Error):
+    """Exception raised when a model route is called before the model is integrated."""
+
+    status_code = 503
+    description = "Model Not Ready"
+
+    def __init__(self, retry_after: int, description: Optional[str] = None) -> None:
+        """
+        Initialize ModelNotReadyError instance.
+
+        Args:
+            retry_after (int): Seconds after which the client may retry.
+            description (Optional[str]): An optional custom description of the error.
+        """
+        super().__init__(
+            description=description, headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Error):
+    """Exception raised when a request is rejected because the Ollama circuit breaker is open."""
+
+    status_code = 503
+    description = "Service Unavailable"
+    # Every request fails the same way while the breaker is open, the breaker logs it once
+    log_level = logging.DEBUG
+
+    def __init__(self, retry_after: int, description: Optional[str] = None) -> None:
+        """
+        Initialize CircuitOpenError instance.
+
+        Args:
+            retry_after (int): Seconds after which the client may retry.
+            description (Optional[str]): An optional custom description of the error.
+        """
+        super().__init__(
+            description=description, headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+
+class RateLimitExceededError(Error):
+    """Exception raised when a request is rejected because its client exceeded a budget."""
+
+    status_code = 429
+    description = "Rate Limit Exceeded"
+    # Clients over their budget are rejected in bulk, the rejections are counted instead
+    log_level = logging.INFO
+
+    def __init__(
+        self, retry_after: int, budget: str, description: Optional[str] = None
+    ) -> None:
+        """
+        Initialize RateLimitExceededError instance.
+
+        Args:
+            retry_after (int): Seconds until the exhausted budget allows the request.
+            budget (str): The exhausted budget, either "requests" or "tokens".
+            description (Optional[str]): An optional custom description of the error.
+        """
+        super().__init__(
+            description=description,
+            headers={
+                "Retry-After": str(retry_after),
+                "X-RateLimit-Budget": budget,
+                "X-RateLimit-Reset": str(retry_after),
+            },
+        )
+        self.retry_after = retry_after
+        self.budget = budget
+
+
+class OllamaStatusError(ValueError):
+    """Exception raised when Ollama answers a request with an error status."""
+
+    def __init__(self, message: str, status_code: int):
+        """
+        Initialize OllamaStatusError instance.
+
+        A ValueError, like the errors of the LangChain Ollama client.
+
+        Args:
+            message (str): The error message.
+            status_code (int): The status code of the Ollama response.
+        """
+        super().__init__(message)
+        self.status_code = status_code
@@ -8,7 +8,8 @@ Company: Translucent Computing Inc.
 Copyright: 2024 Translucent Computing Inc.
 """
 
-from typing import Type, Union
+import logging
+from typing import Dict, Optional, Type, Union
 
 from fastapi import FastAPI, HTTPException
 from starlette.requests import Request
@@ -16,13 +17,28 @@ from starlette.responses import JSONResponse
 from starlette.types import HTTPExceptionHandler
 
 from ..utils.logger import AppLogger
-from .custom_exceptions import CommandNotAllowedError, Error, ForbiddenError
+from .custom_exceptions import (
+    CircuitOpenError,
+    CommandNotAllowedError,
+    Error,
+    ForbiddenError,
+    InvalidRequestParameterError,
+    ModelNotReadyError,
+    RateLimitExceededError,
+    ServiceOverloadedError,
+)
 
 
 class CustomJSONResponse(JSONResponse):
     """Custom JSONResponse class."""
 
-    def __init__(self, status_code: int, name: str, description: str) -> None:
+    def __init__(
+        self,
+        status_code: int,
+        name: str,
+        description: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
         """
         Initialize CustomJSONResponse instance.
 
@@ -30,13 +46,14 @@ class CustomJSONResponse(JSONResponse):
             status_code (int): HTTP status code of the response.
             name (str): Name of the error.
             description (str): Description of the error.
+            headers (Optional[Dict[str, str]]): Additional response headers.
         """
         # Validate status_code
         if status_code < 100 or status_code >= 600:
             status_code = 500
 
         content = {"code": status_code, "name": name, "description": description}
-        super().__init__(status_code=status_code, content=content)
+        super().__init__(status_code=status_code, content=content, headers=headers)
 
 
 class ErrorHandler:
@@ -83,12 +100,24 @@ class ErrorHandler:
             status_code = exc.status_code
             description = exc.detail
 
+        # The request ID is attached to the log record, the handler may run outside
+        # of the request context for unhandled exceptions. Errors expected in bulk,
+        # such as the rejections of an open circuit breaker, are logged at a lower level
+        AppLogger.log(
+            getattr(exc, "log_level", logging.ERROR),
+            "Error handler: %s",
+            description,
+            extra={"request_id": request_id} if request_id else None,
+        )
+
         if request_id:
             description = f"[Request Id: {request_id}], {description}"
 
-        AppLogger.error(f"Error handler: {description}")
         return CustomJSONResponse(
-            status_code=status_code, name=type(exc).__name__, description=description
+            status_code=status_code,
+            name=type(exc).__name__,
+            description=description,
+            headers=getattr(exc, "headers", None),
         )
 
     def add_exception_handler(
@@ -114,3 +143,8 @@ class ErrorHandler:
         self.add_exception_handler(HTTPException, self._error_handler)
         self.add_exception_handler(ForbiddenError, self._error_handler)
         self.add_exception_handler(CommandNotAllowedError, self._error_handler)
+        self.add_exception_handler(InvalidRequestParameterError, self._error_handler)
+        self.add_exception_handler(ServiceOverloadedError, self._error_handler)
+        self.add_exception_handler(ModelNotReadyError, self._error_handler)
+        self.add_exception_handler(CircuitOpenError, self._error_handler)
+        self.add_exception_handler(RateLimitExceededError, self._error_handler)
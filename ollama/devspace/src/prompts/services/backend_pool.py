@@ -0,0 +1,499 @@
+"""
+This module provides load balancing of the Ollama requests across several backends.
+
+Each request is routed to the healthy backend with the fewest outstanding requests;
+ties are broken round robin. Routing only reads cached state: the health of the
+backends is refreshed by periodic probes in a background task, never on the request path.
+
+A backend is ejected when a probe fails, or when its requests fail several times in a
+row. It stays ejected for at least the ejection time, and is re-admitted by the first
+successful probe after that. When every backend is ejected, requests are routed across
+all of them rather than failing outright.
+
+When several models are served, the `ModelScheduler` tracks the models loaded in each
+backend: requests are routed to the backends already holding their model, and wait for a
+model swap when their backend is full.
+
+Requests carrying a conversation ID are routed by the `StickyRouting` instead, so the
+turns of a conversation reuse the prompt cache of the same backend.
+
+Requests answered at once may be hedged: when the selected backend has not answered after
+the hedge delay of the `HedgingPolicy`, the request is also sent to another backend, and
+the first answer wins.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import itertools
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from ..utils.logger import AppLogger
+from ..utils.metrics import LATENCY_BUCKETS
+from .circuit_breaker import is_backend_failure
+from .hedging import HedgingPolicy
+from .model_scheduler import ModelScheduler
+from .ollama_client import Auth, OllamaClient
+from .sticky_routing import CONVERSATION_ID, StickyRouting
+
+BACKEND_OUTSTANDING = Gauge(
+    "ollama_backend_outstanding_requests",
+    "Requests currently sent to an Ollama backend.",
+    ["backend"],
+    multiprocess_mode="livesum",
+)
+BACKEND_HEALTHY = Gauge(
+    "ollama_backend_healthy",
+    "Whether an Ollama backend receives requests (1) or is ejected (0).",
+    ["backend"],
+    multiprocess_mode="liveall",
+)
+BACKEND_REQUEST_DURATION = Histogram(
+    "ollama_backend_request_duration_seconds",
+    "Duration of the successful requests to an Ollama backend.",
+    ["backend"],
+    buckets=LATENCY_BUCKETS,
+)
+BACKEND_EJECTIONS = Counter(
+    "ollama_backend_ejections_total",
+    "Ejections of an Ollama backend.",
+    ["backend"],
+)
+
+# Lightweight Ollama endpoint used by the health probes
+PROBE_PATH = "/api/version"
+
+# Weight of the latest request in the moving average of the backend latency
+LATENCY_SMOOTHING = 0.2
+
+
+class Backend:
+    """
+    An Ollama backend and its routing state.
+
+    Attributes:
+        url (str): The base URL of the backend.
+        outstanding (int): Requests currently sent to the backend.
+        healthy (bool): Whether the backend receives requests.
+        ejected_until (float): Monotonic time before which the backend is not re-admitted.
+        consecutive_failures (int): Failed requests since the last successful one.
+        requests (int): Finished requests.
+        failures (int): Failed requests.
+        latency (Optional[float]): Moving average of the request duration in seconds.
+    """
+
+    def __init__(self, url: str):
+        """
+        Initializes the Backend, healthy until a probe or a request says otherwise.
+
+        Args:
+            url (str): The base URL of the backend.
+        """
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+        self._outstanding = BACKEND_OUTSTANDING.labels(self.url)
+        self._healthy = BACKEND_HEALTHY.labels(self.url)
+        self._duration = BACKEND_REQUEST_DURATION.labels(self.url)
+        self._ejections = BACKEND_EJECTIONS.labels(self.url)
+        self._healthy.set(1)
+
+    def begin(self) -> None:
+        """Count a request sent to the backend."""
+        self.outstanding += 1
+        self._outstanding.inc()
+
+    def eject(self, until: float) -> bool:
+        """
+        Stop routing requests to the backend.
+
+        Args:
+            until (float): Monotonic time before which the backend is not re-admitted.
+
+        Returns:
+            bool: True if the backend was healthy until now.
+        """
+        self.ejected_until = until
+        if not self.healthy:
+            return False
+        self.healthy = False
+        self._healthy.set(0)
+        self._ejections.inc()
+        return True
+
+    def readmit(self) -> None:
+        """Route requests to the backend again."""
+        self.healthy = True
+        self.consecutive_failures = 0
+        self._healthy.set(1)
+
+    def cancel(self) -> None:
+        """
+        Count a request cancelled before it finished, by the client or a hedge.
+
+        Its partial duration says nothing of the backend, so neither the latency nor the
+        failure streak is updated.
+        """
+        self.outstanding -= 1
+        self._outstanding.dec()
+
+    def finish(self, seconds: float, failed: bool) -> None:
+        """
+        Count a finished request.
+
+        Args:
+            seconds (float): The duration of the request.
+            failed (bool): Whether the request failed.
+        """
+        self.outstanding -= 1
+        self._outstanding.dec()
+        self.requests += 1
+        if failed:
+            self.failures += 1
+            self.consecutive_failures += 1
+            return
+
+        self.consecutive_failures = 0
+        self._duration.observe(seconds)
+        self.latency = (
+            seconds
+            if self.latency is None
+            else self.latency + LATENCY_SMOOTHING * (seconds - self.latency)
+        )
+
+
+class BackendPool:
+    """
+    Routes the Ollama requests across backends by least outstanding requests.
+
+    Attributes:
+        backends (List[Backend]): The backends of the pool.
+        probe_interval (float): Seconds between two health probes of the backends.
+        probe_timeout (float): Seconds a health probe may take.
+        failure_threshold (int): Consecutive failed requests that eject a backend.
+        ejection_time (float): Minimum seconds an ejected backend stays ejected.
+        scheduler (Optional[ModelScheduler]): Tracks the models loaded in the backends.
+            The models are ignored when None.
+        sticky_routing (Optional[StickyRouting]): Routes the conversations to the same
+            backend. The conversation IDs are ignored when None.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        client: OllamaClient,
+        probe_interval: float,
+        probe_timeout: float,
+        failure_threshold: int,
+        ejection_time: float,
+        scheduler: Optional[ModelScheduler] = None,
+        sticky_routing: Optional[StickyRouting] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes the BackendPool. The health probes are started by `start`.
+
+        Args:
+            urls (List[str]): The base URLs of the backends.
+            client (OllamaClient): The pooled HTTP client used for all the backends.
+            probe_interval (float): Seconds between two health probes of the backends.
+            probe_timeout (float): Seconds a health probe may take.
+            failure_threshold (int): Consecutive failed requests that eject a backend.
+            ejection_time (float): Minimum seconds an ejected backend stays ejected.
+            scheduler (Optional[ModelScheduler]): Tracks the models loaded in the backends.
+            sticky_routing (Optional[StickyRouting]): Routes the conversations to the same
+                backend.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+
+        Raises:
+            ValueError: If no backend URL is given.
+        """
+        if not urls:
+            raise ValueError("At least one Ollama backend URL is required.")
+        self.backends = [Backend(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.scheduler = scheduler
+        self.sticky_routing = sticky_routing
+        self._client = client
+        self._clock = clock
+        self._turn = itertools.count()
+        self._probe_task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        """Start probing the health of the backends in the background."""
+        self._probe_task = asyncio.create_task(self._probe_periodically())
+
+    async def aclose(self) -> None:
+        """Stop the health probes."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def select(
+        self, exclude: Optional[Backend] = None, model: Optional[str] = None
+    ) -> Backend:
+        """
+        Select the backend for the next request.
+
+        With a scheduler, the cost of loading the model of the request into a backend is
+        added to its outstanding requests. A request with a conversation ID is routed by
+        the sticky routing instead, when there is one.
+
+        Args:
+            exclude (Optional[Backend]): A backend not to select, unless it is the only one.
+            model (Optional[str]): The model of the request.
+
+        Returns:
+            Backend: The healthy backend with the fewest outstanding requests, or the
+                backend with the fewest outstanding requests when none is healthy.
+        """
+        backends = [backend for backend in self.backends if backend is not exclude]
+        if not backends:
+            backends = self.backends
+        candidates = [backend for backend in backends if backend.healthy]
+        if not candidates:
+            candidates = backends
+
+        conversation_id = CONVERSATION_ID.get()
+        if self.sticky_routing is not None and conversation_id:
+            url = self.sticky_routing.select(
+                conversation_id,
+                {backend.url: backend.outstanding for backend in candidates},
+            )
+            return next(backend for backend in candidates if backend.url == url)
+
+        def load(backend: Backend) -> float:
+            if self.scheduler is None or model is None:
+                return backend.outstanding
+            return backend.outstanding + self.scheduler.cost(backend.url, model)
+
+        # Start from a rotating offset, so ties are broken round robin
+        offset = next(self._turn) % len(candidates)
+        selected = candidates[offset]
+        for index in range(1, len(candidates)):
+            backend = candidates[(offset + index) % len(candidates)]
+            if load(backend) < load(selected):
+                selected = backend
+        return selected
+
+    async def stream_lines(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        auth: Optional[Auth] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Post a request to the selected backend and stream the lines of its response.
+
+        Args:
+            path (str): The path of the Ollama endpoint.
+            payload (Dict[str, Any]): The JSON request payload.
+            headers (Optional[Dict[str, str]]): Additional request headers.
+            auth (Optional[Auth]): The authentication of the request.
+
+        Yields:
+            str: The raw JSON lines of the Ollama response.
+        """
+        backend = self.select(model=payload.get("model"))
+        async for line in self._stream_backend(backend, path, payload, headers, auth):
+            yield line
+
+    async def hedged_lines(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        policy: HedgingPolicy,
+        auth: Optional[Auth] = None,
+    ) -> List[str]:
+        """
+        Post a request to the selected backend, hedged to a second backend when it is
+        slow, and return the lines of the first response.
+
+        The request is hedged when the selected backend has not answered after the hedge
+        delay, there is another healthy backend and the hedging budget allows it. The
+        request that loses the race is cancelled, so its backend records neither its
+        partial duration nor an outcome.
+
+        Args:
+            path (str): The path of the Ollama endpoint.
+            payload (Dict[str, Any]): The JSON request payload.
+            headers (Optional[Dict[str, str]]): Additional request headers.
+            policy (HedgingPolicy): When, and whether, the request is hedged.
+            auth (Optional[Auth]): The authentication of the request.
+
+        Returns:
+            List[str]: The raw JSON lines of the first Ollama response.
+
+        Raises:
+            Exception: The error of the last request, if every request fails.
+        """
+
+        async def request(backend: Backend) -> List[str]:
+            return [
+                line
+                async for line in self._stream_backend(
+                    backend, path, payload, headers, auth
+                )
+            ]
+
+        start = time.perf_counter()
+        model = payload.get("model")
+        primary = self.select(model=model)
+        primary_task = asyncio.create_task(request(primary))
+        pending: Set["asyncio.Task[List[str]]"] = {primary_task}
+        hedged = False
+        try:
+            delay = policy.delay()
+            if delay is not None:
+                await asyncio.wait(pending, timeout=delay)
+                secondary = self.select(exclude=primary, model=model)
+                if (
+                    not primary_task.done()
+                    and secondary is not primary
+                    and secondary.healthy
+                    and policy.acquire()
+                ):
+                    pending.add(asyncio.create_task(request(secondary)))
+                    hedged = True
+
+            # The first successful request wins, a failed one leaves the race to the other
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    policy.record(time.perf_counter() - start)
+                    if hedged:
+                        policy.record_winner(hedge=winner is not primary_task)
+                    return winner.result()
+                if not pending:
+                    raise done.pop().exception()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _stream_backend(
+        self,
+        backend: Backend,
+        path: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        auth: Optional[Auth] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Post a request to a backend and stream the lines of its response, once the
+        scheduler admits it.
+
+        Args:
+            backend (Backend): The backend.
+            path (str): The path of the Ollama endpoint.
+            payload (Dict[str, Any]): The JSON request payload.
+            headers (Optional[Dict[str, str]]): Additional request headers.
+            auth (Optional[Auth]): The authentication of the request.
+
+        Yields:
+            str: The raw JSON lines of the Ollama response.
+        """
+        scheduler = self.scheduler
+        model = payload.get("model")
+        admitted = False
+        backend.begin()
+        start = time.perf_counter()
+        # The request either completes, fails, or is cancelled while neither happened. An
+        # error of the request itself, such as an unknown model, completes it: only the
+        # transport errors, timeouts and 5xx responses are failures of the backend
+        completed = False
+        failed = False
+        try:
+            swapped = False
+            if scheduler is not None and model:
+                swapped = await scheduler.admit(backend.url, model)
+                admitted = True
+            admitted_at = time.perf_counter()
+            async for line in self._client.stream_lines(
+                backend.url + path, payload, headers, auth
+            ):
+                if swapped:
+                    scheduler.record_swap(model, time.perf_counter() - admitted_at)
+                    swapped = False
+                yield line
+            completed = True
+        except Exception as exc:
+            failed = is_backend_failure(exc)
+            completed = not failed
+            raise
+        finally:
+            if admitted:
+                scheduler.release(backend.url, model)
+            if completed or failed:
+                backend.finish(time.perf_counter() - start, failed)
+            else:
+                backend.cancel()
+            if failed and backend.consecutive_failures >= self.failure_threshold:
+                self._eject(
+                    backend, f"{backend.consecutive_failures} consecutive failures"
+                )
+
+    async def probe(self) -> None:
+        """Probe the health of every backend."""
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe_periodically(self) -> None:
+        """Probe the health of the backends every probe interval."""
+        while True:
+            try:
+                await self.probe()
+            except Exception:
+                # A failed round of probes must not stop the next ones
+                AppLogger.exception("Failed to probe the health of the Ollama backends")
+            await asyncio.sleep(self.probe_interval)
+
+    async def _probe(self, backend: Backend) -> None:
+        """
+        Probe the health of a backend, ejecting or re-admitting it.
+
+        Args:
+            backend (Backend): The backend to probe.
+        """
+        try:
+            await self._client.get_json(backend.url + PROBE_PATH, self.probe_timeout)
+        except Exception as exc:
+            self._eject(backend, f"health probe failed: {exc!r}")
+            return
+
+        if not backend.healthy and self._clock() >= backend.ejected_until:
+            backend.readmit()
+            AppLogger.info("Re-admitted Ollama backend %s", backend.url)
+
+    def _eject(self, backend: Backend, reason: str) -> None:
+        """
+        Stop routing requests to a backend for at least the ejection time.
+
+        Args:
+            backend (Backend): The backend to eject.
+            reason (str): Why the backend is ejected.
+        """
+        if backend.eject(self._clock() + self.ejection_time):
+            AppLogger.warning("Ejected Ollama backend %s: %s", backend.url, reason)
@@ -0,0 +1,227 @@
+"""
+This module provides a circuit breaker around the Ollama generations.
+
+When Ollama is down, every request would otherwise wait for its connect or read timeout
+and fail on its own. The breaker counts the consecutive failed generations and, at the
+threshold, opens: requests are then rejected at once with `CircuitOpenError`, a 503 with
+a Retry-After header, without calling Ollama. After the reset timeout the breaker is
+half-open and lets a few trial generations through. A successful trial closes it, a
+failed one opens it again.
+
+Only the failures of the backend count: transport errors, timeouts and 5xx responses.
+Client errors and cancelled requests neither open nor close the breaker.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import math
+import time
+from typing import Callable, Optional
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from ..exceptions.custom_exceptions import CircuitOpenError, OllamaStatusError
+from ..utils.logger import AppLogger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Values of the state gauge
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+CIRCUIT_BREAKER_STATE = Gauge(
+    "ollama_circuit_breaker_state",
+    "State of the Ollama circuit breaker: closed (0), open (1) or half-open (2).",
+    ["model"],
+    multiprocess_mode="liveall",
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "ollama_circuit_breaker_transitions_total",
+    "Transitions of the Ollama circuit breaker, by the state entered.",
+    ["model", "state"],
+)
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "ollama_circuit_breaker_rejections_total",
+    "Requests rejected without calling Ollama because the circuit breaker is open.",
+    ["model"],
+)
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """
+    Whether an error of a generation is a failure of the Ollama backend.
+
+    Args:
+        exc (BaseException): The error raised by the generation.
+
+    Returns:
+        bool: True for transport errors, timeouts and 5xx responses.
+    """
+    if isinstance(exc, OllamaStatusError):
+        return exc.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Fails the Ollama generations fast while the backend is failing.
+
+    Attributes:
+        model (str): The model of the generations, the label of the metrics.
+        failure_threshold (int): Consecutive failed generations that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before the trial generations.
+        half_open_max_calls (int): Trial generations allowed at once while half-open.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_max_calls: int = 1,
+        is_failure: Callable[[BaseException], bool] = is_backend_failure,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes the CircuitBreaker, closed.
+
+        Args:
+            model (str): The model of the generations, the label of the metrics.
+            failure_threshold (int): Consecutive failed generations that open the breaker.
+            reset_timeout (float): Seconds the breaker stays open before the trial
+                generations.
+            half_open_max_calls (int): Trial generations allowed at once while half-open.
+            is_failure (Callable[[BaseException], bool]): Whether an error of a generation
+                counts as a failure of the backend.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._is_failure = is_failure
+        self._clock = clock
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._state_gauge = CIRCUIT_BREAKER_STATE.labels(model)
+        self._rejections = CIRCUIT_BREAKER_REJECTIONS.labels(model)
+        self._state_gauge.set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        """The state of the breaker, half-open once the reset timeout of an open breaker expires."""
+        if (
+            self._state == OPEN
+            and self._clock() >= self._opened_at + self.reset_timeout
+        ):
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def retry_after(self) -> int:
+        """
+        Seconds after which a rejected client may retry.
+
+        Returns:
+            int: The seconds left before the trial generations, at least 1.
+        """
+        remaining = self._opened_at + self.reset_timeout - self._clock()
+        return max(1, math.ceil(remaining))
+
+    def check(self) -> None:
+        """
+        Reject a request while the breaker is open, without taking a trial slot.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        if self.state == OPEN:
+            self._reject()
+
+    def acquire(self) -> bool:
+        """
+        Admit a generation, as a trial generation while the breaker is half-open.
+
+        Every admitted generation must be followed by `record`.
+
+        Returns:
+            bool: True if the generation is a trial generation.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or all the trial slots are taken.
+        """
+        state = self.state
+        if state == OPEN:
+            self._reject()
+        if state != HALF_OPEN:
+            return False
+        if self._trials >= self.half_open_max_calls:
+            self._reject()
+        self._trials += 1
+        return True
+
+    def record(self, exc: Optional[BaseException] = None, trial: bool = False) -> None:
+        """
+        Record the outcome of an admitted generation.
+
+        Args:
+            exc (Optional[BaseException]): The error raised by the generation, None if it
+                succeeded.
+            trial (bool): Whether the generation was admitted as a trial generation.
+        """
+        if trial and self._state == HALF_OPEN and self._trials:
+            self._trials -= 1
+
+        if exc is None:
+            self._consecutive_failures = 0
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED)
+                AppLogger.info("Closed the Ollama circuit breaker of %s", self.model)
+            return
+        if not self._is_failure(exc):
+            return
+
+        self._consecutive_failures += 1
+        if self._state == HALF_OPEN or (
+            self._state == CLOSED
+            and self._consecutive_failures >= self.failure_threshold
+        ):
+            self._opened_at = self._clock()
+            self._transition(OPEN)
+            AppLogger.warning(
+                "Opened the Ollama circuit breaker of %s for %.0fs after %d failures: %r",
+                self.model,
+                self.reset_timeout,
+                self._consecutive_failures,
+                exc,
+            )
+
+    def _transition(self, state: str) -> None:
+        """
+        Enter a state.
+
+        Args:
+            state (str): The state entered.
+        """
+        self._state = state
+        self._trials = 0
+        self._state_gauge.set(STATE_VALUES[state])
+        CIRCUIT_BREAKER_TRANSITIONS.labels(self.model, state).inc()
+
+    def _reject(self) -> None:
+        """
+        Reject a request.
+
+        Raises:
+            CircuitOpenError: Always.
+        """
+        self._rejections.inc()
+        raise CircuitOpenError(
+            retry_after=self.retry_after(),
+            description=f"Ollama is unavailable for model {self.model}, retry later",
+        )
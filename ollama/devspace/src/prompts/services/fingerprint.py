@@ -0,0 +1,88 @@
+"""
+This module provides the fingerprint of an Ollama generation request.
+
+Two requests with the same fingerprint ask the same model for a generation of the
+same normalized messages with the same generation parameters. When the sampling is
+deterministic, they produce the same response and can share it.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Mapping
+
+# Request parameters that do not change the generated response
+NON_GENERATION_PARAMS = frozenset({"keep_alive"})
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Normalize Ollama chat messages for fingerprinting.
+
+    Line endings are unified and surrounding whitespace is stripped from the content.
+
+    Args:
+        messages (List[Dict[str, Any]]): The Ollama chat messages.
+
+    Returns:
+        List[Dict[str, Any]]: The normalized messages.
+    """
+    normalized = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            content = content.replace("\r\n", "\n").strip()
+        normalized.append({**message, "content": content})
+    return normalized
+
+
+def is_deterministic(params: Mapping[str, Any]) -> bool:
+    """
+    Check whether the generation parameters select deterministic sampling.
+
+    Args:
+        params (Mapping[str, Any]): The Ollama request parameters.
+
+    Returns:
+        bool: True if the temperature is zero.
+    """
+    options = params.get("options") or {}
+    return options.get("temperature") == 0
+
+
+def generation_fingerprint(
+    model: str, messages: List[Dict[str, Any]], params: Mapping[str, Any]
+) -> str:
+    """
+    Compute the fingerprint of a generation request.
+
+    Args:
+        model (str): The model name.
+        messages (List[Dict[str, Any]]): The Ollama chat messages.
+        params (Mapping[str, Any]): The Ollama request parameters.
+
+    Returns:
+        str: The hex digest identifying the request.
+    """
+    generation_params = {
+        key: value
+        for key, value in params.items()
+        if key not in NON_GENERATION_PARAMS and value is not None
+    }
+    options = generation_params.get("options")
+    if isinstance(options, dict):
+        generation_params["options"] = {
+            key: value for key, value in options.items() if value is not None
+        }
+    generation_params["model"] = model
+
+    document = json.dumps(
+        {"params": generation_params, "messages": normalize_messages(messages)},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
@@ -0,0 +1,140 @@
+"""
+This module provides the policy of the hedged Ollama requests.
+
+A slow generation never errors, so retries do not help the tail latency: it is set by
+whichever backend is the busiest. A hedged request is sent to a second backend when the
+first one has not answered after the hedge delay, the first answer wins and the other
+request is cancelled. The delay is a high percentile of the recent response times, so
+only the slowest requests are hedged, and a budget caps the share of the requests that
+may be hedged, so hedging cannot add more than that share of load to the backends.
+
+Only invoke requests are hedged: they are answered at once, whereas a duplicate of a
+streamed request could not replace the tokens already sent. The invoke requests are
+marked by the per request config of the routes, with `HEDGE_REQUEST`.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import math
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Optional
+
+from prometheus_client import Counter, Gauge
+
+HEDGED_REQUESTS = Counter(
+    "ollama_hedged_requests_total",
+    "Ollama requests that were slower than the hedge delay, by outcome: won by the "
+    "primary or the hedge request, or not hedged because the budget was exhausted.",
+    ["model", "outcome"],
+)
+HEDGE_DELAY = Gauge(
+    "ollama_hedge_delay_seconds",
+    "Seconds after which a slow Ollama request is hedged.",
+    ["model"],
+    multiprocess_mode="liveall",
+)
+
+# Whether the request of the current context may be hedged
+HEDGE_REQUEST: ContextVar[bool] = ContextVar("hedge_request", default=False)
+
+
+class HedgingPolicy:
+    """
+    Decides when, and whether, a slow Ollama request is hedged.
+
+    Attributes:
+        model (str): The model of the requests, the label of the metrics.
+        percentile (float): Percentile of the recent response times used as hedge delay.
+        min_delay (float): The shortest hedge delay, in seconds.
+        min_samples (int): Response times needed before requests are hedged.
+        budget (float): Share of the requests that may be hedged.
+        max_tokens (float): Hedges the budget may save up while requests are fast.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        percentile: float,
+        min_delay: float,
+        min_samples: int,
+        window: int,
+        budget: float,
+        max_tokens: float = 10,
+    ):
+        """
+        Initializes the HedgingPolicy, with an empty budget.
+
+        Args:
+            model (str): The model of the requests, the label of the metrics.
+            percentile (float): Percentile of the recent response times used as hedge delay.
+            min_delay (float): The shortest hedge delay, in seconds.
+            min_samples (int): Response times needed before requests are hedged.
+            window (int): Number of recent response times the percentile is computed on.
+            budget (float): Share of the requests that may be hedged.
+            max_tokens (float): Hedges the budget may save up while requests are fast.
+        """
+        self.model = model
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.max_tokens = max_tokens
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+        self._delay: Optional[float] = None
+        self._delay_gauge = HEDGE_DELAY.labels(model)
+        self._outcomes = {
+            outcome: HEDGED_REQUESTS.labels(model, outcome)
+            for outcome in ("primary", "hedge", "budget_exhausted")
+        }
+
+    def delay(self) -> Optional[float]:
+        """
+        The delay after which a request is hedged, and count it against the budget.
+
+        Returns:
+            Optional[float]: Seconds after which the request is hedged, or None if there
+                are not enough response times yet.
+        """
+        self._tokens = min(self.max_tokens, self._tokens + self.budget)
+        if self._delay is None and len(self._samples) >= self.min_samples:
+            ordered = sorted(self._samples)
+            rank = math.ceil(self.percentile / 100 * len(ordered)) - 1
+            self._delay = max(self.min_delay, ordered[max(0, rank)])
+            self._delay_gauge.set(self._delay)
+        return self._delay
+
+    def acquire(self) -> bool:
+        """
+        Take a hedge from the budget.
+
+        Returns:
+            bool: True if the request may be hedged.
+        """
+        if self._tokens < 1:
+            self._outcomes["budget_exhausted"].inc()
+            return False
+        self._tokens -= 1
+        return True
+
+    def record(self, seconds: float) -> None:
+        """
+        Record the response time of a successful request.
+
+        Args:
+            seconds (float): Seconds until the request was answered.
+        """
+        self._samples.append(seconds)
+        self._delay = None
+
+    def record_winner(self, hedge: bool) -> None:
+        """
+        Count which request of a hedged pair answered first.
+
+        Args:
+            hedge (bool): Whether the hedge request answered first.
+        """
+        self._outcomes["hedge" if hedge else "primary"].inc()
@@ -0,0 +1,349 @@
+"""
+This module schedules the requests of several models on the Ollama backends.
+
+An Ollama backend keeps a few models loaded at once. A request for another model first
+unloads one of them and loads its own, which takes seconds, and requests alternating
+between two models on the same backend pay it every time. The scheduler tracks the models
+resident in each backend, from the requests it admits and from the running models listed
+by the backends, so the backend pool routes a request to a backend already holding its
+model, unless that backend is much busier than the others.
+
+When a backend must load a model while it is full, the requests of that model wait until
+one of the resident models is idle, and are then admitted together, so the swap is paid
+once for all of them. The requests wait in the order of their models: the requests of the
+resident model that will be unloaded wait as well, so a swap is not postponed forever by a
+steady stream of requests.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from ..utils.logger import AppLogger
+
+MODEL_SWAPS = Counter(
+    "ollama_model_swaps_total",
+    "Models loaded into an Ollama backend by a request, unloading another model first "
+    "when the backend is full.",
+    ["backend", "model"],
+)
+MODEL_SWAP_DURATION = Histogram(
+    "ollama_model_swap_seconds",
+    "Seconds from the admission of a request that loads its model into an Ollama backend "
+    "to its first response line.",
+    ["model"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+SCHEDULER_WAITING = Gauge(
+    "ollama_scheduler_waiting_requests",
+    "Requests waiting for their model to be loaded into an Ollama backend.",
+    ["backend"],
+    multiprocess_mode="livesum",
+)
+
+
+def canonical_model(model: str) -> str:
+    """
+    The name Ollama lists a model under.
+
+    Args:
+        model (str): The model name, with or without a tag.
+
+    Returns:
+        str: The model name, with the implicit "latest" tag if it has none.
+    """
+    return model if ":" in model else f"{model}:latest"
+
+
+class _Node:
+    """
+    The models of a backend.
+
+    Attributes:
+        resident (OrderedDict[str, None]): The loaded models, least recently used first.
+        active (Dict[str, int]): The admitted requests by model.
+        waiting (OrderedDict[str, List[asyncio.Future]]): The waiting requests by model,
+            in the order of the first request of each model.
+    """
+
+    def __init__(self, url: str):
+        """
+        Initializes the _Node, without any loaded model.
+
+        Args:
+            url (str): The base URL of the backend.
+        """
+        self.resident: "OrderedDict[str, None]" = OrderedDict()
+        self.active: Dict[str, int] = {}
+        self.waiting: "OrderedDict[str, List[asyncio.Future[bool]]]" = OrderedDict()
+        self.waiting_gauge = SCHEDULER_WAITING.labels(url)
+
+
+class ModelScheduler:
+    """
+    Tracks the models resident in the Ollama backends and batches the model swaps.
+
+    Attributes:
+        max_loaded_models (int): Models a backend keeps loaded at once.
+        load_cost (float): Outstanding requests a backend holding the model may have in
+            excess of a backend that must load it, before the latter is preferred. A
+            backend that must unload a model first costs twice as much.
+    """
+
+    def __init__(self, max_loaded_models: int, load_cost: float):
+        """
+        Initializes the ModelScheduler.
+
+        Args:
+            max_loaded_models (int): Models a backend keeps loaded at once.
+            load_cost (float): Outstanding requests a backend holding the model may have in
+                excess of a backend that must load it, before the latter is preferred.
+        """
+        self.max_loaded_models = max(1, max_loaded_models)
+        self.load_cost = load_cost
+        self._nodes: Dict[str, _Node] = {}
+
+    def resident(self, backend: str) -> List[str]:
+        """
+        The models resident in a backend.
+
+        Args:
+            backend (str): The base URL of the backend.
+
+        Returns:
+            List[str]: The loaded models, least recently used first.
+        """
+        return list(self._node(backend).resident)
+
+    def cost(self, backend: str, model: str) -> float:
+        """
+        The cost of routing a request to a backend, in outstanding requests.
+
+        Args:
+            backend (str): The base URL of the backend.
+            model (str): The model of the request.
+
+        Returns:
+            float: 0 if the model is loaded, the load cost if the backend has room for it,
+                twice the load cost if the backend must unload another model first.
+        """
+        node = self._node(backend)
+        if canonical_model(model) in node.resident:
+            return 0
+        if len(node.resident) < self.max_loaded_models:
+            return self.load_cost
+        return 2 * self.load_cost
+
+    async def admit(self, backend: str, model: str) -> bool:
+        """
+        Wait until a backend may serve a request, with its model loaded.
+
+        Every admitted request must be followed by `release`.
+
+        Args:
+            backend (str): The base URL of the backend.
+            model (str): The model of the request.
+
+        Returns:
+            bool: True if the request loads its model into the backend.
+        """
+        node = self._node(backend)
+        model = canonical_model(model)
+        if not node.waiting and (
+            model in node.resident or len(node.resident) < self.max_loaded_models
+        ):
+            return self._start(backend, node, model, 1)
+        if model in node.resident and model != next(iter(node.resident)):
+            # Not the least recently used model, the next one unloaded
+            return self._start(backend, node, model, 1)
+
+        future: "asyncio.Future[bool]" = asyncio.get_running_loop().create_future()
+        node.waiting.setdefault(model, []).append(future)
+        node.waiting_gauge.inc()
+        self._drain(backend, node)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self._forget(backend, node, model, future)
+            else:
+                self.release(backend, model)
+            raise
+
+    def try_admit(self, backend: str, model: str) -> Optional[bool]:
+        """
+        Admit a request only if it may be served right away, without waiting.
+
+        An admitted request must be followed by `release`.
+
+        Args:
+            backend (str): The base URL of the backend.
+            model (str): The model of the request.
+
+        Returns:
+            Optional[bool]: True if the request loads its model into the backend, False if
+                the model is loaded, or None if the request was not admitted.
+        """
+        node = self._node(backend)
+        model = canonical_model(model)
+        if node.waiting:
+            return None
+        if (
+            model not in node.resident
+            and len(node.resident) >= self.max_loaded_models
+            and all(name in node.active for name in node.resident)
+        ):
+            return None
+        return self._start(backend, node, model, 1)
+
+    def release(self, backend: str, model: str) -> None:
+        """
+        Release a request admitted by `admit`, and admit the waiting requests it unblocks.
+
+        Args:
+            backend (str): The base URL of the backend.
+            model (str): The model of the request.
+        """
+        node = self._node(backend)
+        model = canonical_model(model)
+        node.active[model] -= 1
+        if not node.active[model]:
+            del node.active[model]
+            self._drain(backend, node)
+
+    def observe(self, backend: str, models: Iterable[str]) -> None:
+        """
+        Synchronize the models resident in a backend with the models it lists as running.
+
+        The models of the admitted requests stay resident, they may still be loading.
+
+        Args:
+            backend (str): The base URL of the backend.
+            models (Iterable[str]): The running models listed by the backend.
+        """
+        node = self._node(backend)
+        running = {canonical_model(model) for model in models}
+        for model in list(node.resident):
+            if model not in running and model not in node.active:
+                del node.resident[model]
+        for model in sorted(running - set(node.resident)):
+            node.resident[model] = None
+            node.resident.move_to_end(model, last=False)
+        self._drain(backend, node)
+
+    def record_swap(self, model: str, seconds: float) -> None:
+        """
+        Record the latency of a request that loaded its model.
+
+        Args:
+            model (str): The model of the request.
+            seconds (float): Seconds from its admission to its first response line.
+        """
+        MODEL_SWAP_DURATION.labels(canonical_model(model)).observe(seconds)
+
+    def _node(self, backend: str) -> _Node:
+        """
+        The models of a backend.
+
+        Args:
+            backend (str): The base URL of the backend.
+
+        Returns:
+            _Node: The models of the backend.
+        """
+        node = self._nodes.get(backend)
+        if node is None:
+            node = self._nodes[backend] = _Node(backend)
+        return node
+
+    def _start(self, backend: str, node: _Node, model: str, requests: int) -> bool:
+        """
+        Admit requests of a model, loading the model if it is not resident.
+
+        The backend must have room for the model, or an idle model to unload.
+
+        Args:
+            backend (str): The base URL of the backend.
+            node (_Node): The models of the backend.
+            model (str): The model of the requests.
+            requests (int): The number of requests.
+
+        Returns:
+            bool: True if the model is loaded by the requests.
+        """
+        loaded = model not in node.resident
+        if loaded:
+            if len(node.resident) >= self.max_loaded_models:
+                unloaded = next(
+                    name for name in node.resident if name not in node.active
+                )
+                del node.resident[unloaded]
+                AppLogger.debug(
+                    "Swapping %s for %s on Ollama backend %s",
+                    unloaded,
+                    model,
+                    backend,
+                )
+            MODEL_SWAPS.labels(backend, model).inc()
+        node.resident[model] = None
+        node.resident.move_to_end(model)
+        node.active[model] = node.active.get(model, 0) + requests
+        return loaded
+
+    def _drain(self, backend: str, node: _Node) -> None:
+        """
+        Admit the waiting requests, all the requests of a model at once, in order.
+
+        Args:
+            backend (str): The base URL of the backend.
+            node (_Node): The models of the backend.
+        """
+        while node.waiting:
+            model, futures = next(iter(node.waiting.items()))
+            futures = [future for future in futures if not future.cancelled()]
+            full = len(node.resident) >= self.max_loaded_models
+            if (
+                model not in node.resident
+                and full
+                and all(name in node.active for name in node.resident)
+            ):
+                break
+
+            node.waiting_gauge.dec(len(node.waiting.pop(model)))
+            if not futures:
+                continue
+            loaded = self._start(backend, node, model, len(futures))
+            for index, future in enumerate(futures):
+                # The latency of the swap is recorded once
+                future.set_result(loaded and not index)
+
+    def _forget(
+        self,
+        backend: str,
+        node: _Node,
+        model: str,
+        future: "asyncio.Future[bool]",
+    ) -> None:
+        """
+        Remove a cancelled request from the waiting requests.
+
+        Args:
+            backend (str): The base URL of the backend.
+            node (_Node): The models of the backend.
+            model (str): The model of the request.
+            future (asyncio.Future[bool]): The future of the request.
+        """
+        futures = node.waiting.get(model)
+        if futures is None or future not in futures:
+            return
+        futures.remove(future)
+        node.waiting_gauge.dec()
+        if not futures:
+            del node.waiting[model]
+            self._drain(backend, node)
@@ -0,0 +1,232 @@
+"""
+This module keeps the models loaded in the memory of the Ollama backends.
+
+A background task lists the running models of each backend with "/api/ps" every check
+interval. A model that is not loaded is preloaded, with an empty generate request, so
+the cold load is paid by the warm-up instead of the first user request after a restart
+or an eviction. A loaded model whose keep-alive expires within the refresh margin, which
+only happens when the traffic is low, since every request extends it, is preloaded
+again to refresh its keep-alive. The running models are also reported to the model
+scheduler of the backend pool, if any.
+
+A backend only keeps a few models loaded at once, so at most that many models are kept
+loaded, and the warm-ups go through the admission of the model scheduler: a model is not
+loaded while the models it would unload serve requests, so the warm-ups never swap the
+models out from under the traffic.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+from ..utils.logger import AppLogger
+from .backend_pool import Backend, BackendPool
+from .ollama_client import OllamaClient
+from .readiness import RUNNING_MODELS_PATH, model_names
+
+MODEL_LOAD_DURATION = Histogram(
+    "ollama_model_load_seconds",
+    "Duration of the warm-ups that loaded a model into an Ollama backend.",
+    ["model"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+MODEL_WARMUPS = Counter(
+    "ollama_model_warmups_total",
+    "Warm-up requests sent to the Ollama backends, by reason and result.",
+    ["model", "reason", "result"],
+)
+
+# Ollama endpoint loading a model when called without a prompt
+GENERATE_PATH = "/api/generate"
+
+# Fractional seconds beyond microseconds, which `datetime.fromisoformat` may not parse
+_EXTRA_DIGITS = re.compile(r"(\.\d{6})\d+")
+
+
+def parse_expiry(expires_at: Optional[str]) -> Optional[float]:
+    """
+    Parse the keep-alive expiry of a running model.
+
+    Args:
+        expires_at (Optional[str]): The ISO 8601 expiry listed by "/api/ps".
+
+    Returns:
+        Optional[float]: The expiry as a Unix timestamp, or None if it cannot be parsed.
+    """
+    if not expires_at:
+        return None
+    try:
+        return datetime.fromisoformat(_EXTRA_DIGITS.sub(r"\1", expires_at)).timestamp()
+    except ValueError:
+        return None
+
+
+class ModelWarmer:
+    """
+    Preloads the models into the Ollama backends and refreshes their keep-alive.
+
+    Attributes:
+        models (List[str]): The models kept loaded.
+        keep_alive (float): Seconds a backend keeps a model loaded after its last request.
+        refresh_margin (float): Seconds before the keep-alive expiry the model is refreshed.
+        check_interval (float): Seconds between two checks of the running models.
+        timeout (float): Seconds a check of the running models may take.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        backend_pool: BackendPool,
+        client: OllamaClient,
+        keep_alive: float,
+        refresh_margin: float,
+        check_interval: float,
+        timeout: float,
+        max_loaded_models: int,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        """
+        Initializes the ModelWarmer. The warm-ups are started by `start`.
+
+        Args:
+            models (List[str]): The models kept loaded.
+            backend_pool (BackendPool): The Ollama backends.
+            client (OllamaClient): The pooled HTTP client used for the warm-ups.
+            keep_alive (float): Seconds a backend keeps a model loaded after its last request.
+            refresh_margin (float): Seconds before the keep-alive expiry the model is refreshed.
+            check_interval (float): Seconds between two checks of the running models.
+            timeout (float): Seconds a check of the running models may take.
+            max_loaded_models (int): Models a backend keeps loaded at once, only that
+                many of the models are kept loaded.
+            wall_clock (Callable[[], float]): Unix time, in seconds.
+        """
+        self.models = list(dict.fromkeys(models))
+        max_loaded_models = max(1, max_loaded_models)
+        if len(self.models) > max_loaded_models:
+            self.models = self.models[:max_loaded_models]
+            AppLogger.warning(
+                "Only keeping %s loaded, an Ollama backend keeps %d models loaded at once",
+                ", ".join(self.models),
+                max_loaded_models,
+            )
+        self.keep_alive = keep_alive
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self._backend_pool = backend_pool
+        self._client = client
+        self._wall_clock = wall_clock
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        """Start warming the models up in the background."""
+        self._task = asyncio.create_task(self._warm_periodically())
+
+    async def aclose(self) -> None:
+        """Stop the warm-ups."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self) -> None:
+        """Warm up the models that are not loaded, or about to expire, in every backend."""
+        await asyncio.gather(
+            *(self._check_backend(backend) for backend in self._backend_pool.backends)
+        )
+
+    async def _warm_periodically(self) -> None:
+        """Check the running models every check interval."""
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    async def _check_backend(self, backend: Backend) -> None:
+        """
+        Warm up the models that are not loaded, or about to expire, in a backend.
+
+        Args:
+            backend (Backend): The backend.
+        """
+        try:
+            running = await self._client.get_json(
+                backend.url + RUNNING_MODELS_PATH, self.timeout
+            )
+        except Exception as exc:
+            AppLogger.debug(
+                "Skipped the warm-up of Ollama backend %s: %r", backend.url, exc
+            )
+            return
+
+        expiries: Dict[str, Optional[float]] = {}
+        for model in running.get("models", []):
+            for name in (model.get("name"), model.get("model")):
+                if name:
+                    expiries[name] = parse_expiry(model.get("expires_at"))
+        if self._backend_pool.scheduler is not None:
+            self._backend_pool.scheduler.observe(backend.url, expiries)
+
+        now = self._wall_clock()
+        for model in self.models:
+            loaded = [name for name in model_names(model) if name in expiries]
+            if not loaded:
+                await self._warm(backend, model, "cold")
+                continue
+            expiry = expiries[loaded[0]]
+            if expiry is not None and expiry - now <= self.refresh_margin:
+                await self._warm(backend, model, "refresh")
+
+    async def _warm(self, backend: Backend, model: str, reason: str) -> None:
+        """
+        Load a model into a backend, or refresh its keep-alive.
+
+        Args:
+            backend (Backend): The backend.
+            model (str): The model.
+            reason (str): Either "cold" if the model is not loaded, or "refresh".
+        """
+        scheduler = self._backend_pool.scheduler
+        if scheduler is not None and scheduler.try_admit(backend.url, model) is None:
+            MODEL_WARMUPS.labels(model, reason, "skipped").inc()
+            AppLogger.debug(
+                "Skipped the warm-up of %s on busy Ollama backend %s",
+                model,
+                backend.url,
+            )
+            return
+
+        payload: Dict[str, Any] = {"model": model, "keep_alive": int(self.keep_alive)}
+        start = time.perf_counter()
+        try:
+            async for _ in self._client.stream_lines(
+                backend.url + GENERATE_PATH, payload
+            ):
+                pass
+        except Exception as exc:
+            MODEL_WARMUPS.labels(model, reason, "error").inc()
+            AppLogger.warning(
+                "Failed to warm up %s on Ollama backend %s: %r", model, backend.url, exc
+            )
+            return
+        finally:
+            if scheduler is not None:
+                scheduler.release(backend.url, model)
+
+        seconds = time.perf_counter() - start
+        MODEL_WARMUPS.labels(model, reason, "success").inc()
+        if reason == "cold":
+            MODEL_LOAD_DURATION.labels(model).observe(seconds)
+            AppLogger.info(
+                "Loaded %s on Ollama backend %s in %.1fs", model, backend.url, seconds
+            )
@@ -0,0 +1,527 @@
+"""
+This module provides the ChatOllama model used by the "/ollama" routes.
+
+`KubertChatOllama` extends the LangChain `ChatOllama` model. All generations, whether
+invoked, batched or streamed, read the Ollama response lines through `_acreate_stream`,
+which is where the service hooks in its instrumentation and coalesces identical concurrent
+deterministic requests into a single Ollama generation, and where requests are sent
+through the shared pooled HTTP client, balanced across the Ollama backends, behind the
+circuit breaker. Invoked generations may be hedged across the backends. Invoked and
+batched generations go through `_agenerate`, which answers deterministic requests from the
+response cache. Both `_agenerate` and `_astream` answer the deterministic requests similar
+to an earlier one from the semantic cache, when enabled. Streamed generations go through `_astream`,
+which coalesces the tokens into fewer chunks when the request asks for it.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from langchain_community.chat_models import ChatOllama
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from ..utils.metrics import ModelMetrics
+from ..utils.rate_limit import record_generated_tokens
+from .backend_pool import BackendPool
+from .circuit_breaker import CircuitBreaker
+from .fingerprint import generation_fingerprint, is_deterministic
+from .hedging import HEDGE_REQUEST, HedgingPolicy
+from .ollama_client import Auth, OllamaClient
+from .response_cache import ResponseCache
+from .semantic_cache import SemanticCache, SemanticLookup
+from .single_flight import SingleFlight
+from .stream_coalescing import COALESCING_WINDOW, coalesce
+
+
+class KubertChatOllama(ChatOllama):
+    """
+    ChatOllama model with time-to-first-token, generation speed and error metrics.
+
+    Attributes:
+        response_cache (Optional[ResponseCache]): Cache for the responses of deterministic
+            invoke and batch requests. Caching is disabled when None.
+        single_flight (Optional[SingleFlight]): Coalesces identical concurrent deterministic
+            requests into one Ollama generation. Coalescing is disabled when None.
+        ollama_client (Optional[OllamaClient]): Pooled HTTP client for the Ollama requests.
+            When None, every request opens its own connection, as in `ChatOllama`.
+        backend_pool (Optional[BackendPool]): Balances the Ollama requests across several
+            backends. When None, requests are sent to `base_url` with `ollama_client`.
+        circuit_breaker (Optional[CircuitBreaker]): Fails the generations fast while Ollama
+            is failing. Disabled when None.
+        hedging (Optional[HedgingPolicy]): Hedges the slow invoke requests to a second
+            backend of the backend pool. Disabled when None.
+        semantic_cache (Optional[SemanticCache]): Cache for the responses of requests
+            whose last user message is similar to a cached one. Disabled when None.
+    """
+
+    response_cache: Optional[ResponseCache] = None
+    single_flight: Optional[SingleFlight] = None
+    ollama_client: Optional[OllamaClient] = None
+    backend_pool: Optional[BackendPool] = None
+    circuit_breaker: Optional[CircuitBreaker] = None
+    hedging: Optional[HedgingPolicy] = None
+    semantic_cache: Optional[SemanticCache] = None
+
+    def _request_params(
+        self, stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        Build the parameters of an Ollama request, the same way `ChatOllama` does.
+
+        Args:
+            stop (Optional[List[str]]): Stop words.
+            **kwargs: Additional Ollama parameters.
+
+        Returns:
+            Dict[str, Any]: The request parameters, including the sampling options.
+
+        Raises:
+            ValueError: If stop words are set both on the model and in the call.
+        """
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+        return params
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """
+        Generate a chat response, answering deterministic requests from the response cache,
+        or from the semantic cache when they are similar to an earlier one.
+
+        Args:
+            messages (List[BaseMessage]): The chat messages.
+            stop (Optional[List[str]]): Stop words.
+            run_manager (Optional[AsyncCallbackManagerForLLMRun]): The callback manager.
+            **kwargs: Additional Ollama parameters.
+
+        Returns:
+            ChatResult: The generated response.
+        """
+        params = self._request_params(stop, **kwargs)
+        key = None
+        if self.response_cache is not None and is_deterministic(params):
+            key = generation_fingerprint(
+                self.model, self._convert_messages_to_ollama_messages(messages), params
+            )
+            cached = await self.response_cache.get(key)
+            if cached is not None:
+                return _chat_result(cached)
+
+        lookup = await self._semantic_lookup(messages, params)
+        if lookup is not None and lookup.response is not None:
+            return _chat_result(lookup.response)
+
+        result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        generation = result.generations[0]
+        response = {
+            "text": generation.text,
+            "generation_info": generation.generation_info,
+        }
+        if key is not None:
+            await self.response_cache.set(key, response)
+        if lookup is not None:
+            self.semantic_cache.set(lookup, response)
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """
+        Stream a chat response, coalescing the tokens when the run asks for it. A
+        deterministic request answered from the semantic cache streams its cached response
+        as a single chunk.
+
+        Args:
+            messages (List[BaseMessage]): The chat messages.
+            stop (Optional[List[str]]): Stop words.
+            run_manager (Optional[AsyncCallbackManagerForLLMRun]): The callback manager.
+            **kwargs: Additional Ollama parameters.
+
+        Yields:
+            ChatGenerationChunk: The generated chunks.
+        """
+        lookup = await self._semantic_lookup(
+            messages, self._request_params(stop, **kwargs)
+        )
+        if lookup is not None and lookup.response is not None:
+            chunks = _cached_chunks(lookup.response)
+        else:
+            chunks = super()._astream(messages, stop, run_manager, **kwargs)
+            if lookup is not None:
+                chunks = _cache_stream(chunks, self.semantic_cache, lookup)
+        window = COALESCING_WINDOW.get()
+        if window is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        async for chunk in coalesce(chunks, window, _chunk_size, _merge_chunks):
+            yield chunk
+
+    async def _semantic_lookup(
+        self, messages: List[BaseMessage], params: Dict[str, Any]
+    ) -> Optional[SemanticLookup]:
+        """
+        Look up a request in the semantic cache by its last message, a user message. Like
+        the response cache, the semantic cache only holds deterministic responses, a
+        sampled one is not replayed to the similar requests.
+
+        Args:
+            messages (List[BaseMessage]): The chat messages.
+            params (Dict[str, Any]): The Ollama request parameters.
+
+        Returns:
+            Optional[SemanticLookup]: The lookup, or None if the semantic cache is disabled,
+                the request is not deterministic or the last message is not a text user
+                message.
+        """
+        if (
+            self.semantic_cache is None
+            or not is_deterministic(params)
+            or not messages
+            or not isinstance(messages[-1], HumanMessage)
+            or not isinstance(messages[-1].content, str)
+        ):
+            return None
+
+        # Only the last message is compared, everything else must be the same
+        earlier = self._convert_messages_to_ollama_messages(messages[:-1])
+        scope = SemanticCache.scope(generation_fingerprint(self.model, earlier, params))
+        return await self.semantic_cache.get(scope, messages[-1].content)
+
+    async def _acreate_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the response lines of an Ollama request.
+
+        Deterministic requests identical to a running one follow its response lines,
+        from the first one, instead of starting another generation.
+
+        Args:
+            api_url (str): The Ollama endpoint.
+            payload (Any): The request payload.
+            stop (Optional[List[str]]): Stop words.
+            **kwargs: Additional Ollama parameters.
+
+        Yields:
+            str: The raw JSON lines of the Ollama response.
+        """
+        if self.single_flight is not None:
+            params = self._request_params(stop, **kwargs)
+            if is_deterministic(params):
+                key = generation_fingerprint(
+                    self.model,
+                    payload.get("messages") or [],
+                    {
+                        **params,
+                        "api_url": api_url,
+                        "prompt": payload.get("prompt"),
+                        "images": payload.get("images"),
+                    },
+                )
+                async for line in self.single_flight.stream(
+                    key,
+                    lambda: self._ollama_stream(api_url, payload, stop, **kwargs),
+                ):
+                    yield line
+                return
+
+        async for line in self._ollama_stream(api_url, payload, stop, **kwargs):
+            yield line
+
+    async def _ollama_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the response lines of an Ollama request and record its metrics.
+
+        Nothing is recorded per line. The final Ollama line carries the evaluation
+        counters, which are parsed once when the stream ends, and the generated tokens are
+        counted into the usage of the rate limited request. The outcome of the request is
+        recorded by the circuit breaker.
+
+        Args:
+            api_url (str): The Ollama endpoint.
+            payload (Any): The request payload.
+            stop (Optional[List[str]]): Stop words.
+            **kwargs: Additional Ollama parameters.
+
+        Yields:
+            str: The raw JSON lines of the Ollama response.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the request.
+        """
+        breaker = self.circuit_breaker
+        trial = breaker.acquire() if breaker is not None else False
+        metrics = ModelMetrics.for_model(self.model)
+        start = time.perf_counter()
+        first_token_at = 0.0
+        lines = 0
+        last_line = ""
+
+        metrics.in_flight.inc()
+        try:
+            async for line in self._post_stream(api_url, payload, stop, **kwargs):
+                if not lines:
+                    first_token_at = time.perf_counter()
+                    metrics.time_to_first_token.observe(first_token_at - start)
+                lines += 1
+                last_line = line
+                yield line
+        except BaseException as exc:
+            if isinstance(exc, Exception):
+                metrics.record_error(exc)
+            if breaker is not None:
+                breaker.record(exc, trial)
+            raise
+        finally:
+            metrics.in_flight.dec()
+
+        if breaker is not None:
+            breaker.record(None, trial)
+
+        if lines:
+            tokens = _record_generation_speed(metrics, last_line, lines, first_token_at)
+            record_generated_tokens(tokens)
+
+    def _post_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Post an Ollama request, through the backend pool or the pooled HTTP client when
+        there is one. The backend pool sends the request to the path of `api_url` on the
+        backend it selects, hedged to a second backend when the request may be hedged.
+        The request carries the headers and the auth of the model, as in `ChatOllama`.
+
+        Args:
+            api_url (str): The Ollama endpoint.
+            payload (Any): The request payload.
+            stop (Optional[List[str]]): Stop words.
+            **kwargs: Additional Ollama parameters.
+
+        Returns:
+            AsyncIterator[str]: The raw JSON lines of the Ollama response.
+        """
+        if self.ollama_client is None and self.backend_pool is None:
+            return super()._acreate_stream(api_url, payload, stop=stop, **kwargs)
+
+        params = self._request_params(stop, **kwargs)
+        if payload.get("messages"):
+            request_payload = {"messages": payload["messages"], **params}
+        else:
+            request_payload = {
+                "prompt": payload.get("prompt"),
+                "images": payload.get("images", []),
+                **params,
+            }
+        headers = self.headers if isinstance(self.headers, dict) else None
+        if (
+            self.backend_pool is not None
+            and self.hedging is not None
+            and HEDGE_REQUEST.get()
+        ):
+            return _hedged_stream(
+                self.backend_pool,
+                urlsplit(api_url).path,
+                request_payload,
+                headers,
+                self.hedging,
+                self.auth,
+            )
+        if self.backend_pool is not None:
+            return self.backend_pool.stream_lines(
+                urlsplit(api_url).path, request_payload, headers, self.auth
+            )
+        return self.ollama_client.stream_lines(
+            api_url, request_payload, headers, self.auth
+        )
+
+
+async def _hedged_stream(
+    backend_pool: BackendPool,
+    path: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]],
+    hedging: HedgingPolicy,
+    auth: Optional[Auth],
+) -> AsyncIterator[str]:
+    """
+    Stream the lines of the first response of a hedged Ollama request.
+
+    Args:
+        backend_pool (BackendPool): The backend pool.
+        path (str): The path of the Ollama endpoint.
+        payload (Dict[str, Any]): The JSON request payload.
+        headers (Optional[Dict[str, str]]): Additional request headers.
+        hedging (HedgingPolicy): When, and whether, the request is hedged.
+        auth (Optional[Auth]): The authentication of the request.
+
+    Yields:
+        str: The raw JSON lines of the Ollama response.
+    """
+    for line in await backend_pool.hedged_lines(path, payload, headers, hedging, auth):
+        yield line
+
+
+def _chat_result(response: Dict[str, Any]) -> ChatResult:
+    """
+    Build a chat result from a cached response.
+
+    Args:
+        response (Dict[str, Any]): The cached response text and generation info.
+
+    Returns:
+        ChatResult: The chat result.
+    """
+    generation = ChatGeneration(
+        message=AIMessage(content=response["text"]),
+        generation_info=response["generation_info"],
+    )
+    return ChatResult(generations=[generation])
+
+
+async def _cached_chunks(
+    response: Dict[str, Any],
+) -> AsyncIterator[ChatGenerationChunk]:
+    """
+    Stream a cached response as a single chunk.
+
+    Args:
+        response (Dict[str, Any]): The cached response text and generation info.
+
+    Yields:
+        ChatGenerationChunk: The chunk of the whole response.
+    """
+    yield ChatGenerationChunk(
+        message=AIMessageChunk(content=response["text"]),
+        generation_info=response["generation_info"],
+    )
+
+
+async def _cache_stream(
+    chunks: AsyncIterator[ChatGenerationChunk],
+    semantic_cache: SemanticCache,
+    lookup: SemanticLookup,
+) -> AsyncIterator[ChatGenerationChunk]:
+    """
+    Pass a stream through, caching its response once it is complete.
+
+    Args:
+        chunks (AsyncIterator[ChatGenerationChunk]): The streamed chunks.
+        semantic_cache (SemanticCache): The semantic cache.
+        lookup (SemanticLookup): The missed lookup of the request.
+
+    Yields:
+        ChatGenerationChunk: The streamed chunks.
+    """
+    text: List[str] = []
+    generation_info = None
+    async for chunk in chunks:
+        text.append(chunk.text)
+        generation_info = chunk.generation_info or generation_info
+        yield chunk
+    semantic_cache.set(
+        lookup, {"text": "".join(text), "generation_info": generation_info}
+    )
+
+
+def _chunk_size(chunk: ChatGenerationChunk) -> int:
+    """Return the size of the text of a chunk, in UTF-8 bytes."""
+    return len(chunk.text.encode("utf-8"))
+
+
+def _merge_chunks(
+    first: ChatGenerationChunk, second: ChatGenerationChunk
+) -> ChatGenerationChunk:
+    """Merge two consecutive chunks into one."""
+    return first + second
+
+
+def _record_generation_speed(
+    metrics: ModelMetrics, last_line: str, lines: int, first_token_at: float
+) -> int:
+    """
+    Record the generated tokens, the generation speed and the prompt evaluation time of a
+    finished response.
+
+    Uses the Ollama `eval_count` and `eval_duration` counters of the final line, and
+    falls back to the number of lines over the wall clock time when they are missing.
+    The prompt evaluation time is the `prompt_eval_duration` of the final line, if any.
+
+    Args:
+        metrics (ModelMetrics): The metrics of the model.
+        last_line (str): The final line of the Ollama response.
+        lines (int): The number of lines in the response.
+        first_token_at (float): The `perf_counter` time of the first line.
+
+    Returns:
+        int: The generated tokens.
+    """
+    try:
+        final = json.loads(last_line)
+    except ValueError:
+        final = {}
+
+    tokens = final.get("eval_count") or lines
+    eval_duration = final.get("eval_duration")
+    seconds = (
+        eval_duration / 1e9 if eval_duration else time.perf_counter() - first_token_at
+    )
+    metrics.generated_tokens.inc(tokens)
+    if seconds > 0:
+        metrics.tokens_per_second.observe(tokens / seconds)
+    prompt_eval_duration = final.get("prompt_eval_duration")
+    if prompt_eval_duration:
+        metrics.prompt_eval_seconds.observe(prompt_eval_duration / 1e9)
+    return tokens
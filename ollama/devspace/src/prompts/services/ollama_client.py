@@ -0,0 +1,180 @@
+"""
+This module provides the pooled HTTP client shared by all requests to Ollama.
+
+The client keeps connections alive between requests, so the TCP and TLS handshakes, and
+the round trips through the oauth proxy, are paid once per connection instead of once per
+call. It is created when the application starts and closed when it shuts down.
+
+Connection reuse is measured with the httpcore trace extension: a request that had to
+open a TCP connection is counted as "new", any other request as "reused".
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+
+import httpx
+from prometheus_client import Counter
+
+from ..exceptions.custom_exceptions import OllamaStatusError
+from ..utils.logger import AppLogger
+
+OLLAMA_HTTP_REQUESTS = Counter(
+    "ollama_http_requests_total",
+    "HTTP requests sent to Ollama, by whether they opened a new connection or reused one.",
+    ["connection"],
+)
+
+# Authentication of the Ollama requests: a (username, password) tuple for Basic auth, an
+# httpx.Auth such as httpx.DigestAuth, or a callable modifying the request
+Auth = Union[Tuple[str, str], httpx.Auth, Callable[[httpx.Request], httpx.Request]]
+
+# httpcore trace event emitted once a new TCP connection is established
+CONNECT_TCP_COMPLETE = "connection.connect_tcp.complete"
+
+
+class OllamaClient:
+    """
+    Pooled async HTTP client for the Ollama API.
+
+    Attributes:
+        limits (httpx.Limits): The connection pool limits.
+        timeout (httpx.Timeout): The connect and read timeouts.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        connect_timeout: float,
+        read_timeout: float,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        Initializes the OllamaClient. The connection pool is created by `start`.
+
+        Args:
+            max_connections (int): Maximum number of concurrent connections.
+            max_keepalive_connections (int): Maximum number of idle connections kept alive.
+            keepalive_expiry (float): Seconds an idle connection is kept alive.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the next chunk of a response.
+            transport (Optional[httpx.AsyncBaseTransport]): Transport replacing the network,
+                used in tests.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._connections = {
+            "new": OLLAMA_HTTP_REQUESTS.labels("new"),
+            "reused": OLLAMA_HTTP_REQUESTS.labels("reused"),
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The underlying HTTP client, created on first use if the client was not started."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, transport=self._transport
+            )
+        return self._client
+
+    async def start(self) -> None:
+        """Create the connection pool."""
+        AppLogger.info(
+            "Starting the Ollama HTTP client with up to %d connections",
+            self.limits.max_connections,
+        )
+        _ = self.client
+
+    async def aclose(self) -> None:
+        """Close the connection pool and its connections."""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def get_json(self, url: str, timeout: float) -> Any:
+        """
+        Send a GET request to Ollama and decode its JSON response.
+
+        Args:
+            url (str): The Ollama endpoint.
+            timeout (float): Seconds to wait for the whole request.
+
+        Returns:
+            Any: The decoded response.
+
+        Raises:
+            httpx.HTTPError: If the request fails, times out or has an error status.
+        """
+        response = await self.client.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_lines(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        auth: Optional[Auth] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Post a request to Ollama and stream the lines of its response.
+
+        Args:
+            url (str): The Ollama endpoint.
+            payload (Dict[str, Any]): The JSON request payload.
+            headers (Optional[Dict[str, str]]): Additional request headers.
+            auth (Optional[Auth]): The authentication of the request.
+
+        Yields:
+            str: The raw JSON lines of the Ollama response.
+
+        Raises:
+            OllamaEndpointNotFoundError: If Ollama responds with 404.
+            OllamaStatusError: If Ollama responds with any other non 200 status.
+            httpx.HTTPError: If the request fails or times out.
+        """
+        new_connection = False
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            nonlocal new_connection
+            if event == CONNECT_TCP_COMPLETE:
+                new_connection = True
+
+        async with self.client.stream(
+            "POST",
+            url,
+            json=payload,
+            headers=headers,
+            auth=auth,
+            extensions={"trace": trace},
+        ) as response:
+            self._connections["new" if new_connection else "reused"].inc()
+            if response.status_code != 200:
+                if response.status_code == 404:
+                    # Imported here, LangChain is only loaded with the model integration
+                    from langchain_community.llms.ollama import (
+                        OllamaEndpointNotFoundError,
+                    )
+
+                    raise OllamaEndpointNotFoundError(
+                        "Ollama call failed with status code 404."
+                    )
+                detail = (await response.aread()).decode("utf-8", errors="replace")
+                raise OllamaStatusError(
+                    f"Ollama call failed with status code {response.status_code}."
+                    f" Details: {detail}",
+                    response.status_code,
+                )
+            async for line in response.aiter_lines():
+                if line:
+                    yield line
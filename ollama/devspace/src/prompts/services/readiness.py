@@ -0,0 +1,257 @@
+"""
+This module provides the readiness state of the service, answered by "/readyz".
+
+A background task probes the Ollama backends every interval, listing the running models
+with "/api/ps", and caches the result. The readiness endpoint only reads the cached
+state, so the probe traffic to Ollama is the same however often the endpoint is polled.
+
+The service is ready when the model routes are integrated, at least one backend is
+reachable, the error rate of the Ollama requests over the recent window is below the
+threshold, the circuit breaker of the Ollama requests is not open and, if required, the
+model is loaded in a backend.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from prometheus_client import Gauge
+
+from ..utils.logger import AppLogger
+from .backend_pool import BackendPool
+from .circuit_breaker import OPEN, CircuitBreaker
+from .ollama_client import OllamaClient
+
+SERVICE_READY = Gauge(
+    "service_ready",
+    "Whether the service is ready to receive requests (1) or not (0).",
+    multiprocess_mode="liveall",
+)
+
+# Ollama endpoint listing the models loaded in memory
+RUNNING_MODELS_PATH = "/api/ps"
+
+
+def model_names(model: str) -> Tuple[str, ...]:
+    """
+    The names Ollama may list a model under.
+
+    Args:
+        model (str): The model name, with or without a tag.
+
+    Returns:
+        Tuple[str, ...]: The model name, and with the implicit "latest" tag if it has none.
+    """
+    return (model,) if ":" in model else (model, f"{model}:latest")
+
+
+class ReadinessProbe:
+    """
+    Probes the Ollama backends in the background and caches the readiness of the service.
+
+    Attributes:
+        model (str): The model that must be served.
+        probe_interval (float): Seconds between two probes.
+        probe_timeout (float): Seconds a probe of a backend may take.
+        max_error_rate (float): Share of failed requests over the window that makes the
+            service not ready.
+        min_requests (int): Requests in the window below which the error rate is ignored.
+        error_window (float): Seconds over which the error rate is measured.
+        require_model_loaded (bool): Whether the model must be loaded in a backend.
+        state (Dict[str, Any]): The readiness state cached by the last probe.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        backend_pool: Optional[BackendPool],
+        client: OllamaClient,
+        is_integrated: Callable[[], bool],
+        probe_interval: float,
+        probe_timeout: float,
+        max_error_rate: float,
+        min_requests: int,
+        error_window: float,
+        require_model_loaded: bool,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes the ReadinessProbe, not ready until the first probe. Probes are started
+        by `start`.
+
+        Args:
+            model (str): The model that must be served.
+            backend_pool (Optional[BackendPool]): The Ollama backends, None if there are none.
+            client (OllamaClient): The pooled HTTP client used for the probes.
+            is_integrated (Callable[[], bool]): Whether the model routes are integrated.
+            probe_interval (float): Seconds between two probes.
+            probe_timeout (float): Seconds a probe of a backend may take.
+            max_error_rate (float): Share of failed requests over the window that makes the
+                service not ready.
+            min_requests (int): Requests in the window below which the error rate is ignored.
+            error_window (float): Seconds over which the error rate is measured.
+            require_model_loaded (bool): Whether the model must be loaded in a backend.
+            circuit_breaker (Optional[CircuitBreaker]): The circuit breaker of the Ollama
+                requests, None if there is none.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.model = model
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_error_rate = max_error_rate
+        self.min_requests = min_requests
+        self.error_window = error_window
+        self.require_model_loaded = require_model_loaded
+        self.state: Dict[str, Any] = {
+            "ready": False,
+            "reasons": ["Not probed yet"],
+        }
+        self._backend_pool = backend_pool
+        self._client = client
+        self._is_integrated = is_integrated
+        self._circuit_breaker = circuit_breaker
+        self._clock = clock
+        self._model_names = model_names(model)
+        # Request and failure counts of the backends at each probe, over the error window
+        self._counts: Deque[Tuple[float, int, int]] = deque()
+        self._probe_task: Optional["asyncio.Task[None]"] = None
+        SERVICE_READY.set(0)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the service was ready at the last probe."""
+        return self.state["ready"]
+
+    async def start(self) -> None:
+        """Start probing in the background."""
+        self._probe_task = asyncio.create_task(self._probe_periodically())
+
+    async def aclose(self) -> None:
+        """Stop probing."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def probe(self) -> Dict[str, Any]:
+        """
+        Probe the backends and refresh the cached readiness state.
+
+        Returns:
+            Dict[str, Any]: The new readiness state.
+        """
+        backends = self._backend_pool.backends if self._backend_pool else []
+        results = await asyncio.gather(
+            *(self._probe_backend(backend.url) for backend in backends)
+        )
+        error_rate, requests = self._error_rate()
+
+        reasons: List[str] = []
+        if not self._is_integrated():
+            reasons.append("The model routes are not integrated yet")
+        if not any(result["reachable"] for result in results):
+            reasons.append("No Ollama backend is reachable")
+        model_loaded = any(result["model_loaded"] for result in results)
+        if self.require_model_loaded and not model_loaded:
+            reasons.append(f"The model {self.model} is not loaded")
+        if requests >= self.min_requests and error_rate > self.max_error_rate:
+            reasons.append(f"The error rate of the Ollama requests is {error_rate:.0%}")
+        circuit_breaker = (
+            self._circuit_breaker.state if self._circuit_breaker is not None else None
+        )
+        if circuit_breaker == OPEN:
+            reasons.append("The circuit breaker of the Ollama requests is open")
+
+        ready = not reasons
+        if ready != self.state["ready"]:
+            log = AppLogger.info if ready else AppLogger.warning
+            log("Service %s: %s", "ready" if ready else "not ready", reasons)
+        SERVICE_READY.set(1 if ready else 0)
+        self.state = {
+            "ready": ready,
+            "reasons": reasons,
+            "model": self.model,
+            "model_loaded": model_loaded,
+            "error_rate": error_rate,
+            "circuit_breaker": circuit_breaker,
+            "backends": results,
+        }
+        return self.state
+
+    async def _probe_periodically(self) -> None:
+        """Probe every probe interval."""
+        while True:
+            try:
+                await self.probe()
+            except Exception:
+                # A failed probe must not freeze the cached readiness state
+                AppLogger.exception("Failed to probe the readiness of the service")
+            await asyncio.sleep(self.probe_interval)
+
+    async def _probe_backend(self, url: str) -> Dict[str, Any]:
+        """
+        List the running models of a backend.
+
+        Args:
+            url (str): The base URL of the backend.
+
+        Returns:
+            Dict[str, Any]: Whether the backend is reachable and has the model loaded.
+        """
+        try:
+            running = await self._client.get_json(
+                url + RUNNING_MODELS_PATH, self.probe_timeout
+            )
+        except Exception as exc:
+            return {
+                "url": url,
+                "reachable": False,
+                "model_loaded": False,
+                "error": repr(exc),
+            }
+
+        loaded = {
+            name
+            for model in running.get("models", [])
+            for name in (model.get("name"), model.get("model"))
+        }
+        return {
+            "url": url,
+            "reachable": True,
+            "model_loaded": any(name in loaded for name in self._model_names),
+        }
+
+    def _error_rate(self) -> Tuple[float, int]:
+        """
+        Measure the error rate of the Ollama requests over the error window.
+
+        Returns:
+            Tuple[float, int]: The share of failed requests and the number of requests.
+        """
+        backends = self._backend_pool.backends if self._backend_pool else []
+        now = self._clock()
+        self._counts.append(
+            (
+                now,
+                sum(backend.requests for backend in backends),
+                sum(backend.failures for backend in backends),
+            )
+        )
+        while len(self._counts) > 2 and self._counts[1][0] <= now - self.error_window:
+            self._counts.popleft()
+
+        _, first_requests, first_failures = self._counts[0]
+        _, last_requests, last_failures = self._counts[-1]
+        requests = last_requests - first_requests
+        if requests <= 0:
+            return 0.0, 0
+        return (last_failures - first_failures) / requests, requests
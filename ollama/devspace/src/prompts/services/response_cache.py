@@ -0,0 +1,276 @@
+"""
+This module provides a bounded response cache for Ollama generations.
+
+The memory tier is an LRU bounded by the encoded size of its entries in bytes. Entries
+expire after a TTL. An optional SQLite tier on disk keeps entries across pod restarts;
+memory misses fall through to it and disk hits are promoted back into memory.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from ..utils.logger import AppLogger
+
+CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total",
+    "Response cache lookups by tier and result.",
+    ["tier", "result"],
+)
+CACHE_BYTES = Gauge(
+    "response_cache_memory_bytes",
+    "Encoded size of the entries in the memory tier of the response cache.",
+    multiprocess_mode="livesum",
+)
+CACHE_EVICTIONS = Counter(
+    "response_cache_evictions_total",
+    "Entries evicted from the memory tier of the response cache.",
+    ["reason"],
+)
+
+# Estimated bookkeeping overhead of a memory entry, on top of its key and value
+ENTRY_OVERHEAD_BYTES = 200
+
+# Expired rows are purged from the disk tier every this many writes
+DISK_PURGE_INTERVAL = 100
+
+
+class ResponseCache:
+    """
+    Bounded LRU and TTL cache for generated responses.
+
+    Attributes:
+        max_bytes (int): The memory bound of the memory tier.
+        ttl (float): Seconds an entry stays valid.
+        hits (int): Lookups answered from either tier.
+        misses (int): Lookups not found in any tier.
+        size_bytes (int): Current size of the memory tier.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float,
+        disk_path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Initializes the ResponseCache.
+
+        Args:
+            max_bytes (int): The memory bound of the memory tier in bytes.
+            ttl (float): Seconds an entry stays valid.
+            disk_path (Optional[str]): Path of the SQLite file for the disk tier, if any.
+            clock (Callable[[], float]): Wall clock, in seconds since the epoch.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size_bytes = 0
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lookups = {
+            (tier, result): CACHE_LOOKUPS.labels(tier, result)
+            for tier in ("memory", "disk")
+            for result in ("hit", "miss")
+        }
+        self._disk: Optional[_DiskTier] = (
+            _DiskTier(disk_path, clock) if disk_path else None
+        )
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The request fingerprint.
+
+        Returns:
+            Optional[Dict[str, Any]]: The cached response, or None on a miss.
+        """
+        now = self._clock()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self._record("memory", "hit")
+                return json.loads(value)
+            self._remove(key, "expired")
+        self._record("memory", "miss")
+
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None:
+                self._record("disk", "hit")
+                self._store(key, *row)
+                return json.loads(row[1])
+            self._record("disk", "miss")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: Dict[str, Any]) -> None:
+        """
+        Cache a response.
+
+        Args:
+            key (str): The request fingerprint.
+            response (Dict[str, Any]): The JSON serializable response.
+        """
+        value = json.dumps(response, separators=(",", ":")).encode("utf-8")
+        expires_at = self._clock() + self.ttl
+        self._store(key, expires_at, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, expires_at, value)
+
+    def close(self) -> None:
+        """Close the disk tier."""
+        if self._disk is not None:
+            self._disk.close()
+
+    def _store(self, key: str, expires_at: float, value: bytes) -> None:
+        """
+        Store an entry in the memory tier and evict the least recently used entries
+        until the tier is back under its memory bound.
+
+        Args:
+            key (str): The request fingerprint.
+            expires_at (float): Expiry time of the entry.
+            value (bytes): The encoded response.
+        """
+        if key in self._entries:
+            self._remove(key)
+        entry_bytes = _entry_size(key, value)
+        if entry_bytes > self.max_bytes:
+            return
+
+        self._entries[key] = (expires_at, value)
+        self.size_bytes += entry_bytes
+        while self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, "size")
+        CACHE_BYTES.set(self.size_bytes)
+
+    def _remove(self, key: str, reason: Optional[str] = None) -> None:
+        """
+        Remove an entry from the memory tier.
+
+        Args:
+            key (str): The request fingerprint.
+            reason (Optional[str]): The eviction reason, if the entry is evicted.
+        """
+        _, value = self._entries.pop(key)
+        self.size_bytes -= _entry_size(key, value)
+        if reason:
+            CACHE_EVICTIONS.labels(reason).inc()
+        CACHE_BYTES.set(self.size_bytes)
+
+    def _record(self, tier: str, result: str) -> None:
+        """
+        Record the result of a lookup.
+
+        Args:
+            tier (str): The cache tier.
+            result (str): Either "hit" or "miss".
+        """
+        self._lookups[(tier, result)].inc()
+        if result == "hit":
+            self.hits += 1
+
+
+class _DiskTier:
+    """SQLite backed disk tier of the response cache."""
+
+    def __init__(self, path: str, clock: Callable[[], float]):
+        """
+        Open the SQLite database, creating it if needed, and purge expired rows.
+
+        Args:
+            path (str): Path of the SQLite file.
+            clock (Callable[[], float]): Wall clock, in seconds since the epoch.
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+            )
+        self._purge()
+        AppLogger.info("Response cache disk tier opened at %s", path)
+
+    def get(self, key: str) -> Optional[Tuple[float, bytes]]:
+        """
+        Read an unexpired entry.
+
+        Args:
+            key (str): The request fingerprint.
+
+        Returns:
+            Optional[Tuple[float, bytes]]: The expiry time and encoded response.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires_at, value FROM responses WHERE key = ? AND expires_at > ?",
+                (key, self._clock()),
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def set(self, key: str, expires_at: float, value: bytes) -> None:
+        """
+        Write an entry.
+
+        Args:
+            key (str): The request fingerprint.
+            expires_at (float): Expiry time of the entry.
+            value (bytes): The encoded response.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value),
+            )
+            self._writes += 1
+        if self._writes % DISK_PURGE_INTERVAL == 0:
+            self._purge()
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._connection.close()
+
+    def _purge(self) -> None:
+        """Delete the expired rows."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM responses WHERE expires_at <= ?", (self._clock(),)
+            )
+
+
+def _entry_size(key: str, value: bytes) -> int:
+    """
+    Estimate the memory taken by a memory tier entry.
+
+    Args:
+        key (str): The request fingerprint.
+        value (bytes): The encoded response.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    return len(key) + len(value) + ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,362 @@
+"""
+This module provides a semantic response cache for Ollama generations.
+
+The exact response cache misses the many near-duplicate questions of the users, such as
+"what is kubernetes?" and "What's Kubernetes". The semantic cache embeds the last user
+message of a request with the embedding endpoint of Ollama, and answers the request with
+the response of a cached request whose embedding has a cosine similarity of at least the
+threshold, within the same scope: the same model, parameters and earlier messages. Like
+the exact cache, it only holds the responses of deterministic requests, at temperature 0.
+
+The embeddings are kept normalized in a NumPy matrix preallocated for the capacity of the
+cache, so a lookup is a matrix product. The lookups started in the same iteration of the
+event loop are batched: their messages are embedded by a single Ollama request and
+searched by a single matrix product. When the cache is full, the least recently used
+entry is evicted; expired entries are replaced first.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+from ..utils.logger import AppLogger
+from .backend_pool import BackendPool
+from .ollama_client import Auth, OllamaClient
+
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "semantic_cache_lookups_total",
+    "Semantic cache lookups by result: hit, miss, or error when the embedding failed.",
+    ["result"],
+)
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "semantic_cache_similarity",
+    "Cosine similarity of the closest cached entry of a lookup, by result, to tune the "
+    "threshold: hits close to it may be wrong answers, misses close to it lost hits.",
+    ["result"],
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1),
+)
+SEMANTIC_CACHE_ENTRIES = Gauge(
+    "semantic_cache_entries",
+    "Entries of the semantic cache.",
+    multiprocess_mode="livesum",
+)
+SEMANTIC_CACHE_EVICTIONS = Counter(
+    "semantic_cache_evictions_total",
+    "Entries evicted from the semantic cache, by reason.",
+    ["reason"],
+)
+SEMANTIC_CACHE_BATCH_SIZE = Histogram(
+    "semantic_cache_batch_size",
+    "Lookups embedded and searched together.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+# Ollama endpoint embedding a list of texts
+EMBED_PATH = "/api/embed"
+
+Embed = Callable[[List[str]], Awaitable[Sequence[Sequence[float]]]]
+
+
+class OllamaEmbedder:
+    """
+    Embeds texts with the embedding endpoint of an Ollama backend.
+
+    Through the backend pool, the embedding requests are routed, admitted by the model
+    scheduler and counted in the outstanding requests of the backends like the generations.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        client: OllamaClient,
+        timeout: float,
+        base_url: str,
+        backend_pool: Optional[BackendPool] = None,
+        headers: Optional[Dict[str, str]] = None,
+        auth: Optional[Auth] = None,
+    ):
+        """
+        Initializes the OllamaEmbedder.
+
+        Args:
+            model (str): The embedding model.
+            client (OllamaClient): The pooled HTTP client.
+            timeout (float): Seconds an embedding request may take.
+            base_url (str): The Ollama URL, used without a backend pool.
+            backend_pool (Optional[BackendPool]): Selects the backend of each request.
+            headers (Optional[Dict[str, str]]): Additional request headers, those of the
+                models.
+            auth (Optional[Auth]): The authentication of the requests, that of the models.
+        """
+        self.model = model
+        self.timeout = timeout
+        self.headers = headers
+        self.auth = auth
+        self._client = client
+        self._base_url = base_url.rstrip("/")
+        self._backend_pool = backend_pool
+
+    async def __call__(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts.
+
+        Args:
+            texts (List[str]): The texts.
+
+        Returns:
+            List[List[float]]: The embedding of each text.
+
+        Raises:
+            OllamaEndpointNotFoundError: If Ollama responds with 404.
+            OllamaStatusError: If Ollama responds with any other non 200 status.
+            httpx.HTTPError: If the request fails.
+            TimeoutError: If the request times out.
+        """
+        payload = {"model": self.model, "input": texts}
+        lines = (
+            self._backend_pool.stream_lines(
+                EMBED_PATH, payload, self.headers, self.auth
+            )
+            if self._backend_pool is not None
+            else self._client.stream_lines(
+                self._base_url + EMBED_PATH, payload, self.headers, self.auth
+            )
+        )
+        try:
+            async with asyncio.timeout(self.timeout):
+                response = json.loads("".join([line async for line in lines]))
+        finally:
+            await lines.aclose()
+        return response["embeddings"]
+
+
+class SemanticLookup:
+    """
+    The result of a semantic cache lookup, which caches the response on a miss.
+
+    Attributes:
+        scope (int): The hash of the scope of the request.
+        vector (Optional[np.ndarray]): The normalized embedding, None if it failed.
+        response (Optional[Dict[str, Any]]): The cached response, None on a miss.
+        similarity (Optional[float]): The similarity of the closest cached entry.
+    """
+
+    def __init__(self, scope: int, vector: Optional[np.ndarray]):
+        """
+        Initializes the SemanticLookup, as a miss.
+
+        Args:
+            scope (int): The hash of the scope of the request.
+            vector (Optional[np.ndarray]): The normalized embedding, None if it failed.
+        """
+        self.scope = scope
+        self.vector = vector
+        self.response: Optional[Dict[str, Any]] = None
+        self.similarity: Optional[float] = None
+
+
+class SemanticCache:
+    """
+    Capacity bounded cache of responses, looked up by embedding similarity.
+
+    Attributes:
+        capacity (int): The maximum number of entries.
+        threshold (float): The minimum cosine similarity of a hit.
+        ttl (float): Seconds an entry stays valid.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups not answered from the cache.
+    """
+
+    def __init__(
+        self,
+        embed: Embed,
+        capacity: int,
+        threshold: float,
+        ttl: float,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Initializes the SemanticCache. The matrix is allocated by the first embedding,
+        which gives the dimensions.
+
+        Args:
+            embed (Embed): Embeds a list of texts.
+            capacity (int): The maximum number of entries.
+            threshold (float): The minimum cosine similarity of a hit.
+            ttl (float): Seconds an entry stays valid.
+            clock (Callable[[], float]): Wall clock, in seconds since the epoch.
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._embed = embed
+        self._clock = clock
+        self._vectors: Optional[np.ndarray] = None
+        self._scopes = np.zeros(capacity, dtype=np.int64)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._responses: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._entries = 0
+        self._pending: List[Tuple[int, str, "asyncio.Future[SemanticLookup]"]] = []
+        self._flushes: Set["asyncio.Task[None]"] = set()
+        self._lookups = {
+            result: SEMANTIC_CACHE_LOOKUPS.labels(result)
+            for result in ("hit", "miss", "error")
+        }
+        self._similarity = {
+            result: SEMANTIC_CACHE_SIMILARITY.labels(result)
+            for result in ("hit", "miss")
+        }
+
+    @staticmethod
+    def scope(fingerprint: str) -> int:
+        """
+        Hash the scope of a request.
+
+        Args:
+            fingerprint (str): The fingerprint of the model, parameters and earlier
+                messages of the request.
+
+        Returns:
+            int: The hash of the scope.
+        """
+        digest = hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    async def get(self, scope: int, text: str) -> SemanticLookup:
+        """
+        Look up the response of a request by the similarity of its text.
+
+        Args:
+            scope (int): The hash of the scope of the request.
+            text (str): The text embedded, the last user message.
+
+        Returns:
+            SemanticLookup: The lookup, with the cached response on a hit.
+        """
+        future: "asyncio.Future[SemanticLookup]" = (
+            asyncio.get_running_loop().create_future()
+        )
+        self._pending.append((scope, text, future))
+        if len(self._pending) == 1:
+            flush = asyncio.create_task(self._flush())
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        return await future
+
+    def set(self, lookup: SemanticLookup, response: Dict[str, Any]) -> None:
+        """
+        Cache the response of a missed lookup, evicting an entry if the cache is full.
+
+        A lookup whose embedding failed, or has other dimensions than the cached ones, is
+        not cached.
+
+        Args:
+            lookup (SemanticLookup): The missed lookup.
+            response (Dict[str, Any]): The JSON serializable response.
+        """
+        vector = lookup.vector
+        if vector is None:
+            return
+        if self._vectors is None:
+            self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+        if vector.shape[0] != self._vectors.shape[1]:
+            return
+
+        now = self._clock()
+        free = ~self._valid | (self._expires <= now)
+        if free.any():
+            row = int(np.argmax(free))
+            if self._valid[row]:
+                SEMANTIC_CACHE_EVICTIONS.labels("expired").inc()
+            else:
+                self._entries += 1
+        else:
+            row = int(np.argmin(self._last_used))
+            SEMANTIC_CACHE_EVICTIONS.labels("capacity").inc()
+
+        self._vectors[row] = vector
+        self._scopes[row] = lookup.scope
+        self._expires[row] = now + self.ttl
+        self._last_used[row] = now
+        self._valid[row] = True
+        self._responses[row] = response
+        SEMANTIC_CACHE_ENTRIES.set(self._entries)
+
+    async def _flush(self) -> None:
+        """Embed and search the pending lookups together."""
+        # Let the lookups started in the same iteration of the event loop join the batch
+        await asyncio.sleep(0)
+        batch, self._pending = self._pending, []
+        SEMANTIC_CACHE_BATCH_SIZE.observe(len(batch))
+
+        try:
+            embeddings = await self._embed([text for _, text, _ in batch])
+            queries = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(norms > 0, norms, 1)
+            lookups = self._search([scope for scope, _, _ in batch], queries)
+        except Exception as exc:
+            AppLogger.warning("Failed the semantic cache lookups: %r", exc)
+            lookups = [SemanticLookup(scope, None) for scope, _, _ in batch]
+            self._lookups["error"].inc(len(batch))
+
+        for (_, _, future), lookup in zip(batch, lookups):
+            if not future.done():
+                future.set_result(lookup)
+
+    def _search(self, scopes: List[int], queries: np.ndarray) -> List[SemanticLookup]:
+        """
+        Find the closest cached entry of each query in its scope.
+
+        Args:
+            scopes (List[int]): The hashes of the scopes of the queries.
+            queries (np.ndarray): The normalized embeddings of the queries, one per row.
+
+        Returns:
+            List[SemanticLookup]: The lookup of each query.
+        """
+        lookups = [
+            SemanticLookup(scope, vector) for scope, vector in zip(scopes, queries)
+        ]
+        if self._vectors is not None and self._entries:
+            now = self._clock()
+            live = self._valid & (self._expires > now)
+            # Similarities of the entries with every query, one column per query
+            similarities = self._vectors @ queries.T
+            in_scope = live[:, None] & (
+                self._scopes[:, None] == np.asarray(scopes, dtype=np.int64)[None, :]
+            )
+            similarities = np.where(in_scope, similarities, -np.inf)
+            rows = similarities.argmax(axis=0)
+            for column, (lookup, row) in enumerate(zip(lookups, rows)):
+                similarity = float(similarities[row, column])
+                if similarity == -np.inf:
+                    continue
+                lookup.similarity = similarity
+                if similarity >= self.threshold:
+                    lookup.response = self._responses[row]
+                    self._last_used[row] = now
+
+        for lookup in lookups:
+            result = "hit" if lookup.response is not None else "miss"
+            self._lookups[result].inc()
+            if lookup.similarity is not None:
+                self._similarity[result].observe(lookup.similarity)
+            if result == "hit":
+                self.hits += 1
+            else:
+                self.misses += 1
+        return lookups
@@ -0,0 +1,164 @@
+"""
+This module provides single-flight coalescing of identical concurrent streams.
+
+While a stream for a key is running, later requests for the same key subscribe to it
+instead of starting their own. Each subscriber first receives the items that were already
+produced and then follows the live stream. The producer runs in its own task, so it
+outlives the request that started it, and is cancelled once every subscriber has left.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Generic, List, Optional, TypeVar
+
+from prometheus_client import Counter
+
+T = TypeVar("T")
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "single_flight_requests_total",
+    "Coalescable requests by role; followers share the generation of a leader.",
+    ["role"],
+)
+
+
+class _Flight(Generic[T]):
+    """A running stream and the items it has produced so far."""
+
+    def __init__(self) -> None:
+        """Initializes an empty flight."""
+        self.items: List[T] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def publish(self, item: T) -> None:
+        """
+        Append an item and wake up the waiting subscribers.
+
+        Args:
+            item (T): The produced item.
+        """
+        self.items.append(item)
+        self.notify()
+
+    def notify(self) -> None:
+        """Wake up the waiting subscribers."""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces identical concurrent streams into a single producer.
+
+    Attributes:
+        in_flight (int): The number of running producers.
+    """
+
+    def __init__(self) -> None:
+        """Initializes the SingleFlight with no running flights."""
+        self._flights: Dict[str, _Flight[T]] = {}
+        self._leaders = SINGLE_FLIGHT_REQUESTS.labels("leader")
+        self._followers = SINGLE_FLIGHT_REQUESTS.labels("follower")
+
+    @property
+    def in_flight(self) -> int:
+        """The number of running producers."""
+        return len(self._flights)
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[T]]
+    ) -> AsyncIterator[T]:
+        """
+        Stream the items for a key, joining a running producer when there is one.
+
+        Args:
+            key (str): Identifies requests that produce identical streams.
+            factory (Callable[[], AsyncIterator[T]]): Starts the stream when no producer
+                is running for the key.
+
+        Yields:
+            T: The items of the stream, from the first one.
+
+        Raises:
+            Exception: The error raised by the producer, after the items it produced.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+            self._leaders.inc()
+        else:
+            self._followers.inc()
+
+        flight.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(flight.items):
+                    yield flight.items[index]
+                    index += 1
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task:
+                # Detach the flight first, so new requests do not join a cancelled producer
+                self._discard(key, flight)
+                flight.task.cancel()
+
+    async def _produce(
+        self, key: str, flight: _Flight[T], factory: Callable[[], AsyncIterator[T]]
+    ) -> None:
+        """
+        Run the stream and publish its items to the subscribers of the flight.
+
+        Args:
+            key (str): The key of the flight.
+            flight (_Flight[T]): The flight to publish to.
+            factory (Callable[[], AsyncIterator[T]]): Starts the stream.
+        """
+        iterator = factory()
+        try:
+            async for item in iterator:
+                flight.publish(item)
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            await _aclose(iterator)
+            flight.done = True
+            self._discard(key, flight)
+            flight.notify()
+
+    def _discard(self, key: str, flight: _Flight[T]) -> None:
+        """
+        Remove a flight, unless a newer flight has replaced it.
+
+        Args:
+            key (str): The key of the flight.
+            flight (_Flight[T]): The flight to remove.
+        """
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+async def _aclose(iterator: AsyncIterator[T]) -> None:
+    """
+    Close an async iterator, releasing the resources of an unfinished generator.
+
+    Args:
+        iterator (AsyncIterator[T]): The iterator to close.
+    """
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -0,0 +1,162 @@
+"""
+This module routes the turns of a conversation to the same Ollama backend.
+
+A multi-turn chat resends its growing message history with every turn, and Ollama only
+reuses the prompt cache of a model, skipping the evaluation of the prefix it has already
+seen, when the next turn lands on the same backend. Requests carrying a conversation ID
+header are routed by consistent hashing of the ID over a ring of the backends, with
+virtual nodes so the conversations spread evenly.
+
+The routing has bounded loads: a backend is skipped, for the next one on the ring, while it
+has more outstanding requests than the load factor times the average, so a few long
+conversations cannot overload a backend. A backend that is ejected, or comes back, only
+moves the conversations it hashes to; the other conversations keep their backend.
+
+The conversation ID of the request is set by the per request config of the routes, with
+`CONVERSATION_ID`.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import bisect
+import hashlib
+import math
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Sequence
+
+from prometheus_client import Counter
+
+STICKY_ROUTED_REQUESTS = Counter(
+    "ollama_sticky_routed_requests_total",
+    "Requests routed by their conversation ID, by outcome: to the backend the "
+    "conversation hashes to, to the next one because that backend is unavailable, or "
+    "because it is overloaded.",
+    ["outcome"],
+)
+
+# The conversation ID of the request of the current context
+CONVERSATION_ID: ContextVar[Optional[str]] = ContextVar("conversation_id", default=None)
+
+
+def _hash(value: str) -> int:
+    """
+    Hash a value onto the ring.
+
+    Args:
+        value (str): The value.
+
+    Returns:
+        int: A 64-bit position on the ring.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """
+    Consistent hash ring of the backend URLs, with virtual nodes.
+
+    Attributes:
+        replicas (int): Virtual nodes of each backend on the ring.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int):
+        """
+        Initializes the HashRing.
+
+        Args:
+            nodes (Sequence[str]): The backend URLs.
+            replicas (int): Virtual nodes of each backend on the ring.
+        """
+        self.replicas = replicas
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._positions = [position for position, _ in points]
+        self._nodes = [node for _, node in points]
+        self._distinct = len(set(nodes))
+
+    def nodes(self, key: str) -> Iterator[str]:
+        """
+        The backends in the order a key falls back through them.
+
+        Args:
+            key (str): The key, a conversation ID.
+
+        Yields:
+            str: Every backend URL once, starting with the one the key hashes to.
+        """
+        if not self._nodes:
+            return
+        seen = set()
+        start = bisect.bisect(self._positions, _hash(key))
+        for index in range(len(self._nodes)):
+            node = self._nodes[(start + index) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == self._distinct:
+                    return
+
+
+class StickyRouting:
+    """
+    Selects the backend of a conversation by consistent hashing with bounded loads.
+
+    Attributes:
+        load_factor (float): Outstanding requests a backend may have, as a multiple of the
+            average, before its conversations go to the next backend on the ring.
+    """
+
+    def __init__(self, urls: Sequence[str], replicas: int, load_factor: float):
+        """
+        Initializes the StickyRouting.
+
+        Args:
+            urls (Sequence[str]): The backend URLs.
+            replicas (int): Virtual nodes of each backend on the ring.
+            load_factor (float): Outstanding requests a backend may have, as a multiple of
+                the average, before its conversations go to the next backend on the ring.
+        """
+        self.load_factor = load_factor
+        self._ring = HashRing([url.rstrip("/") for url in urls], replicas)
+        self._outcomes = {
+            outcome: STICKY_ROUTED_REQUESTS.labels(outcome)
+            for outcome in ("home", "unavailable", "overloaded")
+        }
+
+    def select(self, key: str, outstanding: Dict[str, int]) -> str:
+        """
+        Select the backend of a conversation.
+
+        Args:
+            key (str): The conversation ID.
+            outstanding (Dict[str, int]): The outstanding requests of the backends the
+                request may be routed to, by backend URL.
+
+        Returns:
+            str: The URL of the first of these backends on the ring from the key whose
+                outstanding requests are within the bound.
+        """
+        total = sum(outstanding.values())
+        capacity = math.ceil(self.load_factor * (total + 1) / len(outstanding))
+
+        outcome = "home"
+        for url in self._ring.nodes(key):
+            if url not in outstanding:
+                outcome = "unavailable" if outcome == "home" else outcome
+                continue
+            if outstanding[url] + 1 > capacity:
+                outcome = "overloaded" if outcome == "home" else outcome
+                continue
+            self._outcomes[outcome].inc()
+            return url
+
+        # No backend within the bound, with a load factor below 1
+        self._outcomes["overloaded"].inc()
+        return min(outstanding, key=outstanding.__getitem__)
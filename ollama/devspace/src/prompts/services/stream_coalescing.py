@@ -0,0 +1,299 @@
+"""
+This module coalesces the chunks of a streamed generation into fewer, larger chunks.
+
+The stream routes send one SSE event per generated token, so the framing, JSON encoding
+and socket write of each event dominate the CPU for high-throughput machine clients.
+Clients opt in per request with query parameters of the stream route:
+    ?coalesce=true        coalesce with the default window
+    ?coalesce_ms=20       emit the buffered tokens at most 20 ms after the first one
+    ?coalesce_bytes=1024  emit the buffered tokens once they reach 1024 bytes
+The window is set in a context variable of the request, read by the model, which emits
+the buffered chunks as one chunk when either limit is reached. Without the parameters
+every token is sent as soon as it is generated.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+from fastapi import Request
+
+from ..exceptions.custom_exceptions import InvalidRequestParameterError
+
+T = TypeVar("T")
+
+# Query parameters of the stream routes selecting the coalescing window
+COALESCE_PARAM = "coalesce"
+COALESCE_MS_PARAM = "coalesce_ms"
+COALESCE_BYTES_PARAM = "coalesce_bytes"
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+class CoalescingWindow:
+    """
+    The limits of a batch of coalesced chunks.
+
+    Attributes:
+        max_delay (float): Seconds a chunk may be buffered before the batch is emitted.
+        max_bytes (int): Size of the buffered text, in UTF-8 bytes, at which the batch
+            is emitted.
+    """
+
+    def __init__(self, max_delay: float, max_bytes: int):
+        """
+        Initializes the CoalescingWindow.
+
+        Args:
+            max_delay (float): Seconds a chunk may be buffered before the batch is emitted.
+            max_bytes (int): Size of the buffered text, in UTF-8 bytes, at which the batch
+                is emitted.
+        """
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+
+
+# Coalescing window of the current request, None if its tokens are not coalesced
+COALESCING_WINDOW: ContextVar[Optional[CoalescingWindow]] = ContextVar(
+    "coalescing_window", default=None
+)
+
+
+class StreamCoalescing:
+    """
+    Selects the coalescing window of the stream requests from their query parameters.
+
+    Attributes:
+        default_delay (float): Seconds of the window when only the size is requested.
+        default_bytes (int): Bytes of the window when only the delay is requested.
+        max_delay (float): The longest delay a client may request, in seconds.
+        max_bytes (int): The largest size a client may request, in bytes.
+    """
+
+    def __init__(
+        self,
+        default_delay: float,
+        default_bytes: int,
+        max_delay: float,
+        max_bytes: int,
+    ):
+        """
+        Initializes the StreamCoalescing.
+
+        Args:
+            default_delay (float): Seconds of the window when only the size is requested.
+            default_bytes (int): Bytes of the window when only the delay is requested.
+            max_delay (float): The longest delay a client may request, in seconds.
+            max_bytes (int): The largest size a client may request, in bytes.
+        """
+        self.default_delay = default_delay
+        self.default_bytes = default_bytes
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+
+    def window(self, query_params: Mapping[str, str]) -> Optional[CoalescingWindow]:
+        """
+        Select the window requested by the query parameters.
+
+        Args:
+            query_params (Mapping[str, str]): The query parameters of the request.
+
+        Returns:
+            Optional[CoalescingWindow]: The window, or None if coalescing is not requested.
+
+        Raises:
+            InvalidRequestParameterError: If a parameter is malformed or out of bounds.
+        """
+        enabled = query_params.get(COALESCE_PARAM)
+        delay_ms = query_params.get(COALESCE_MS_PARAM)
+        size = query_params.get(COALESCE_BYTES_PARAM)
+
+        if enabled is not None:
+            if enabled.lower() in _FALSE:
+                return None
+            if enabled.lower() not in _TRUE:
+                raise InvalidRequestParameterError(
+                    description=f"{COALESCE_PARAM} must be true or false"
+                )
+        elif delay_ms is None and size is None:
+            return None
+
+        max_delay = self.default_delay
+        if delay_ms is not None:
+            max_delay = _parse(
+                COALESCE_MS_PARAM, delay_ms, float, self.max_delay * 1000
+            )
+            max_delay /= 1000
+        max_bytes = self.default_bytes
+        if size is not None:
+            max_bytes = _parse(COALESCE_BYTES_PARAM, size, int, self.max_bytes)
+        return CoalescingWindow(max_delay, max_bytes)
+
+    def config_modifier(
+        self, config: Dict[str, Any], request: Request
+    ) -> Dict[str, Any]:
+        """
+        Set the window requested by the client for the generation of a request.
+
+        Used as the per request config modifier of the LangServe routes, which runs in the
+        context of the request before its generation starts. The config is not changed.
+
+        Args:
+            config (Dict[str, Any]): The run config.
+            request (Request): The incoming HTTP request.
+
+        Returns:
+            Dict[str, Any]: The run config.
+
+        Raises:
+            InvalidRequestParameterError: If a parameter is malformed or out of bounds.
+        """
+        COALESCING_WINDOW.set(self.window(request.query_params))
+        return config
+
+
+def _parse(
+    name: str,
+    value: str,
+    kind: Callable[[str], Union[int, float]],
+    upper: Union[int, float],
+) -> Any:
+    """
+    Parse a positive query parameter, up to its upper bound.
+
+    Args:
+        name (str): The parameter name.
+        value (str): The parameter value.
+        kind (Callable[[str], Union[int, float]]): The parameter type.
+        upper (Union[int, float]): The largest allowed value.
+
+    Returns:
+        Any: The parsed value.
+
+    Raises:
+        InvalidRequestParameterError: If the value is malformed or out of bounds.
+    """
+    try:
+        parsed = kind(value)
+    except ValueError:
+        parsed = None
+    if parsed is None or not 0 < parsed <= upper:
+        raise InvalidRequestParameterError(
+            description=f"{name} must be a number greater than 0 and at most {upper:g}"
+        )
+    return parsed
+
+
+class _Failure:
+    """An error raised by the source of a coalesced stream."""
+
+    def __init__(self, error: Exception):
+        """
+        Initializes the _Failure.
+
+        Args:
+            error (Exception): The error raised by the source.
+        """
+        self.error = error
+
+
+_END = object()
+
+
+async def coalesce(
+    chunks: AsyncIterator[T],
+    window: CoalescingWindow,
+    size: Callable[[T], int],
+    merge: Callable[[T, T], T],
+) -> AsyncIterator[T]:
+    """
+    Coalesce the chunks of a stream within a window.
+
+    The source is read by a background task, so a batch is emitted when its delay expires
+    even if the source is waiting for the next chunk. The task hands the chunks over
+    through a queue of a single chunk, so the source is not read ahead of a slow consumer.
+    A batch is emitted once the delay since its first chunk expires or its size reaches
+    the window size, and when the source ends or fails.
+
+    Args:
+        chunks (AsyncIterator[T]): The source chunks.
+        window (CoalescingWindow): The limits of a batch.
+        size (Callable[[T], int]): The size of a chunk, in bytes.
+        merge (Callable[[T, T], T]): Merge two consecutive chunks into one.
+
+    Yields:
+        T: The coalesced chunks.
+
+    Raises:
+        Exception: The error raised by the source, once the chunks before it are emitted.
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=1)
+
+    async def read() -> None:
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as exc:
+            await queue.put(_Failure(exc))
+        else:
+            await queue.put(_END)
+
+    reader = asyncio.create_task(read())
+    batch: Optional[T] = None
+    batch_size = 0
+    # Loop time at which the current batch is emitted, whatever its size
+    deadline: Optional[float] = None
+    try:
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    item = await queue.get()
+            except TimeoutError:
+                pass
+            else:
+                if item is _END or isinstance(item, _Failure):
+                    if batch is not None:
+                        yield batch
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    return
+                if batch is None:
+                    batch = item
+                    deadline = loop.time() + window.max_delay
+                else:
+                    batch = merge(batch, item)
+                batch_size += size(item)
+                if batch_size < window.max_bytes:
+                    continue
+
+            emitted, batch, batch_size, deadline = batch, None, 0, None
+            yield emitted
+    finally:
+        reader.cancel()
+        try:
+            await reader
+        except asyncio.CancelledError:
+            # Only the cancellation of the reader is expected, not that of the consumer
+            current = asyncio.current_task()
+            if current is not None and current.cancelling():
+                raise
+        finally:
+            # The reader may stop in the middle of the source, which is closed right away
+            # rather than when it is garbage collected
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
@@ -0,0 +1,424 @@
+"""
+Admission Control Module
+
+This module limits the number of concurrent generation requests per model, in front of
+the model runnable. Ollama only runs a few generations at a time, so requests beyond the
+concurrency limit wait in bounded FIFO queues. When a queue is full, or a request waits
+longer than the queue timeout, the request is rejected right away with a 503 and a
+`Retry-After` header instead of piling up until it times out.
+
+Requests are classified into priority classes, interactive or batch, by a header or else
+by their endpoint. Each class has its own queue. When a slot frees up while both classes
+are waiting, it goes to a class picked by smooth weighted round robin, so interactive
+requests get most slots without starving the batch ones. A request that has waited longer
+than the aging time goes first, whatever its class, which bounds the wait of both classes.
+
+The limit is enforced by a raw ASGI middleware, so a slot is held until the last byte
+of a streamed response is sent. Rejections are rendered by the exception handlers of
+the application, the same way as errors raised in the routes.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import inspect
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Mapping, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..exceptions.custom_exceptions import ServiceOverloadedError
+from .metrics import LATENCY_BUCKETS
+
+ADMISSION_ACTIVE = Gauge(
+    "admission_active_requests",
+    "Generation requests currently admitted.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth",
+    "Generation requests waiting to be admitted.",
+    ["model", "priority"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time admitted generation requests waited in the queue.",
+    ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Generation requests rejected by the admission control.",
+    ["model", "priority", "reason"],
+)
+ADMISSION_REQUEST_DURATION = Histogram(
+    "admission_request_duration_seconds",
+    "Latency of the generation requests, including the queueing delay.",
+    ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# LangServe endpoints that run a generation, the last segment of their path
+GENERATION_ENDPOINTS = frozenset(
+    {"invoke", "batch", "stream", "stream_log", "stream_events"}
+)
+
+# Priority classes of the generation requests
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Weight of the latest request in the moving average of the slot hold time
+HOLD_TIME_SMOOTHING = 0.2
+
+
+class PriorityClass:
+    """
+    A priority class of the generation requests and its wait queue.
+
+    Attributes:
+        name (str): The class name.
+        weight (int): Share of the freed slots, relative to the other waiting classes.
+        max_queue (int): Requests of the class allowed to wait for a slot.
+        waiters (Deque[Tuple[float, asyncio.Future[None]]]): The waiting requests, with
+            the time they were queued, oldest first.
+        credit (int): Credit of the class in the smooth weighted round robin.
+    """
+
+    def __init__(self, name: str, weight: int, max_queue: int):
+        """
+        Initializes the PriorityClass.
+
+        Args:
+            name (str): The class name.
+            weight (int): Share of the freed slots, relative to the other waiting classes.
+            max_queue (int): Requests of the class allowed to wait for a slot.
+        """
+        self.name = name
+        self.weight = weight
+        self.max_queue = max_queue
+        self.waiters: Deque[Tuple[float, "asyncio.Future[None]"]] = deque()
+        self.credit = 0
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with bounded wait queues for the requests of one model.
+
+    Attributes:
+        model (str): The model name.
+        max_concurrency (int): Requests admitted at the same time.
+        queue_timeout (float): Seconds a request may wait for a slot.
+        aging_time (float): Seconds after which a waiting request goes first.
+        classes (Mapping[str, PriorityClass]): The priority classes by name.
+        active (int): Requests currently admitted.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int,
+        classes: Sequence[PriorityClass],
+        queue_timeout: float,
+        aging_time: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes the AdmissionController.
+
+        Args:
+            model (str): The model name.
+            max_concurrency (int): Requests admitted at the same time.
+            classes (Sequence[PriorityClass]): The priority classes.
+            queue_timeout (float): Seconds a request may wait for a slot.
+            aging_time (float): Seconds after which a waiting request goes first.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.aging_time = aging_time
+        self.classes = {priority.name: priority for priority in classes}
+        self.active = 0
+        self._clock = clock
+        self._hold_time = 1.0
+        self._active = ADMISSION_ACTIVE.labels(model)
+        self._queue_depth = {
+            name: ADMISSION_QUEUE_DEPTH.labels(model, name) for name in self.classes
+        }
+        self._wait = {name: ADMISSION_WAIT.labels(model, name) for name in self.classes}
+        self._durations = {
+            name: ADMISSION_REQUEST_DURATION.labels(model, name)
+            for name in self.classes
+        }
+        self._rejections = {
+            (name, reason): ADMISSION_REJECTIONS.labels(model, name, reason)
+            for name in self.classes
+            for reason in ("queue_full", "queue_timeout")
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of requests waiting for a slot."""
+        return sum(len(priority.waiters) for priority in self.classes.values())
+
+    async def acquire(self, priority: str) -> None:
+        """
+        Wait for a slot.
+
+        Args:
+            priority (str): The priority class of the request.
+
+        Raises:
+            ServiceOverloadedError: If the queue of the class is full, or no slot frees
+                up within the queue timeout.
+        """
+        if self.active < self.max_concurrency and not self.queue_depth:
+            self.active += 1
+            self._active.inc()
+            self._wait[priority].observe(0.0)
+            return
+
+        priority_class = self.classes[priority]
+        if len(priority_class.waiters) >= priority_class.max_queue:
+            raise self._reject(priority, "queue_full")
+
+        waiter = (self._clock(), asyncio.get_running_loop().create_future())
+        priority_class.waiters.append(waiter)
+        self._queue_depth[priority].inc()
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter[1]
+        except BaseException as exc:
+            if waiter[1].done() and not waiter[1].cancelled():
+                # The slot was handed over as the wait was interrupted, pass it on
+                self.release(0.0)
+            else:
+                waiter[1].cancel()
+                priority_class.waiters.remove(waiter)
+                self._queue_depth[priority].dec()
+            if isinstance(exc, TimeoutError):
+                raise self._reject(priority, "queue_timeout") from None
+            raise
+        self._wait[priority].observe(self._clock() - waiter[0])
+
+    def release(self, hold_time: float) -> None:
+        """
+        Release a slot, handing it over to the next waiting request if any.
+
+        Args:
+            hold_time (float): Seconds the slot was held.
+        """
+        if hold_time:
+            self._hold_time += HOLD_TIME_SMOOTHING * (hold_time - self._hold_time)
+        priority_class = self._next_class()
+        if priority_class is None:
+            self.active -= 1
+            self._active.dec()
+            return
+
+        _, future = priority_class.waiters.popleft()
+        self._queue_depth[priority_class.name].dec()
+        if not priority_class.waiters:
+            priority_class.credit = 0
+        future.set_result(None)
+
+    def record_duration(self, priority: str, seconds: float) -> None:
+        """
+        Record the latency of a finished request.
+
+        Args:
+            priority (str): The priority class of the request.
+            seconds (float): The latency, including the queueing delay.
+        """
+        self._durations[priority].observe(seconds)
+
+    def retry_after(self) -> int:
+        """
+        Estimate when a slot should be available to a new request.
+
+        Returns:
+            int: Seconds until the queue ahead of a new request is drained.
+        """
+        queued = self.queue_depth + 1
+        return max(1, math.ceil(self._hold_time * queued / self.max_concurrency))
+
+    def _next_class(self) -> Optional[PriorityClass]:
+        """
+        Pick the class that gets a freed slot.
+
+        The class of a request that has waited longer than the aging time goes first.
+        Otherwise, the waiting classes are picked by smooth weighted round robin.
+
+        Returns:
+            Optional[PriorityClass]: The picked class, or None if nothing is waiting.
+        """
+        waiting = [priority for priority in self.classes.values() if priority.waiters]
+        if not waiting:
+            return None
+
+        oldest = min(waiting, key=lambda priority: priority.waiters[0][0])
+        if self._clock() - oldest.waiters[0][0] >= self.aging_time:
+            return oldest
+
+        total = 0
+        for priority in waiting:
+            priority.credit += priority.weight
+            total += priority.weight
+        picked = max(waiting, key=lambda priority: priority.credit)
+        picked.credit -= total
+        return picked
+
+    def _reject(self, priority: str, reason: str) -> ServiceOverloadedError:
+        """
+        Count a rejected request and build its error.
+
+        Args:
+            priority (str): The priority class of the request.
+            reason (str): Either "queue_full" or "queue_timeout".
+
+        Returns:
+            ServiceOverloadedError: The error to raise.
+        """
+        self._rejections[(priority, reason)].inc()
+        return ServiceOverloadedError(
+            retry_after=self.retry_after(),
+            description=f"Model {self.model} is at capacity, retry later",
+        )
+
+
+class AdmissionMiddleware:
+    """Middleware to admit the generation requests through their model's controller."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controllers: Mapping[str, AdmissionController],
+        priority_header: str = "X-Priority",
+    ):
+        """
+        Initializes the AdmissionMiddleware.
+
+        Args:
+            app (ASGIApp): The ASGI app.
+            controllers (Mapping[str, AdmissionController]): The admission controllers by
+                the path prefix of the model routes.
+            priority_header (str): The request header selecting the priority class.
+        """
+        self.app = app
+        self.controllers = dict(controllers)
+        self.priority_header = priority_header.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Dispatches the request once it is admitted, or renders its rejection.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        prefix, _, endpoint = scope["path"].rpartition("/")
+        controller = self._controller(prefix, endpoint)
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        priority = self._priority(scope, controller, endpoint)
+        start = time.perf_counter()
+        try:
+            await controller.acquire(priority)
+        except ServiceOverloadedError as exc:
+            await render_error(scope, receive, send, exc)
+            return
+
+        admitted = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            end = time.perf_counter()
+            controller.release(end - admitted)
+            controller.record_duration(priority, end - start)
+
+    def _controller(self, prefix: str, endpoint: str) -> Optional[AdmissionController]:
+        """
+        Find the controller of a generation request.
+
+        Args:
+            prefix (str): The request path, up to its last segment.
+            endpoint (str): The last segment of the request path.
+
+        Returns:
+            Optional[AdmissionController]: The controller, or None if the request does
+                not run a generation.
+        """
+        if endpoint not in GENERATION_ENDPOINTS:
+            return None
+        for route_prefix, controller in self.controllers.items():
+            if prefix == route_prefix or prefix.startswith(route_prefix + "/c/"):
+                return controller
+        return None
+
+    def _priority(
+        self, scope: Scope, controller: AdmissionController, endpoint: str
+    ) -> str:
+        """
+        Classify a generation request.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+            controller (AdmissionController): The controller of the request.
+            endpoint (str): The last segment of the request path.
+
+        Returns:
+            str: The priority class named by the priority header, or else batch for the
+                batch endpoint and interactive for the others.
+        """
+        for name, value in scope["headers"]:
+            if name == self.priority_header:
+                priority = value.decode("latin-1").strip().lower()
+                if priority in controller.classes:
+                    return priority
+                break
+        return BATCH if endpoint == "batch" else INTERACTIVE
+
+
+async def render_error(
+    scope: Scope, receive: Receive, send: Send, exc: Exception
+) -> None:
+    """
+    Send the response of the application's exception handler for an error.
+
+    Args:
+        scope (Scope): The ASGI connection scope.
+        receive (Receive): The ASGI receive channel.
+        send (Send): The ASGI send channel.
+        exc (Exception): The error.
+
+    Raises:
+        Exception: The error itself, if no exception handler is registered for it.
+    """
+    handlers = scope["app"].exception_handlers
+    for cls in type(exc).__mro__:
+        handler = handlers.get(cls)
+        if handler is not None:
+            request = Request(scope, receive)
+            if inspect.iscoroutinefunction(handler):
+                response = await handler(request, exc)
+            else:
+                response = await run_in_threadpool(handler, request, exc)
+            await response(scope, receive, send)
+            return
+    raise exc
@@ -41,16 +41,16 @@ def load_json_file(filename: str) -> Dict[str, Any]:
         with open(filename, "r", encoding="utf-8") as json_file:
             return json.load(json_file)
     except FileNotFoundError as fileexc:
-        AppLogger.error(f"File not found: {filename}")
+        AppLogger.error("File not found: %s", filename)
         raise JSONFileNotFoundError(filename) from fileexc
     except json.JSONDecodeError as jsonexc:
-        AppLogger.error(f"Invalid JSON in file: {filename}. Error: {str(jsonexc)}")
+        AppLogger.error("Invalid JSON in file: %s. Error: %s", filename, jsonexc)
         raise JSONInvalidError(filename, str(jsonexc)) from jsonexc
     except UnicodeDecodeError as uniexc:
-        AppLogger.error(f"Invalid encoding in file: {filename}. Error: {str(uniexc)}")
+        AppLogger.error("Invalid encoding in file: %s. Error: %s", filename, uniexc)
         raise JSONInvalidEncodingError(filename, str(uniexc)) from uniexc
     except Exception as exc:
-        AppLogger.error(f"Unexpected error while reading '{filename}': {str(exc)}")
+        AppLogger.error("Unexpected error while reading '%s': %s", filename, exc)
         raise JSONFileError(
             "Unexpected error while reading '%s': %s", filename, str(exc)
         ) from exc
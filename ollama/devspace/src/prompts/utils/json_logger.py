@@ -2,9 +2,15 @@
 Json Formatter Module.
 
 This module provides a custom JSON formatter for logging which
-excludes specific fields from the output.
+excludes specific fields from the output, and a faster formatter
+with the same output for high log volumes.
 """
 
+import json
+import logging
+import time
+from typing import Any, Dict
+
 from pythonjsonlogger import jsonlogger
 
 
@@ -32,3 +38,94 @@ class JsonFormatter(jsonlogger.JsonFormatter):
     def __init__(self, *args, **kwargs):
         kwargs["reserved_attrs"] = ["color_message", *jsonlogger.RESERVED_ATTRS]
         super().__init__(*args, **kwargs)
+
+
+class FastJsonFormatter(JsonFormatter):
+    """Drop-in replacement of `JsonFormatter` for high log volumes.
+
+    The output is identical to `JsonFormatter`, but the work that does not depend on
+    the record is done once: the fields of the format string and the skipped attributes
+    are resolved when the formatter is created, the JSON encoder is created once and
+    reused, and the date part of `asctime` is cached per second. Each record is built
+    into a single plain dict in one pass.
+
+    Formatters configured with a custom serializer, renamed fields or a timestamp field
+    fall back to the `JsonFormatter` implementation.
+
+    Usage:
+        formatter = FastJsonFormatter(fmt="%(asctime)s %(levelname)s %(message)s")
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fields = tuple(self._required_fields)
+        self._skipped = frozenset(self._skip_fields)
+        self._needs_asctime = "asctime" in self._fields
+        self._fallback = bool(
+            self.json_serializer is not json.dumps
+            or self.rename_fields
+            or self.timestamp
+        )
+        self._encode = self.json_encoder(
+            default=self.json_default,
+            indent=self.json_indent,
+            ensure_ascii=self.json_ensure_ascii,
+        ).encode
+        self._cached_second = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt=None) -> str:
+        """Format the creation time, formatting the date part once per second."""
+        if (
+            datefmt
+            or not self.default_msec_format
+            or self.converter is not time.localtime
+        ):
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, text = self._cached_second
+        if second != cached_second:
+            text = time.strftime(self.default_time_format, time.localtime(second))
+            self._cached_second = (second, text)
+        return self.default_msec_format % (text, record.msecs)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Formats a log record and serializes it to JSON."""
+        if self._fallback:
+            return super().format(record)
+
+        message_dict: Dict[str, Any] = {}
+        if isinstance(record.msg, dict):
+            message_dict = record.msg
+            record.message = ""
+        else:
+            record.message = record.getMessage()
+        if self._needs_asctime:
+            record.asctime = self.formatTime(record, self.datefmt)
+
+        if record.exc_info and not message_dict.get("exc_info"):
+            message_dict["exc_info"] = self.formatException(record.exc_info)
+        if not message_dict.get("exc_info") and record.exc_text:
+            message_dict["exc_info"] = record.exc_text
+        if record.stack_info and not message_dict.get("stack_info"):
+            message_dict["stack_info"] = self.formatStack(record.stack_info)
+
+        attributes = record.__dict__
+        log_record = {field: attributes.get(field) for field in self._fields}
+        if self.static_fields:
+            log_record.update(self.static_fields)
+        if message_dict:
+            log_record.update(message_dict)
+        # Set difference runs in C, most records have at most one extra attribute
+        extra_keys = attributes.keys() - self._skipped
+        if len(extra_keys) > 1:
+            for key, value in attributes.items():
+                if key in extra_keys and not (
+                    isinstance(key, str) and key.startswith("_")
+                ):
+                    log_record[key] = value
+        elif extra_keys:
+            (key,) = extra_keys
+            if not (isinstance(key, str) and key.startswith("_")):
+                log_record[key] = attributes[key]
+
+        return self.prefix + self._encode(self.process_log_record(log_record))
@@ -1,6 +1,6 @@
 """
-This module provides a logging filter to suppress specific
-log records based on their content.
+This module provides a logging filter to suppress and sample
+access log records based on their request path.
 
 Author: Patryk Golabek
 Company: Translucent Computing Inc.
@@ -8,34 +8,73 @@ Copyright: 2023 Translucent Computing Inc.
 """
 
 import logging
-from typing import List
+import random
+from typing import Callable, Dict, List, Mapping, Optional
+
+# Number of arguments of a uvicorn access log record:
+# (client address, method, path with query string, HTTP version, status code)
+ACCESS_LOG_ARGS = 5
 
 
 class SuppressSpecificLogEntries(logging.Filter):
     """
-    A logging filter to suppress log records containing specific strings.
+    A logging filter to suppress or sample uvicorn access log records by request path.
+
+    The request path is read from the arguments of the access log record, so the
+    message is never formatted. Paths are matched by a dictionary lookup for exact
+    paths, then by walking up the path segments for prefixes, which is a lookup per
+    segment whatever the number of rules. The most specific rule wins.
+
+    A rule ending with "*" matches a path prefix on segment boundaries, for example
+    "/static/*" matches "/static" and "/static/app.js". Responses with a status code
+    at or above `always_log_status` are always logged.
 
     Attributes:
-        suppressed_entries (list): A list of strings to be suppressed in logs.
+        suppressed_entries (list): The paths whose access logs are suppressed.
+        sample_rates (dict): The share of the access logs kept, by path.
+        always_log_status (int): The status code from which records are always logged.
 
     Methods:
         filter(record: logging.LogRecord) -> bool:
-            Determines if the log record should be suppressed based on its message content.
+            Determines if the log record should be suppressed based on its request path.
     """
 
-    def __init__(self, suppressed_entries: List[str]):
+    def __init__(
+        self,
+        suppressed_entries: List[str],
+        sample_rates: Optional[Mapping[str, float]] = None,
+        always_log_status: int = 500,
+        sampler: Callable[[], float] = random.random,
+    ):
         """
-        Initializes the SuppressSpecificLogEntries filter with a list of strings to suppress.
+        Initializes the SuppressSpecificLogEntries filter with the path rules.
 
         Args:
-            suppressed_entries (List[str]): A list of strings to be suppressed in logs.
+            suppressed_entries (List[str]): The paths whose access logs are suppressed.
+            sample_rates (Optional[Mapping[str, float]]): The share of the access logs
+                kept, from 0 to 1, by path.
+            always_log_status (int): The status code from which records are always logged.
+            sampler (Callable[[], float]): Returns a random number in [0, 1).
         """
         super().__init__()
         self.suppressed_entries = suppressed_entries
+        self.sample_rates = dict(sample_rates or {})
+        self.always_log_status = always_log_status
+        self._sampler = sampler
+        self._exact: Dict[str, float] = {}
+        self._prefixes: Dict[str, float] = {}
+
+        rules = {entry: 0.0 for entry in suppressed_entries}
+        rules.update(self.sample_rates)
+        for pattern, rate in rules.items():
+            if pattern.endswith("*"):
+                self._prefixes[pattern[:-1].rstrip("/")] = rate
+            else:
+                self._exact[pattern] = rate
 
     def filter(self, record: logging.LogRecord) -> bool:
         """
-        Checks if the log record's message contains any of the suppressed strings.
+        Checks if the access log record's request path is suppressed or sampled out.
 
         Args:
             record (logging.LogRecord): The log record to be checked.
@@ -43,6 +82,39 @@ class SuppressSpecificLogEntries(logging.Filter):
         Returns:
             bool: True if the log record should be allowed, False if it should be suppressed.
         """
-        return not any(
-            entry in record.getMessage() for entry in self.suppressed_entries
-        )
+        args = record.args
+        if not isinstance(args, tuple) or len(args) != ACCESS_LOG_ARGS:
+            return True
+
+        status = args[4]
+        if isinstance(status, int) and status >= self.always_log_status:
+            return True
+
+        path = str(args[2]).partition("?")[0]
+        rate = self._exact.get(path)
+        if rate is None:
+            rate = self._prefix_rate(path)
+        if rate is None or rate >= 1:
+            return True
+        return rate > 0 and self._sampler() < rate
+
+    def _prefix_rate(self, path: str) -> Optional[float]:
+        """
+        Find the rate of the longest prefix rule matching a path.
+
+        Args:
+            path (str): The request path, without its query string.
+
+        Returns:
+            Optional[float]: The rate, or None if no prefix rule matches.
+        """
+        if not self._prefixes:
+            return None
+        prefix = path.rstrip("/")
+        while True:
+            rate = self._prefixes.get(prefix)
+            if rate is not None:
+                return rate
+            if not prefix:
+                return None
+            prefix = prefix[: prefix.rfind("/")]
@@ -0,0 +1,206 @@
+"""
+This module provides a non-blocking logging pipeline.
+
+The handlers configured on the loggers are replaced by queue handlers, which only put
+the records on a bounded queue. A background thread takes them off the queue, formats
+them and writes them with the original handlers, so JSON encoding and stdout writes
+never run on the event loop thread.
+
+When the queue is full, new records are either dropped and counted, or the logging
+thread blocks until there is room, depending on the policy. Stopping the pipeline puts
+the original handlers back and flushes the records still in the queue.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import copy
+import logging
+import logging.handlers
+import queue
+from typing import Dict, List, Optional, Sequence
+
+from prometheus_client import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the logging queue was full.",
+)
+
+DROP = "drop"
+BLOCK = "block"
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler with a full queue policy.
+
+    Attributes:
+        block (bool): Whether to wait for room in a full queue instead of dropping.
+        dropped (int): Records dropped because the queue was full.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]", block: bool):
+        """
+        Initializes the BoundedQueueHandler.
+
+        Args:
+            log_queue (queue.Queue[logging.LogRecord]): The bounded queue.
+            block (bool): Whether to wait for room in a full queue instead of dropping.
+        """
+        super().__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepare a record for the queue without formatting it.
+
+        The message arguments are merged right away, so later changes to the argument
+        objects do not change the message. Everything else, including tracebacks, is
+        formatted on the background thread.
+
+        Args:
+            record (logging.LogRecord): The record.
+
+        Returns:
+            logging.LogRecord: A copy of the record, with its message merged.
+        """
+        record = copy.copy(record)
+        if record.args and isinstance(record.msg, str):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Put a record on the queue, dropping it or waiting when the queue is full.
+
+        Args:
+            record (logging.LogRecord): The prepared record.
+        """
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Queue listener that waits for room in a full queue to stop."""
+
+    def enqueue_sentinel(self) -> None:
+        """Put the sentinel that stops the thread, after the queued records."""
+        self.queue.put(self._sentinel)  # type: ignore[attr-defined]
+
+
+class LogQueue:
+    """
+    Moves the handlers of loggers behind bounded queues served by background threads.
+
+    Each distinct handler gets its own queue and thread, and is replaced by the same
+    queue handler on every logger it was attached to.
+
+    Attributes:
+        queue_handlers (List[BoundedQueueHandler]): The queue handlers in use.
+    """
+
+    def __init__(self, loggers: Sequence[logging.Logger], size: int, policy: str):
+        """
+        Initializes the LogQueue. The queues are installed by `start`.
+
+        Args:
+            loggers (Sequence[logging.Logger]): The loggers whose handlers are queued.
+            size (int): The capacity of each queue, in records.
+            policy (str): Either "drop" or "block", for records logged to a full queue.
+
+        Raises:
+            ValueError: If the policy is unknown.
+        """
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f"Unknown logging queue policy: {policy}")
+        self.loggers = list(loggers)
+        self.size = size
+        self.block = policy == BLOCK
+        self.queue_handlers: List[BoundedQueueHandler] = []
+        self._original: Dict[logging.Logger, List[logging.Handler]] = {}
+        self._listeners: List[logging.handlers.QueueListener] = []
+
+    @property
+    def dropped(self) -> int:
+        """The number of records dropped by all the queues."""
+        return sum(handler.dropped for handler in self.queue_handlers)
+
+    def start(self) -> None:
+        """Replace the handlers of the loggers by queue handlers and start the threads."""
+        wrappers: Dict[logging.Handler, BoundedQueueHandler] = {}
+        for logger in self.loggers:
+            self._original[logger] = list(logger.handlers)
+            for handler in self._original[logger]:
+                if handler not in wrappers:
+                    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(self.size)
+                    wrappers[handler] = BoundedQueueHandler(log_queue, self.block)
+                    self._listeners.append(
+                        _QueueListener(log_queue, handler, respect_handler_level=True)
+                    )
+                logger.removeHandler(handler)
+                logger.addHandler(wrappers[handler])
+
+        self.queue_handlers = list(wrappers.values())
+        for listener in self._listeners:
+            listener.start()
+
+    def stop(self) -> None:
+        """
+        Put the original handlers back and flush the queued records.
+
+        The loggers write synchronously again once stopped, so records logged later
+        during shutdown are not lost.
+        """
+        for logger, handlers in self._original.items():
+            for handler in list(logger.handlers):
+                if isinstance(handler, BoundedQueueHandler):
+                    logger.removeHandler(handler)
+            for handler in handlers:
+                logger.addHandler(handler)
+        self._original.clear()
+
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners.clear()
+
+
+_active: Optional[LogQueue] = None
+
+
+def install_log_queue(
+    loggers: Sequence[logging.Logger], size: int, policy: str
+) -> LogQueue:
+    """
+    Queue the handlers of the loggers.
+
+    Args:
+        loggers (Sequence[logging.Logger]): The loggers whose handlers are queued.
+        size (int): The capacity of each queue, in records.
+        policy (str): Either "drop" or "block", for records logged to a full queue.
+
+    Returns:
+        LogQueue: The started logging queue.
+    """
+    global _active
+    stop_log_queue()
+    _active = LogQueue(loggers, size, policy)
+    _active.start()
+    return _active
+
+
+def stop_log_queue() -> None:
+    """Stop the installed logging queue, if any, flushing its records."""
+    global _active
+    if _active is not None:
+        _active.stop()
+        _active = None
@@ -4,16 +4,43 @@ This module defines a logger configuration for the application.
 It defines a class AppLogger which contains a class method `get_logger`
 that configures and returns a logger with a name defined as a class variable.
 
+The logger is initialized once. Logging at a disabled level returns after a single
+level check, and messages are formatted from their arguments only when emitted.
+The ID of the current request is attached to the records from a context variable.
+
 Copyright 2024 Translucent Computing Inc. All rights reserved.
 Author: Patryk Golabek
 """
 
 import logging
 import sys
-import traceback
-from typing import Any, Optional
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from tenacity import RetryCallState
+
+# ID of the request being handled, set by the RequestIDMiddleware
+REQUEST_ID: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class RequestIdFilter(logging.Filter):
+    """Logging filter attaching the ID of the current request to the records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Set the `request_id` attribute of a record, unless it was given as an extra.
+
+        Args:
+            record (logging.LogRecord): The log record.
 
-from tenacity import Future, RetryCallState
+        Returns:
+            bool: Always True, no record is filtered out.
+        """
+        if getattr(record, "request_id", None) is None:
+            request_id = REQUEST_ID.get()
+            if request_id is not None:
+                record.request_id = request_id
+        return True
 
 
 class AppLogger:
@@ -21,6 +48,8 @@ class AppLogger:
 
     _logger_name = "kubert"
     logger: logging.Logger = logging.getLogger(_logger_name)
+    _initialized = False
+    _request_id_filter = RequestIdFilter()
 
     @classmethod
     def set_log_level(cls, log_level: int) -> None:
@@ -49,27 +78,58 @@ class AppLogger:
         # Create new handler, targeting docker logs, sending to the console.
         handler = logging.StreamHandler(sys.stdout)
         formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+            "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s",
+            defaults={"request_id": "-"},
         )
         handler.setFormatter(formatter)
         cls.logger.addHandler(handler)
+        cls.logger.addFilter(cls._request_id_filter)
 
         # Set the log level of the logger and its handlers.
         cls.set_log_level(log_level)
+        cls._initialized = True
+
+    @classmethod
+    def apply_logging_config(
+        cls, logging_config: Dict[str, Any], log_level: int = logging.DEBUG
+    ) -> None:
+        """
+        Hand the output of the logger to a logging configuration applied with dictConfig.
+
+        Unless the configuration configures the logger, its console handler is removed and
+        its records propagate to the configured handlers, so they are not also written
+        synchronously to the console.
+
+        Args:
+            logging_config (Dict[str, Any]): The applied logging configuration.
+            log_level (int): The log level of the logger when it is not configured.
+                Defaults to logging.DEBUG.
+        """
+        if cls._logger_name not in logging_config.get("loggers", {}):
+            for item in cls.logger.handlers[:]:
+                cls.logger.removeHandler(item)
+            cls.logger.setLevel(log_level)
+            cls.logger.propagate = True
+        cls.logger.addFilter(cls._request_id_filter)
+        cls._initialized = True
 
     @classmethod
     def get_logger(cls) -> logging.Logger:
         """
         Retrieves the logger.
 
-        If the logger doesn't have any handlers, it initializes it with default configuration.
-        If the logger was configured externally, it simply retrieves it without modification.
+        On first use, if the logger doesn't have any handlers, it initializes it with
+        default configuration. If the logger was configured externally, it only attaches
+        the request ID filter to it.
 
         Return:
             logging.Logger: Configured logger with the name specified in the class variable.
         """
-        if cls.logger.handlers is None or len(cls.logger.handlers) == 0:
-            cls.initialize_logger()
+        if not cls._initialized:
+            if not cls.logger.handlers:
+                cls.initialize_logger()
+            cls.logger.addFilter(cls._request_id_filter)
+            cls._initialized = True
 
         return cls.logger
 
@@ -78,115 +138,133 @@ class AppLogger:
         """
         Logs a debug message.
 
-        If the logger has not been initialized, it initializes it.
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
 
         Args:
             message (str): The message to log.
             *args: Additional arguments to the message.
             **kwargs: Additional keyword arguments to the message.
         """
-        cls.get_logger()
-        if cls.logger.isEnabledFor(logging.DEBUG):
-            cls.logger.debug(message, *args, **kwargs)
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(message, *args, **kwargs)
 
     @classmethod
     def info(cls, message: str, *args: Any, **kwargs: Any) -> None:
         """
         Logs a info message.
 
-        If the logger has not been initialized, it initializes it.
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
 
         Args:
             message (str): The message to log.
             *args: Additional arguments to the message.
             **kwargs: Additional keyword arguments to the message.
         """
-        cls.get_logger()
-        if cls.logger.isEnabledFor(logging.INFO):
-            cls.logger.info(message, *args, **kwargs)
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(message, *args, **kwargs)
 
     @classmethod
     def warning(cls, message: str, *args: Any, **kwargs: Any) -> None:
         """
         Logs a warning message.
 
-        If the logger has not been initialized, it initializes it.
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
 
         Args:
             message (str): The message to log.
             *args: Additional arguments to the message.
             **kwargs: Additional keyword arguments to the message.
         """
-        cls.get_logger()
-        if cls.logger.isEnabledFor(logging.WARNING):
-            cls.logger.warning(message, *args, **kwargs)
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(message, *args, **kwargs)
 
     @classmethod
     def exception(cls, message: str, *args: Any, **kwargs: Any) -> None:
         """
         Logs a exception message.
 
-        If the logger has not been initialized, it initializes it.
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
 
         Args:
             message (str): The message to log.
             *args: Additional arguments to the message.
             **kwargs: Additional keyword arguments to the message.
         """
-        cls.get_logger()
-        if cls.logger.isEnabledFor(logging.ERROR):
-            cls.logger.exception(message, *args, **kwargs)
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(logging.ERROR):
+            logger.exception(message, *args, **kwargs)
 
     @classmethod
     def error(cls, message: str, *args: Any, **kwargs: Any) -> None:
         """
         Logs a error message.
 
-        If the logger has not been initialized, it initializes it.
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
 
         Args:
             message (str): The message to log.
             *args: Additional arguments to the message.
             **kwargs: Additional keyword arguments to the message.
         """
-        cls.get_logger()
-        if cls.logger.isEnabledFor(logging.ERROR):
-            cls.logger.error(message, *args, **kwargs)
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error(message, *args, **kwargs)
+
+    @classmethod
+    def log(cls, level: int, message: str, *args: Any, **kwargs: Any) -> None:
+        """
+        Logs a message at the given level.
+
+        If the logger has not been initialized, it initializes it. The message is
+        formatted with its arguments only if the level is enabled.
+
+        Args:
+            level (int): The logging level.
+            message (str): The message to log.
+            *args: Additional arguments to the message.
+            **kwargs: Additional keyword arguments to the message.
+        """
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if logger.isEnabledFor(level):
+            logger.log(level, message, *args, **kwargs)
 
     @classmethod
     def log_retry_attempt(cls, retry_state: RetryCallState) -> None:
         """
         Log retry attempt and the exception information.
 
+        The exception traceback is only formatted if debug logging is enabled.
+
         Args:
             retry_state (RetryCallState): The state of the retry attempt.
         """
-        # Initializing the log message with the current retry attempt number
-        log_msg: str = f"Retrying for {retry_state.attempt_number} "
-
-        # Getting the outcome of the current attempt
-        outcome: Future = retry_state.outcome
-
-        # Ensure outcome is not None and has an exception
-        if outcome and outcome.exception():
-            # Extracting the exception (if any) from the outcome
-            exception: Optional[BaseException] = outcome.exception()  # type: ignore
-
-            # Ensure we have a traceback before appending it to the message
-            if exception:
-                # Adding the exception details to the log message
-                log_msg += f"time(s) due to: {str(exception)}"  # type: ignore
-
-                # Formatting the traceback and adding it to the log message
-                log_msg += "\n" + "".join(
-                    traceback.format_exception(
-                        etype=type(exception),  # type: ignore
-                        value=exception,  # type: ignore
-                        tb=exception.__traceback__,  # type: ignore
-                    )
-                )
-        else:
-            log_msg += "time(s). No exception captured."
+        logger = cls.logger if cls._initialized else cls.get_logger()
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+
+        # Getting the exception of the current attempt, if any
+        outcome = retry_state.outcome
+        exception: Optional[BaseException] = (
+            outcome.exception() if outcome and outcome.failed else None
+        )
 
-        # Sending the log message to the logger with a level of debug
-        cls.debug(log_msg)
+        if exception is not None:
+            logger.debug(
+                "Retrying for %d time(s) due to: %s",
+                retry_state.attempt_number,
+                exception,
+                exc_info=exception,
+            )
+        else:
+            logger.debug(
+                "Retrying for %d time(s). No exception captured.",
+                retry_state.attempt_number,
+            )
@@ -0,0 +1,190 @@
+"""
+Metrics Module
+
+This module defines the Prometheus metrics of the application and a raw ASGI middleware
+that records the HTTP request metrics.
+
+The recording path is kept cheap: labelled metric children are bound once and cached,
+so recording a request costs a dictionary lookup and a histogram observation. The LLM
+metrics are bound per model through `ModelMetrics.for_model` and are observed once per
+generation, never per token.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import time
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Buckets in seconds, sized for LLM requests that take from milliseconds to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 300)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, until the last byte of the response body.",
+    ["method", "route", "status_code"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being processed.",
+    multiprocess_mode="livesum",
+)
+
+OLLAMA_GENERATIONS_IN_FLIGHT = Gauge(
+    "ollama_generations_in_flight",
+    "Ollama generations currently running.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+OLLAMA_TIME_TO_FIRST_TOKEN = Histogram(
+    "ollama_time_to_first_token_seconds",
+    "Time from the Ollama request to the first generated token.",
+    ["model"],
+    buckets=TTFT_BUCKETS,
+)
+OLLAMA_TOKENS_PER_SECOND = Histogram(
+    "ollama_tokens_per_second",
+    "Generation speed of an Ollama response.",
+    ["model"],
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+OLLAMA_PROMPT_EVAL_DURATION = Histogram(
+    "ollama_prompt_eval_seconds",
+    "Time Ollama spent evaluating the prompt of a response, shorter when it reuses the "
+    "prompt cache of the conversation.",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+OLLAMA_GENERATED_TOKENS = Counter(
+    "ollama_generated_tokens_total",
+    "Tokens generated by Ollama.",
+    ["model"],
+)
+OLLAMA_UPSTREAM_ERRORS = Counter(
+    "ollama_upstream_errors_total",
+    "Failed Ollama requests by error type.",
+    ["model", "error"],
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class ModelMetrics:
+    """
+    The LLM metrics bound to the labels of a single model.
+
+    Attributes:
+        model (str): The model name.
+        in_flight (Gauge): Generations currently running.
+        time_to_first_token (Histogram): Time to the first generated token.
+        tokens_per_second (Histogram): Generation speed.
+        prompt_eval_seconds (Histogram): Time evaluating the prompt.
+        generated_tokens (Counter): Generated tokens.
+    """
+
+    def __init__(self, model: str):
+        """
+        Initializes the ModelMetrics by binding the metric children for the model.
+
+        Args:
+            model (str): The model name.
+        """
+        self.model = model
+        self.in_flight = OLLAMA_GENERATIONS_IN_FLIGHT.labels(model)
+        self.time_to_first_token = OLLAMA_TIME_TO_FIRST_TOKEN.labels(model)
+        self.tokens_per_second = OLLAMA_TOKENS_PER_SECOND.labels(model)
+        self.prompt_eval_seconds = OLLAMA_PROMPT_EVAL_DURATION.labels(model)
+        self.generated_tokens = OLLAMA_GENERATED_TOKENS.labels(model)
+        self._errors: Dict[str, Any] = {}
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def for_model(model: str) -> "ModelMetrics":
+        """
+        Get the cached metrics for a model.
+
+        Args:
+            model (str): The model name.
+
+        Returns:
+            ModelMetrics: The metrics bound to the model.
+        """
+        return ModelMetrics(model)
+
+    def record_error(self, exc: BaseException) -> None:
+        """
+        Count a failed Ollama request.
+
+        Args:
+            exc (BaseException): The exception raised by the request.
+        """
+        error = type(exc).__name__
+        counter = self._errors.get(error)
+        if counter is None:
+            counter = self._errors[error] = OLLAMA_UPSTREAM_ERRORS.labels(
+                self.model, error
+            )
+        counter.inc()
+
+
+class MetricsMiddleware:
+    """Middleware to record the latency and the number of in-flight HTTP requests."""
+
+    def __init__(self, app: ASGIApp):
+        """
+        Initializes the MetricsMiddleware.
+
+        Args:
+            app (ASGIApp): The ASGI app.
+        """
+        self.app = app
+        self._durations: Dict[Tuple[str, str, int], Any] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Dispatches the request and records its metrics.
+
+        The route label is the path template of the matched route, which keeps the
+        label cardinality bounded.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            key = (
+                scope["method"],
+                route.path if route is not None else UNMATCHED_ROUTE,
+                status_code,
+            )
+            duration = self._durations.get(key)
+            if duration is None:
+                duration = self._durations[key] = HTTP_REQUEST_DURATION.labels(*key)
+            duration.observe(time.perf_counter() - start)
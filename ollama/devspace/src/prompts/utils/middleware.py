@@ -2,7 +2,13 @@
 Middleware Module
 
 This module defines custom middleware classes for the FastAPI application.
-It includes middleware for handling timeouts and generating request IDs for each request.
+It includes middleware for handling timeouts, including deadlines for streamed
+LLM responses, and generating request IDs for each request.
+
+Both middlewares are implemented as raw ASGI applications instead of Starlette's
+`BaseHTTPMiddleware`, which re-buffers every response body through an extra memory
+stream and task group. The `send` messages, including the chunks of the SSE token
+streams, are passed straight through to the server.
 
 Author: Patryk Golabek
 Company: Translucent Computing Inc.
@@ -10,68 +16,208 @@ Copyright: 2024 Translucent Computing Inc.
 """
 
 import asyncio
+import json
+import math
 import uuid
-from typing import Any, Awaitable, Callable
-
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
-
-
-class TimeoutMiddleware(BaseHTTPMiddleware):
-    """Middleware to deal with long running requests."""
-
-    def __init__(self, app: Any, timeout: int):
+from typing import Optional, Sequence
+
+from sse_starlette.sse import ServerSentEvent
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .logger import REQUEST_ID, AppLogger
+
+
+class TimeoutMiddleware:
+    """
+    Middleware to deal with long running requests.
+
+    The `timeout` bounds the time it takes the application to start the response.
+    Server-sent event streams under one of the `stream_paths` are additionally bounded by
+    a first-token deadline, an idle deadline between chunks and a total duration deadline.
+    When a stream deadline is hit, the application is cancelled, which closes the upstream
+    Ollama request, and the stream is ended with an SSE `error` event.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        timeout: float,
+        stream_paths: Sequence[str] = (),
+        first_token_timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+    ):
         """
-        Initializes the TimeoutMiddleware with the given timeout value.
+        Initializes the TimeoutMiddleware with the given timeout values.
 
         Args:
-            app (Any): The ASGI app.
-            timeout (int): The timeout value in seconds.
+            app (ASGIApp): The ASGI app.
+            timeout (float): The time in seconds to start the response.
+            stream_paths (Sequence[str]): Path prefixes whose event streams get the stream
+                deadlines.
+            first_token_timeout (Optional[float]): Seconds from the request start to the
+                first chunk.
+            idle_timeout (Optional[float]): Seconds allowed between two consecutive chunks.
+            total_timeout (Optional[float]): Seconds allowed for the whole stream.
         """
-        super().__init__(app)
+        self.app = app
         self.timeout = timeout
+        self.stream_paths = tuple(stream_paths)
+        self.first_token_timeout = first_token_timeout or math.inf
+        self.idle_timeout = idle_timeout or math.inf
+        self.total_timeout = total_timeout or math.inf
 
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Dispatches the request and handles timeouts.
 
+        Once the response headers are sent, the deadline is lifted, unless the response
+        is an event stream under one of the stream paths.
+
         Args:
-            request (Request): The incoming HTTP request.
-            call_next (Callable[[Request], Awaitable[Response]]): The next middleware or route handler.
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        total_at = started_at + self.total_timeout
+        watch_stream = scope["path"].startswith(self.stream_paths)
+        response_started = False
+        streaming = False
+        first_chunk_seen = False
+        deadline = asyncio.timeout_at(started_at + self.timeout)
+
+        def reschedule(when: float) -> None:
+            deadline.reschedule(None if when == math.inf else when)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started, streaming, first_chunk_seen
+            if deadline.expired():
+                # The application is unwinding after a stream deadline, drop its output.
+                return
+            if streaming:
+                body = message.get("body", b"")
+                if body and not body.startswith(b":"):
+                    first_chunk_seen = True
+                    reschedule(min(loop.time() + self.idle_timeout, total_at))
+            elif not response_started and message["type"] == "http.response.start":
+                response_started = True
+                streaming = watch_stream and _is_event_stream(message)
+                if streaming:
+                    reschedule(min(started_at + self.first_token_timeout, total_at))
+                else:
+                    reschedule(math.inf)
+            await send(message)
 
-        Returns:
-            Response: The HTTP response.
+        try:
+            async with deadline:
+                await self.app(scope, receive, send_wrapper)
+        except TimeoutError:
+            if not deadline.expired():
+                raise
+            if not response_started:
+                response = JSONResponse(
+                    {"detail": "Request timed out"}, status_code=504
+                )
+                await response(scope, receive, send)
+            elif streaming:
+                await self._end_stream(
+                    scope, send, loop.time() >= total_at, first_chunk_seen
+                )
+            else:
+                raise
+
+    async def _end_stream(
+        self, scope: Scope, send: Send, total_expired: bool, first_chunk_seen: bool
+    ) -> None:
+        """
+        End an event stream that ran past one of its deadlines with an SSE `error` event.
 
-        Raises:
-            JSONResponse: If the request times out.
+        Args:
+            scope (Scope): The ASGI connection scope.
+            send (Send): The ASGI send channel.
+            total_expired (bool): Whether the total duration deadline was hit.
+            first_chunk_seen (bool): Whether the stream had produced any chunk.
         """
-        try:
-            return await asyncio.wait_for(call_next(request), timeout=self.timeout)
-        except asyncio.TimeoutError:
-            return JSONResponse({"detail": "Request timed out"}, status_code=504)
+        if total_expired:
+            message = "Stream exceeded the maximum duration"
+        elif first_chunk_seen:
+            message = "Stream stalled waiting for the next token"
+        else:
+            message = "Stream timed out waiting for the first token"
+
+        AppLogger.warning("%s: %s", message, scope["path"])
+        event = ServerSentEvent(
+            data=json.dumps({"status_code": 504, "message": message}), event="error"
+        )
+        await send(
+            {"type": "http.response.body", "body": event.encode(), "more_body": True}
+        )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _is_event_stream(message: Message) -> bool:
+    """
+    Check whether a response start message is for a server-sent event stream.
+
+    Args:
+        message (Message): The `http.response.start` message.
+
+    Returns:
+        bool: True if the content type is `text/event-stream`.
+    """
+    for name, value in message.get("headers", ()):
+        if name.lower() == b"content-type":
+            return value.startswith(b"text/event-stream")
+    return False
+
+
+class RequestIDMiddleware:
+    """Middleware to generate a unique request ID for each request."""
 
+    def __init__(self, app: ASGIApp):
+        """
+        Initializes the RequestIDMiddleware.
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
-    """Middleware to generate a unique request ID for each request."""
+        Args:
+            app (ASGIApp): The ASGI app.
+        """
+        self.app = app
 
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Dispatches the request and attaches a unique request ID to it.
 
-        Args:
-            request (Request): The incoming HTTP request.
-            call_next (Callable[[Request], Awaitable[Response]]): The next middleware or route handler.
+        The request ID is stored in the request state, set in the `REQUEST_ID` context
+        variable for the log records, and added to the response as the `X-Request-ID` header.
 
-        Returns:
-            Response: The HTTP response with the request ID header.
+        Args:
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
         """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         request_id = str(uuid.uuid4())
-        request.state.request_id = request_id
-        response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
-        return response
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+            await send(message)
+
+        token = REQUEST_ID.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_ID.reset(token)
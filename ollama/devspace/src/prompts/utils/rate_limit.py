@@ -0,0 +1,390 @@
+"""
+Rate Limit Module
+
+This module limits the generation requests of each client, so a single user cannot saturate
+the GPU of the Ollama backends. The service sits behind the OAuth2 proxy, which forwards
+the identity of the user in the `X-Forwarded-User` and `X-Forwarded-Email` headers; the
+first identity header of a request is its client key, and requests without one share an
+anonymous key.
+
+Each client has two token buckets: a request budget, which a request takes one token from
+before it starts, and a generated token budget, which is charged the tokens Ollama
+generated for the request once it finishes. A request is rejected with a 429, a
+`Retry-After` header and the seconds until the exhausted budget refills, while either
+budget is exhausted, so a client that generated long responses waits until it has paid
+them back.
+
+The buckets are kept by a store. The in-memory store is sharded by client key, each shard
+an LRU dictionary bounded to its share of the clients, so a bucket update is O(1). It is
+only updated on the event loop, so it needs no locks. `RateLimitStore` is the abstract
+interface of the stores, so a store shared by the replicas of the service may replace it.
+
+The limit is enforced by a raw ASGI middleware. The generated tokens are counted by the
+ChatOllama model into the usage of the request, set by the middleware in the context with
+`GENERATION_USAGE`.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import math
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..exceptions.custom_exceptions import RateLimitExceededError
+from .admission import GENERATION_ENDPOINTS, render_error
+
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Generation requests rejected by the rate limit, by the exhausted budget.",
+    ["budget"],
+)
+RATE_LIMIT_CHARGED_TOKENS = Counter(
+    "rate_limit_charged_tokens_total",
+    "Generated tokens charged to the token budgets of the clients.",
+)
+RATE_LIMIT_BUCKETS = Gauge(
+    "rate_limit_buckets",
+    "Token buckets of the clients in the in-memory rate limit store.",
+    multiprocess_mode="livesum",
+)
+RATE_LIMIT_EVICTIONS = Counter(
+    "rate_limit_evictions_total",
+    "Token buckets evicted from the in-memory rate limit store, least recently used first.",
+)
+
+# Budgets of the clients
+REQUESTS = "requests"
+TOKENS = "tokens"
+
+# Client key of the requests without an identity header
+ANONYMOUS = "anonymous"
+
+
+class GenerationUsage:
+    """
+    The tokens generated for a request.
+
+    Attributes:
+        tokens (int): The generated tokens.
+    """
+
+    def __init__(self) -> None:
+        """Initializes the GenerationUsage."""
+        self.tokens = 0
+
+
+# The usage of the request of the current context, counted by the ChatOllama model
+GENERATION_USAGE: ContextVar[Optional[GenerationUsage]] = ContextVar(
+    "generation_usage", default=None
+)
+
+
+def record_generated_tokens(tokens: int) -> None:
+    """
+    Count generated tokens into the usage of the request of the current context, if any.
+
+    Args:
+        tokens (int): The generated tokens.
+    """
+    usage = GENERATION_USAGE.get()
+    if usage is not None:
+        usage.tokens += tokens
+
+
+class TokenBucket:
+    """
+    The limit of a budget: the bucket holds up to the burst and refills at the rate.
+
+    Attributes:
+        name (str): The budget name.
+        rate (float): Tokens refilled per second.
+        burst (float): Tokens the full bucket holds.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        """
+        Initializes the TokenBucket.
+
+        Args:
+            name (str): The budget name.
+            rate (float): Tokens refilled per second.
+            burst (float): Tokens the full bucket holds.
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+
+class RateLimitStore(ABC):
+    """
+    Interface of the stores of the token buckets of the clients.
+
+    A missing bucket is full. The level of a bucket may go below zero when it is charged,
+    the client then waits until it is refilled.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, bucket: TokenBucket, amount: float) -> float:
+        """
+        Take tokens from a bucket, if it holds enough of them.
+
+        Args:
+            key (str): The client key.
+            bucket (TokenBucket): The limit of the bucket.
+            amount (float): The tokens to take, 0 to only check that the bucket is not
+                in debt.
+
+        Returns:
+            float: 0 if the tokens were taken, or else the seconds until the bucket holds
+                enough of them.
+        """
+
+    @abstractmethod
+    async def charge(self, key: str, bucket: TokenBucket, amount: float) -> None:
+        """
+        Take tokens from a bucket, whether it holds enough of them or not.
+
+        Args:
+            key (str): The client key.
+            bucket (TokenBucket): The limit of the bucket.
+            amount (float): The tokens to take.
+        """
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """
+    Token buckets in the memory of the process, sharded by client key.
+
+    Each shard is an LRU dictionary of the bucket levels, holding up to its share of the
+    maximum number of clients. The store is only used on the event loop, and an update
+    does not await, so the shards need no locks. An evicted client starts again with full
+    buckets, so the bound must exceed the clients active over the refill time of a bucket.
+
+    Attributes:
+        shards (int): The number of shards.
+        max_clients (int): Clients kept across all the shards.
+    """
+
+    def __init__(
+        self,
+        shards: int,
+        max_clients: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes the InMemoryRateLimitStore.
+
+        Args:
+            shards (int): The number of shards.
+            max_clients (int): Clients kept across all the shards.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.shards = shards
+        self.max_clients = max_clients
+        self._clock = clock
+        # A client has a bucket per budget
+        self._max_shard_keys = 2 * max(1, math.ceil(max_clients / shards))
+        # The buckets of each shard, by budget and client key: level and update time
+        self._buckets: List["OrderedDict[Tuple[str, str], List[float]]"] = [
+            OrderedDict() for _ in range(shards)
+        ]
+
+    async def take(self, key: str, bucket: TokenBucket, amount: float) -> float:
+        """
+        Take tokens from a bucket, if it holds enough of them.
+
+        Args:
+            key (str): The client key.
+            bucket (TokenBucket): The limit of the bucket.
+            amount (float): The tokens to take, 0 to only check that the bucket is not
+                in debt.
+
+        Returns:
+            float: 0 if the tokens were taken, or else the seconds until the bucket holds
+                enough of them.
+        """
+        return self._update(key, bucket, amount, force=False)
+
+    async def charge(self, key: str, bucket: TokenBucket, amount: float) -> None:
+        """
+        Take tokens from a bucket, whether it holds enough of them or not.
+
+        Args:
+            key (str): The client key.
+            bucket (TokenBucket): The limit of the bucket.
+            amount (float): The tokens to take.
+        """
+        self._update(key, bucket, amount, force=True)
+
+    def _update(
+        self, key: str, bucket: TokenBucket, amount: float, force: bool
+    ) -> float:
+        """
+        Refill a bucket, then take tokens from it.
+
+        Args:
+            key (str): The client key.
+            bucket (TokenBucket): The limit of the bucket.
+            amount (float): The tokens to take.
+            force (bool): Whether to take the tokens even if the bucket lacks them.
+
+        Returns:
+            float: 0 if the tokens were taken, or else the seconds until the bucket holds
+                enough of them.
+        """
+        index = zlib.crc32(key.encode("utf-8")) % self.shards
+        buckets = self._buckets[index]
+        bucket_key = (bucket.name, key)
+        now = self._clock()
+        state = buckets.get(bucket_key)
+        if state is None:
+            state = [bucket.burst, now]
+            buckets[bucket_key] = state
+            if len(buckets) > self._max_shard_keys:
+                buckets.popitem(last=False)
+                RATE_LIMIT_EVICTIONS.inc()
+            else:
+                RATE_LIMIT_BUCKETS.inc()
+        else:
+            buckets.move_to_end(bucket_key)
+
+        level = min(bucket.burst, state[0] + (now - state[1]) * bucket.rate)
+        state[1] = now
+        if force or level >= amount:
+            state[0] = level - amount
+            return 0.0
+        state[0] = level
+        return (amount - level) / bucket.rate
+
+
+class RateLimitMiddleware:
+    """Middleware to limit the generation requests of each client."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: RateLimitStore,
+        paths: Sequence[str],
+        identity_headers: Sequence[str],
+        requests_per_minute: float,
+        request_burst: float,
+        tokens_per_minute: float,
+        token_burst: float,
+    ):
+        """
+        Initializes the RateLimitMiddleware. A budget with a rate of 0 is not limited.
+
+        Args:
+            app (ASGIApp): The ASGI app.
+            store (RateLimitStore): The store of the token buckets.
+            paths (Sequence[str]): The path prefixes of the model routes.
+            identity_headers (Sequence[str]): The request headers identifying the client,
+                the first one present is the client key.
+            requests_per_minute (float): Requests of a client per minute.
+            request_burst (float): Requests a client may make at once.
+            tokens_per_minute (float): Tokens generated for a client per minute.
+            token_burst (float): Tokens that may be generated for a client at once.
+        """
+        self.app = app
+        self.store = store
+        self.paths = list(paths)
+        self.identity_headers = [
+            header.lower().encode("latin-1") for header in identity_headers
+        ]
+        self.requests = (
+            TokenBucket(REQUESTS, requests_per_minute / 60, request_burst)
+            if requests_per_minute > 0
+            else None
+        )
+        self.tokens = (
+            TokenBucket(TOKENS, tokens_per_minute / 60, token_burst)
+            if tokens_per_minute > 0
+            else None
+        )
+        self._rejections = {
+            budget: RATE_LIMIT_REJECTIONS.labels(budget)
+            for budget in (REQUESTS, TOKENS)
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Dispatches the request within the budgets of its client, or renders its rejection.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
+        """
+        if scope["type"] != "http" or not self._limited(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        key = self._client_key(scope)
+        # The token budget is only checked, the tokens are charged once they are generated
+        for bucket, amount in ((self.tokens, 0), (self.requests, 1)):
+            if bucket is None:
+                continue
+            wait = await self.store.take(key, bucket, amount)
+            if wait:
+                self._rejections[bucket.name].inc()
+                exc = RateLimitExceededError(
+                    retry_after=max(1, math.ceil(wait)),
+                    budget=bucket.name,
+                    description=f"Rate limit of the {bucket.name} of {key} exceeded",
+                )
+                await render_error(scope, receive, send, exc)
+                return
+
+        usage = GenerationUsage()
+        token = GENERATION_USAGE.set(usage)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            GENERATION_USAGE.reset(token)
+            if self.tokens is not None and usage.tokens:
+                RATE_LIMIT_CHARGED_TOKENS.inc(usage.tokens)
+                await self.store.charge(key, self.tokens, usage.tokens)
+
+    def _limited(self, path: str) -> bool:
+        """
+        Whether a request runs a generation of a model route.
+
+        Args:
+            path (str): The request path.
+
+        Returns:
+            bool: True if the request is rate limited.
+        """
+        prefix, _, endpoint = path.rpartition("/")
+        if endpoint not in GENERATION_ENDPOINTS:
+            return False
+        return any(
+            prefix == route_prefix or prefix.startswith(route_prefix + "/c/")
+            for route_prefix in self.paths
+        )
+
+    def _client_key(self, scope: Scope) -> str:
+        """
+        Identify the client of a request.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+
+        Returns:
+            str: The value of the first identity header present, or else the anonymous key.
+        """
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        for name in self.identity_headers:
+            value = headers.get(name, b"").decode("latin-1").strip()
+            if value:
+                return value
+        return ANONYMOUS
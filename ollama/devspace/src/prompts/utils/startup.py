@@ -0,0 +1,60 @@
+"""
+This module provides the timing of the application startup steps.
+
+The `create_app` factory and the lifespan record how long each `setup_*` step takes,
+so slow steps can be profiled and startup regressions caught by the tests.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class StartupProfile:
+    """
+    Durations of the application startup steps.
+
+    Attributes:
+        steps (Dict[str, float]): The duration in seconds of each step, in order.
+    """
+
+    def __init__(self) -> None:
+        """Initializes an empty StartupProfile."""
+        self.steps: Dict[str, float] = {}
+
+    @property
+    def total(self) -> float:
+        """The total duration of the steps, in seconds."""
+        return sum(self.steps.values())
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """
+        Time a startup step.
+
+        Args:
+            name (str): The name of the step.
+
+        Yields:
+            None: While the step runs.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+    def summary(self) -> str:
+        """
+        Describe the durations of the steps.
+
+        Returns:
+            str: The steps and their durations in milliseconds.
+        """
+        return ", ".join(
+            f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.steps.items()
+        )
@@ -0,0 +1,294 @@
+"""
+A stub of the Ollama API for tests and load tests.
+
+The stub streams a fixed reply token by token from "/api/chat" and "/api/generate",
+in the newline delimited JSON format of Ollama, answers the "/api/version" health probe,
+loads models on "/api/generate" requests without a prompt and lists them at "/api/ps",
+and can be served in a background thread over a real socket with `serve`. The time to
+first token, the token rate and the share of failed generations are configurable. Like
+Ollama, it only evaluates the chat messages that extend the messages of its previous chat
+request, as if it kept them in its prompt cache, and reports their evaluation time.
+"/api/embed" returns deterministic fake embeddings, the hashed character trigrams of the
+lower case texts, so texts that differ by a few characters have similar embeddings.
+
+It can also be run as a standalone server, for load tests:
+    python -m tests.stubs.ollama --port 11434 [--tokens 64] [--ttft 0.2]
+        [--tokens-per-second 50] [--error-rate 0.01]
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Nanoseconds the stub reports to evaluate a chat message of the prompt
+PROMPT_EVAL_NANOSECONDS = 10**7
+
+# Dimensions of the fake embeddings
+EMBEDDING_DIMENSIONS = 256
+
+
+class OllamaStub:
+    """
+    Stub Ollama server.
+
+    Attributes:
+        tokens (List[str]): The tokens of the reply.
+        status_code (int): The status code of the generation endpoints.
+        token_delay (float): Seconds before each token is streamed.
+        first_token_delay (float): Seconds before the first token is streamed.
+        error_rate (float): Share of the generations failing with status 500.
+        healthy (bool): Whether the health probe succeeds.
+        loaded_models (List[str]): The models listed as loaded in memory.
+        expires_at (Optional[str]): The keep-alive expiry listed for the loaded models.
+        load_delay (float): Seconds to load a model that is not loaded.
+        probes (int): The probes received by "/api/ps".
+        warmups (List[Dict[str, Any]]): The payloads of the received load requests.
+        requests (List[Dict[str, Any]]): The payloads of the received generation requests.
+        authorizations (List[Optional[str]]): The Authorization header of each generation
+            and embedding request.
+        prompt_eval_counts (List[int]): The messages evaluated by each chat request.
+        embeddings (List[List[str]]): The texts of the received embedding requests.
+        app (Starlette): The ASGI application.
+    """
+
+    def __init__(
+        self,
+        tokens: Sequence[str] = ("Hel", "lo"),
+        status_code: int = 200,
+        token_delay: float = 0,
+        first_token_delay: Optional[float] = None,
+        error_rate: float = 0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Initializes the OllamaStub.
+
+        Args:
+            tokens (Sequence[str]): The tokens of the reply.
+            status_code (int): The status code of the generation endpoints.
+            token_delay (float): Seconds before each token is streamed.
+            first_token_delay (Optional[float]): Seconds before the first token is streamed,
+                the token delay if None.
+            error_rate (float): Share of the generations failing with status 500.
+            seed (Optional[int]): Seed of the error injection.
+        """
+        self.tokens = list(tokens)
+        self.status_code = status_code
+        self.token_delay = token_delay
+        self.first_token_delay = (
+            token_delay if first_token_delay is None else first_token_delay
+        )
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.healthy = True
+        self.loaded_models: List[str] = []
+        self.expires_at: Optional[str] = None
+        self.load_delay = 0.0
+        self.probes = 0
+        self.warmups: List[Dict[str, Any]] = []
+        self.requests: List[Dict[str, Any]] = []
+        self.authorizations: List[Optional[str]] = []
+        self.prompt_eval_counts: List[int] = []
+        self.embeddings: List[List[str]] = []
+        self._cached_messages: List[Dict[str, Any]] = []
+        self.app = Starlette(
+            routes=[
+                Route("/api/chat", self.generate, methods=["POST"]),
+                Route("/api/generate", self.generate, methods=["POST"]),
+                Route("/api/embed", self.embed, methods=["POST"]),
+                Route("/api/version", self.version),
+                Route("/api/ps", self.running_models),
+            ]
+        )
+
+    async def version(self, request: Request):
+        """Answer the health probe, or fail when the stub is unhealthy."""
+        if not self.healthy:
+            return JSONResponse({"error": "stub unhealthy"}, 503)
+        return JSONResponse({"version": "0.0.0-stub"})
+
+    async def running_models(self, request: Request):
+        """List the loaded models, or fail when the stub is unhealthy."""
+        self.probes += 1
+        if not self.healthy:
+            return JSONResponse({"error": "stub unhealthy"}, 503)
+        return JSONResponse(
+            {
+                "models": [
+                    {"name": name, "model": name, "expires_at": self.expires_at}
+                    for name in self.loaded_models
+                ]
+            }
+        )
+
+    async def embed(self, request: Request):
+        """Embed the texts with deterministic fake embeddings."""
+        payload = await request.json()
+        texts = payload["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        self.embeddings.append(texts)
+        self.authorizations.append(request.headers.get("authorization"))
+        if self.status_code != 200:
+            return JSONResponse({"error": "stub failure"}, self.status_code)
+        return JSONResponse(
+            {
+                "model": payload.get("model"),
+                "embeddings": [fake_embedding(text) for text in texts],
+            }
+        )
+
+    async def load(self, model: str):
+        """Load a model, as Ollama does for a generate request without a prompt."""
+        if model not in self.loaded_models:
+            await asyncio.sleep(self.load_delay)
+            self.loaded_models.append(model)
+        return JSONResponse(
+            {"model": model, "response": "", "done": True, "done_reason": "load"}
+        )
+
+    async def generate(self, request: Request):
+        """Stream the reply, or fail with the configured status code."""
+        payload = await request.json()
+        if request.url.path == "/api/generate" and "prompt" not in payload:
+            self.warmups.append(payload)
+            return await self.load(payload["model"])
+        self.requests.append(payload)
+        self.authorizations.append(request.headers.get("authorization"))
+        if self.status_code != 200:
+            return JSONResponse({"error": "stub failure"}, self.status_code)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return JSONResponse({"error": "injected stub failure"}, 500)
+
+        chat = request.url.path == "/api/chat"
+        prompt_eval: Dict[str, Any] = {}
+        if chat:
+            messages = payload.get("messages") or []
+            cached = 0
+            for previous, message in zip(self._cached_messages, messages):
+                if previous != message:
+                    break
+                cached += 1
+            self._cached_messages = messages
+            evaluated = len(messages) - cached
+            self.prompt_eval_counts.append(evaluated)
+            prompt_eval = {
+                "prompt_eval_count": evaluated,
+                "prompt_eval_duration": evaluated * PROMPT_EVAL_NANOSECONDS,
+            }
+
+        def line(content: str, done: bool, **extra: Any) -> str:
+            body: Dict[str, Any] = {"model": payload.get("model"), "done": done}
+            if chat:
+                body["message"] = {"role": "assistant", "content": content}
+            else:
+                body["response"] = content
+            return json.dumps({**body, **extra}) + "\n"
+
+        async def lines():
+            for index, token in enumerate(self.tokens):
+                delay = self.token_delay if index else self.first_token_delay
+                if delay:
+                    await asyncio.sleep(delay)
+                yield line(token, False)
+            yield line(
+                "",
+                True,
+                eval_count=len(self.tokens),
+                eval_duration=10**8,
+                **prompt_eval,
+            )
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def fake_embedding(text: str) -> List[float]:
+    """
+    Embed a text as the counts of its hashed character trigrams.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[float]: The embedding, of `EMBEDDING_DIMENSIONS` dimensions.
+    """
+    normalized = " ".join(
+        "".join(c if c.isalnum() else " " for c in text.lower()).split()
+    )
+    padded = f"  {normalized}  "
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for index in range(len(padded) - 2):
+        trigram = padded[index : index + 3].encode("utf-8")
+        vector[zlib.crc32(trigram) % EMBEDDING_DIMENSIONS] += 1
+    return vector
+
+
+@contextmanager
+def serve(stub: OllamaStub) -> Iterator[str]:
+    """
+    Serve a stub on a free local port in a background thread.
+
+    Args:
+        stub (OllamaStub): The stub to serve.
+
+    Yields:
+        str: The base URL of the running stub.
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(
+            stub.app, host="127.0.0.1", port=0, lifespan="off", log_level="warning"
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main() -> None:
+    """Serve a stub until interrupted, with the options of the command line."""
+    parser = argparse.ArgumentParser(description="Stub Ollama server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per reply")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stub = OllamaStub(
+        tokens=[f"tok{index} " for index in range(args.tokens)],
+        token_delay=1 / args.tokens_per_second if args.tokens_per_second else 0,
+        first_token_delay=args.ttft,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(
+        stub.app, host=args.host, port=args.port, log_level="warning", access_log=False
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Unit tests for the admission control of the generation requests.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from typing import List, Optional
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from src.prompts.exceptions.custom_exceptions import ServiceOverloadedError
+from src.prompts.exceptions.fastapi_error_handler import ErrorHandler
+from src.prompts.utils.admission import (
+    BATCH,
+    INTERACTIVE,
+    AdmissionController,
+    AdmissionMiddleware,
+    PriorityClass,
+)
+from src.prompts.utils.middleware import RequestIDMiddleware
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_controller(
+    max_queue: int = 1,
+    queue_timeout: float = 5,
+    aging_time: float = 60,
+    clock: Optional[FakeClock] = None,
+) -> AdmissionController:
+    """Create a controller admitting one request at a time."""
+    return AdmissionController(
+        model="admission-test",
+        max_concurrency=1,
+        classes=[
+            PriorityClass(INTERACTIVE, weight=4, max_queue=max_queue),
+            PriorityClass(BATCH, weight=1, max_queue=max_queue),
+        ],
+        queue_timeout=queue_timeout,
+        aging_time=aging_time,
+        clock=clock or FakeClock(),
+    )
+
+
+async def enqueue(
+    controller: AdmissionController, priority: str, admitted: List[str]
+) -> None:
+    """Wait for a slot and record the priority class of the admitted request."""
+    await controller.acquire(priority)
+    admitted.append(priority)
+
+
+def test_full_queue_rejects_and_release_hands_over():
+    """Test that requests beyond the queue are rejected, and queued ones admitted in order."""
+
+    async def run():
+        controller = make_controller()
+        await controller.acquire(INTERACTIVE)
+        queued = asyncio.create_task(controller.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 1
+
+        with pytest.raises(ServiceOverloadedError) as error:
+            await controller.acquire(INTERACTIVE)
+        assert error.value.headers == {"Retry-After": str(error.value.retry_after)}
+
+        controller.release(2.0)
+        await queued
+        assert (controller.active, controller.queue_depth) == (1, 0)
+        controller.release(2.0)
+        assert controller.active == 0
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_rejects():
+    """Test that a request waiting longer than the queue timeout is rejected."""
+
+    async def run():
+        controller = make_controller(queue_timeout=0.05)
+        await controller.acquire(INTERACTIVE)
+        with pytest.raises(ServiceOverloadedError):
+            await controller.acquire(INTERACTIVE)
+        assert controller.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_wait_leaves_the_queue():
+    """Test that a request cancelled while waiting does not take a slot."""
+
+    async def run():
+        controller = make_controller()
+        await controller.acquire(INTERACTIVE)
+        queued = asyncio.create_task(controller.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert controller.queue_depth == 0
+
+        controller.release(1.0)
+        assert controller.active == 0
+
+    asyncio.run(run())
+
+
+def test_freed_slots_are_shared_by_weight():
+    """Test that interactive requests get four of every five slots while both classes wait."""
+
+    async def run():
+        controller = make_controller(max_queue=10)
+        admitted: List[str] = []
+        await controller.acquire(BATCH)
+        tasks = [
+            asyncio.create_task(enqueue(controller, priority, admitted))
+            for priority in [BATCH] * 5 + [INTERACTIVE] * 5
+        ]
+        await asyncio.sleep(0)
+        for _ in range(5):
+            controller.release(1.0)
+            await asyncio.sleep(0)
+        for _ in range(6):
+            controller.release(1.0)
+        await asyncio.gather(*tasks)
+        return admitted
+
+    admitted = asyncio.run(run())
+
+    assert sorted(admitted[:5]) == [BATCH] + [INTERACTIVE] * 4
+    assert admitted[5:] == [INTERACTIVE] + [BATCH] * 4
+
+
+def test_aged_request_goes_first():
+    """Test that a batch request waiting longer than the aging time is not starved."""
+
+    async def run():
+        clock = FakeClock()
+        controller = make_controller(max_queue=10, aging_time=20, clock=clock)
+        admitted: List[str] = []
+        await controller.acquire(INTERACTIVE)
+        batch = asyncio.create_task(enqueue(controller, BATCH, admitted))
+        await asyncio.sleep(0)
+        clock.now += 25
+        interactive = asyncio.create_task(enqueue(controller, INTERACTIVE, admitted))
+        await asyncio.sleep(0)
+        controller.release(1.0)
+        await asyncio.sleep(0)
+        controller.release(1.0)
+        await asyncio.gather(batch, interactive)
+        return admitted
+
+    assert asyncio.run(run()) == [BATCH, INTERACTIVE]
+
+
+@pytest.mark.parametrize(
+    "path, headers, priority",
+    [
+        ("/model/invoke", [], INTERACTIVE),
+        ("/model/stream", [(b"x-priority", b"Batch")], BATCH),
+        ("/model/batch", [], BATCH),
+        ("/model/batch", [(b"x-priority", b"interactive")], INTERACTIVE),
+        ("/model/invoke", [(b"x-priority", b"urgent")], INTERACTIVE),
+    ],
+)
+def test_requests_are_classified_by_header_or_endpoint(
+    path: str, headers: list, priority: str
+):
+    """Test that the priority header wins over the endpoint, and unknown classes are ignored."""
+    middleware = AdmissionMiddleware(FastAPI(), {"/model": make_controller()})
+    controller = middleware.controllers["/model"]
+    endpoint = path.rpartition("/")[2]
+    scope = {"type": "http", "path": path, "headers": headers}
+
+    assert middleware._priority(scope, controller, endpoint) == priority
+
+
+def test_middleware_rejects_through_error_handler():
+    """Test that overloaded generation requests get a 503 with Retry-After from the ErrorHandler."""
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.post("/model/invoke")
+    async def invoke():
+        """Route that holds its slot until released."""
+        await release.wait()
+        return {"output": "done"}
+
+    @app.get("/model/input_schema")
+    async def input_schema():
+        """Route that does not run a generation."""
+        return {}
+
+    ErrorHandler(app).register_default_handlers()
+    app.add_middleware(
+        AdmissionMiddleware, controllers={"/model": make_controller(max_queue=0)}
+    )
+    app.add_middleware(RequestIDMiddleware)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            admitted = asyncio.create_task(client.post("/model/invoke"))
+            await asyncio.sleep(0.05)
+            rejected = await client.post("/model/invoke")
+            schema = await client.get("/model/input_schema")
+            release.set()
+            return await admitted, rejected, schema
+
+    admitted, rejected, schema = asyncio.run(run())
+
+    assert admitted.status_code == 200
+    assert schema.status_code == 200
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+    assert "X-Request-ID" in rejected.headers
+    body = rejected.json()
+    assert body["name"] == "ServiceOverloadedError"
+    assert rejected.headers["X-Request-ID"] in body["description"]
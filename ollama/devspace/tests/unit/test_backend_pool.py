@@ -0,0 +1,238 @@
+"""
+Unit tests for the load balancing across Ollama backends.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from contextlib import ExitStack
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+from src.prompts.services.backend_pool import BackendPool
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.ollama_client import OllamaClient
+from tests.stubs.ollama import OllamaStub, serve
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_pool(urls: List[str], clock: Optional[FakeClock] = None) -> BackendPool:
+    """Create a pool that ejects a backend after two failures, for ten seconds."""
+    client = OllamaClient(
+        max_connections=10,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=5,
+    )
+    return BackendPool(
+        urls,
+        client=client,
+        probe_interval=60,
+        probe_timeout=1,
+        failure_threshold=2,
+        ejection_time=10,
+        clock=clock or FakeClock(),
+    )
+
+
+@pytest.fixture
+def stubs() -> Iterator[List[Tuple[OllamaStub, str]]]:
+    """Fixture to serve two Ollama stubs over local sockets."""
+    with ExitStack() as stack:
+        yield [
+            (stub, stack.enter_context(serve(stub)))
+            for stub in (OllamaStub(token_delay=0.02), OllamaStub(token_delay=0.02))
+        ]
+
+
+def test_select_least_outstanding():
+    """Test that the backend with the fewest outstanding requests is selected."""
+    pool = make_pool(["http://a", "http://b", "http://c"])
+    first, second, third = pool.backends
+    first.begin()
+    first.begin()
+    second.begin()
+
+    assert {pool.select().url for _ in range(3)} == {"http://c"}
+
+    third.begin()
+    third.begin()
+    assert {pool.select().url for _ in range(3)} == {"http://b"}
+
+
+def test_ties_are_broken_round_robin():
+    """Test that idle backends take turns."""
+    pool = make_pool(["http://a", "http://b", "http://c"])
+    assert [pool.select().url for _ in range(3)] == ["http://a", "http://b", "http://c"]
+
+
+def test_failing_backend_is_ejected_and_readmitted(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that a failing backend is ejected, and re-admitted by a later probe."""
+    (good, good_url), (bad, bad_url) = stubs
+    bad.status_code = 500
+    clock = FakeClock()
+    pool = make_pool([good_url, bad_url], clock)
+
+    async def send(requests: int) -> int:
+        errors = 0
+        for _ in range(requests):
+            try:
+                async for _ in pool.stream_lines("/api/chat", {"model": "m"}):
+                    pass
+            except ValueError:
+                errors += 1
+        return errors
+
+    async def run():
+        assert await send(6) == 2
+        assert not pool.backends[1].healthy
+        assert len(good.requests) == 4
+
+        bad.status_code = 200
+        await pool.probe()
+        assert not pool.backends[1].healthy
+
+        clock.now += 10
+        await pool.probe()
+        assert pool.backends[1].healthy
+        assert await send(2) == 0
+        await pool._client.aclose()
+
+    asyncio.run(run())
+
+    assert len(bad.requests) == 3
+    assert pool.backends[0].latency is not None
+
+
+def test_probe_ejects_unreachable_backend(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that a backend failing its health probe stops receiving requests."""
+    (stub, url), (unhealthy, unhealthy_url) = stubs
+    unhealthy.healthy = False
+    pool = make_pool([url, unhealthy_url, "http://127.0.0.1:9"])
+
+    async def run():
+        await pool.probe()
+        await pool._client.aclose()
+
+    asyncio.run(run())
+
+    assert [backend.healthy for backend in pool.backends] == [True, False, False]
+    assert {pool.select().url for _ in range(3)} == {url}
+
+
+def test_model_balances_concurrent_requests(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that concurrent model requests are spread across the backends."""
+    pool = make_pool([url for _, url in stubs])
+    model = KubertChatOllama(model="pool-test", base_url=stubs[0][1], backend_pool=pool)
+
+    async def run():
+        try:
+            return await asyncio.gather(*(model.ainvoke("Hi") for _ in range(6)))
+        finally:
+            await pool._client.aclose()
+
+    results = asyncio.run(run())
+
+    assert [result.content for result in results] == ["Hello"] * 6
+    assert [len(stub.requests) for stub, _ in stubs] == [3, 3]
+    assert all(backend.outstanding == 0 for backend in pool.backends)
+
+
+def test_cancelled_request_is_not_recorded(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that a stream cancelled halfway updates neither the latency nor the streak."""
+    stub, url = stubs[0]
+    pool = make_pool([url])
+    backend = pool.backends[0]
+
+    async def consume(first_line: asyncio.Event) -> None:
+        async for _ in pool.stream_lines("/api/chat", {"model": "m"}):
+            first_line.set()
+
+    async def run():
+        try:
+            await consume(asyncio.Event())
+            stub.status_code = 500
+            with pytest.raises(ValueError):
+                await consume(asyncio.Event())
+            stub.status_code = 200
+            latency, failures = backend.latency, backend.consecutive_failures
+
+            first_line = asyncio.Event()
+            task = asyncio.create_task(consume(first_line))
+            await first_line.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return latency, failures
+        finally:
+            await pool._client.aclose()
+
+    latency, failures = asyncio.run(run())
+
+    assert backend.latency == latency
+    assert backend.consecutive_failures == failures == 1
+    assert backend.outstanding == 0
+    assert backend.requests == 2
+
+
+def test_client_errors_do_not_eject_the_backend(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that the 4xx responses, caused by the requests, are not backend failures."""
+    stub, url = stubs[0]
+    pool = make_pool([url])
+    backend = pool.backends[0]
+
+    async def run():
+        try:
+            for status_code in (404, 400) * 3:
+                stub.status_code = status_code
+                with pytest.raises(Exception):
+                    async for _ in pool.stream_lines("/api/chat", {"model": "m"}):
+                        pass
+        finally:
+            await pool._client.aclose()
+
+    asyncio.run(run())
+
+    assert backend.healthy
+    assert (backend.failures, backend.consecutive_failures) == (0, 0)
+    assert backend.requests == 6
+
+
+def test_failed_probe_round_does_not_stop_the_probes(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    pool = make_pool(["http://backend"])
+    pool.probe_interval = 0
+    rounds: List[int] = []
+
+    async def probe():
+        rounds.append(len(rounds))
+        if len(rounds) == 1:
+            raise RuntimeError("probe failed")
+
+    monkeypatch.setattr(pool, "probe", probe)
+
+    async def run():
+        await pool.start()
+        try:
+            while len(rounds) < 3:
+                await asyncio.sleep(0)
+        finally:
+            await pool.aclose()
+            await pool._client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    assert len(rounds) >= 3
@@ -0,0 +1,164 @@
+"""
+Unit tests for the circuit breaker of the Ollama generations.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from src.prompts import create_app
+from src.prompts.exceptions.custom_exceptions import (
+    CircuitOpenError,
+    OllamaStatusError,
+)
+from src.prompts.services.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+)
+from tests.stubs.ollama import OllamaStub, serve
+
+CONNECT_ERROR = httpx.ConnectError("connection refused")
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_breaker(clock: FakeClock) -> CircuitBreaker:
+    """Create a breaker opening after three failures, for ten seconds."""
+    return CircuitBreaker(
+        model="breaker-test", failure_threshold=3, reset_timeout=10, clock=clock
+    )
+
+
+def fail(breaker: CircuitBreaker, times: int, exc: Exception = CONNECT_ERROR) -> None:
+    """Record failed generations."""
+    for _ in range(times):
+        breaker.record(exc, breaker.acquire())
+
+
+def test_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+
+    fail(breaker, 2)
+    breaker.record(None, breaker.acquire())
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+    fail(breaker, 1)
+    assert breaker.state == OPEN
+    assert (
+        REGISTRY.get_sample_value(
+            "ollama_circuit_breaker_state", {"model": "breaker-test"}
+        )
+        == 1
+    )
+
+    clock.now += 4
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.check()
+    assert raised.value.status_code == 503
+    assert raised.value.headers == {"Retry-After": "6"}
+
+
+def test_only_backend_failures_count():
+    breaker = make_breaker(FakeClock())
+
+    fail(breaker, 3, ValueError("invalid input"))
+    fail(breaker, 3, OllamaStatusError("bad request", 400))
+    fail(breaker, 3, asyncio.CancelledError())
+    assert breaker.state == CLOSED
+
+    fail(breaker, 3, OllamaStatusError("internal error", 500))
+    assert breaker.state == OPEN
+
+
+def test_half_open_trial_closes_or_reopens():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    fail(breaker, 3)
+
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    breaker.check()
+    trial = breaker.acquire()
+    assert trial
+    # A single trial at once
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+    breaker.record(CONNECT_ERROR, trial)
+    assert breaker.state == OPEN
+
+    clock.now += 10
+    breaker.record(None, breaker.acquire())
+    assert breaker.state == CLOSED
+
+
+def test_open_breaker_fails_fast_and_is_not_ready(monkeypatch: pytest.MonkeyPatch):
+    stub = OllamaStub(status_code=500)
+    with serve(stub) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("READINESS_PROBE_INTERVAL", "60")
+        monkeypatch.setenv("OLLAMA_FAILURE_THRESHOLD", "100")
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "2")
+        app = create_app()
+
+        with TestClient(app, raise_server_exceptions=False) as client:
+            for _ in range(2):
+                response = client.post("/ollama/invoke", json={"input": "Hi"})
+                assert response.status_code == 500
+            assert len(stub.requests) == 2
+
+            for path in ("/ollama/invoke", "/ollama/stream"):
+                response = client.post(path, json={"input": "Hi"})
+                assert response.status_code == 503
+                assert response.json()["name"] == "CircuitOpenError"
+                assert int(response.headers["Retry-After"]) > 0
+            assert len(stub.requests) == 2
+
+            state = client.portal.call(app.state.readiness.probe)
+            assert state["circuit_breaker"] == OPEN
+            assert "The circuit breaker of the Ollama requests is open" in (
+                state["reasons"]
+            )
+
+
+def test_each_model_has_its_own_breaker(monkeypatch: pytest.MonkeyPatch):
+    """Test that the failures of a model do not reject the requests of the other models."""
+    stub = OllamaStub(status_code=500)
+    with serve(stub) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("OLLAMA_MODELS", '["other"]')
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("OLLAMA_FAILURE_THRESHOLD", "100")
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "2")
+
+        with TestClient(create_app(), raise_server_exceptions=False) as client:
+            for _ in range(2):
+                response = client.post("/ollama/invoke", json={"input": "Hi"})
+                assert response.status_code == 500
+            stub.status_code = 200
+
+            response = client.post("/ollama/invoke", json={"input": "Hi"})
+            assert response.status_code == 503
+            response = client.post("/ollama/models/other/invoke", json={"input": "Hi"})
+            assert response.status_code == 200
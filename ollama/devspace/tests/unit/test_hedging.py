@@ -0,0 +1,231 @@
+"""
+Unit tests for the hedged Ollama requests.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import time
+from contextlib import ExitStack
+from typing import Iterator, List, Tuple
+
+import pytest
+from prometheus_client import REGISTRY
+from src.prompts.services.backend_pool import BackendPool
+from src.prompts.services.hedging import HEDGE_REQUEST, HedgingPolicy
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.ollama_client import OllamaClient
+from tests.stubs.ollama import OllamaStub, serve
+
+
+def make_pool(urls: List[str]) -> BackendPool:
+    """Create a pool of the backends."""
+    client = OllamaClient(
+        max_connections=10,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=5,
+    )
+    return BackendPool(
+        urls,
+        client=client,
+        probe_interval=60,
+        probe_timeout=1,
+        failure_threshold=2,
+        ejection_time=10,
+    )
+
+
+def make_policy(model: str, budget: float = 1) -> HedgingPolicy:
+    """Create a policy hedging the requests slower than 50 ms."""
+    policy = HedgingPolicy(
+        model=model,
+        percentile=95,
+        min_delay=0.05,
+        min_samples=1,
+        window=10,
+        budget=budget,
+    )
+    policy.record(0.01)
+    return policy
+
+
+def outcome(model: str, name: str) -> float:
+    """Return the count of an outcome of the hedged requests."""
+    return (
+        REGISTRY.get_sample_value(
+            "ollama_hedged_requests_total", {"model": model, "outcome": name}
+        )
+        or 0
+    )
+
+
+@pytest.fixture
+def stubs() -> Iterator[List[Tuple[OllamaStub, str]]]:
+    """Fixture to serve a slow and a fast Ollama stub, in that order."""
+    with ExitStack() as stack:
+        yield [
+            (stub, stack.enter_context(serve(stub)))
+            for stub in (OllamaStub(first_token_delay=1), OllamaStub())
+        ]
+
+
+def hedged_lines(pool: BackendPool, policy: HedgingPolicy) -> Tuple[List[str], float]:
+    """Send a hedged request and return its lines and duration."""
+
+    async def run():
+        start = time.perf_counter()
+        try:
+            lines = await pool.hedged_lines("/api/chat", {"model": "m"}, None, policy)
+        finally:
+            await pool._client.aclose()
+        return lines, time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def test_delay_is_the_percentile_of_the_response_times():
+    policy = HedgingPolicy(
+        model="hedge-delay",
+        percentile=90,
+        min_delay=0.5,
+        min_samples=5,
+        window=10,
+        budget=0.1,
+    )
+    for seconds in (1, 2, 3, 4):
+        policy.record(seconds)
+    assert policy.delay() is None
+
+    for seconds in range(5, 11):
+        policy.record(seconds)
+    assert policy.delay() == 9
+
+    # Only the window of the recent response times counts
+    for _ in range(10):
+        policy.record(0.1)
+    assert policy.delay() == 0.5
+
+
+def test_budget_caps_the_hedged_requests():
+    policy = HedgingPolicy(
+        model="hedge-budget",
+        percentile=95,
+        min_delay=0,
+        min_samples=1,
+        window=10,
+        budget=0.25,
+        max_tokens=2,
+    )
+    hedges = 0
+    for _ in range(100):
+        policy.delay()
+        hedges += policy.acquire()
+
+    assert hedges == 25
+    assert outcome("hedge-budget", "budget_exhausted") == 75
+
+    # Saved up hedges are capped while the requests are fast
+    for _ in range(100):
+        policy.delay()
+    assert [policy.acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_hedge_wins_over_slow_backend(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that a slow request is hedged, and the slow one is cancelled."""
+    (slow, _), (fast, _) = stubs
+    pool = make_pool([url for _, url in stubs])
+
+    lines, seconds = hedged_lines(pool, make_policy("hedge-race"))
+
+    assert len(lines) == 3
+    assert seconds < 0.9
+    assert len(slow.requests) == 1
+    assert len(fast.requests) == 1
+    assert all(backend.outstanding == 0 for backend in pool.backends)
+    assert outcome("hedge-race", "hedge") == 1
+
+
+def test_cancelled_loser_records_no_latency(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that the backend of the cancelled request keeps no latency sample."""
+    (_, slow_url), (_, fast_url) = stubs
+    pool = make_pool([slow_url, fast_url])
+    slow, fast = pool.backends
+
+    hedged_lines(pool, make_policy("hedge-loser"))
+
+    assert slow.latency is None
+    assert (slow.requests, slow.consecutive_failures) == (0, 0)
+    assert not REGISTRY.get_sample_value(
+        "ollama_backend_request_duration_seconds_count", {"backend": slow.url}
+    )
+    assert fast.latency is not None
+    assert fast.requests == 1
+
+
+def test_no_hedge_without_budget(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that the slow request is waited for when the budget is exhausted."""
+    (slow, _), (fast, _) = stubs
+    slow.first_token_delay = 0.2
+    pool = make_pool([url for _, url in stubs])
+
+    lines, seconds = hedged_lines(pool, make_policy("hedge-exhausted", budget=0))
+
+    assert len(lines) == 3
+    assert seconds >= 0.2
+    assert len(fast.requests) == 0
+    assert outcome("hedge-exhausted", "budget_exhausted") == 1
+
+
+def test_failed_request_leaves_the_race_to_the_other(
+    stubs: List[Tuple[OllamaStub, str]],
+):
+    """Test that the primary request answers when the hedge request fails."""
+    (slow, _), (failing, _) = stubs
+    slow.first_token_delay = 0.2
+    failing.status_code = 500
+    pool = make_pool([url for _, url in stubs])
+
+    lines, _ = hedged_lines(pool, make_policy("hedge-failure"))
+
+    assert len(lines) == 3
+    assert len(failing.requests) == 1
+    assert outcome("hedge-failure", "primary") == 1
+
+
+def test_model_hedges_invoke_requests_only(stubs: List[Tuple[OllamaStub, str]]):
+    """Test that the model hedges the requests marked by the routes."""
+    (slow, _), (fast, _) = stubs
+    pool = make_pool([url for _, url in stubs])
+    model = KubertChatOllama(
+        model="hedge-model",
+        base_url=stubs[0][1],
+        backend_pool=pool,
+        hedging=make_policy("hedge-model"),
+    )
+
+    async def invoke(hedge: bool) -> float:
+        HEDGE_REQUEST.set(hedge)
+        start = time.perf_counter()
+        result = await model.ainvoke("Hi")
+        assert result.content == "Hello"
+        return time.perf_counter() - start
+
+    async def run():
+        try:
+            # Round robin selects the slow backend for both requests
+            hedged = await invoke(True)
+            not_hedged = await invoke(False)
+        finally:
+            await pool._client.aclose()
+        return hedged, not_hedged
+
+    hedged, not_hedged = asyncio.run(run())
+
+    assert hedged < 0.9
+    assert not_hedged >= 1
+    assert len(slow.requests) == 2
+    assert len(fast.requests) == 1
@@ -0,0 +1,87 @@
+"""
+Unit tests for the JSON log formatters.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+import pytest
+from src.prompts.utils.json_logger import FastJsonFormatter, JsonFormatter
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+def make_record(
+    msg: Any = "Hello %s", args: Any = ("world",), **kwargs: Any
+) -> logging.LogRecord:
+    """Build a log record, with extra attributes set like `extra=` does."""
+    extra: Dict[str, Any] = kwargs.pop("extra", {})
+    exc_info = kwargs.pop("exc_info", None)
+    record = logging.LogRecord(
+        "app", logging.INFO, __file__, 1, msg, args, exc_info, **kwargs
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def raised_exc_info():
+    """Capture the info of a raised exception."""
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        return sys.exc_info()
+
+
+RECORDS: Dict[str, Callable[[], logging.LogRecord]] = {
+    "message with args": make_record,
+    "access log": lambda: make_record(
+        '%s - "%s %s HTTP/%s" %d',
+        ("127.0.0.1:5000", "GET", "/ollama/invoke", "1.1", 200),
+        extra={"color_message": "colored"},
+    ),
+    "dict message": lambda: make_record({"event": "started", "port": 3000}, None),
+    "extra fields": lambda: make_record(
+        extra={"user": "ana", "when": datetime(2024, 1, 2), "obj": object, "_hidden": 1}
+    ),
+    "exception": lambda: make_record("failed", None, exc_info=raised_exc_info()),
+    "stack info": lambda: make_record("here", None, sinfo="Stack (most recent call)"),
+    "non ascii": lambda: make_record("héllo ✓", None),
+}
+
+
+@pytest.mark.parametrize("name", RECORDS)
+def test_fast_formatter_output_is_identical(name: str):
+    """Test that the fast formatter produces the same output as the current formatter."""
+    record = RECORDS[name]()
+    expected = JsonFormatter(FORMAT).format(record)
+    assert FastJsonFormatter(FORMAT).format(record) == expected
+
+
+def test_fast_formatter_output_is_identical_in_a_task():
+    """Test that the output matches for records logged from an asyncio task."""
+
+    async def log():
+        return make_record()
+
+    record = asyncio.run(log())
+    assert FastJsonFormatter(FORMAT).format(record) == JsonFormatter(FORMAT).format(
+        record
+    )
+
+
+def test_asctime_cache_follows_the_clock():
+    """Test that the cached date part of asctime changes with the second."""
+    formatter = FastJsonFormatter(FORMAT)
+    reference = JsonFormatter(FORMAT)
+    for created in (1_700_000_000.123, 1_700_000_000.999, 1_700_000_001.5):
+        record = make_record()
+        record.created = created
+        record.msecs = int((created - int(created)) * 1000)
+        assert formatter.format(record) == reference.format(record)
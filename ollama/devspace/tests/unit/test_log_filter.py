@@ -0,0 +1,105 @@
+"""
+Unit tests for the path-based access log filter.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import logging
+from typing import Any, Optional, Tuple
+
+from src.prompts.utils.log_filter import SuppressSpecificLogEntries
+
+
+def access_record(path: str, status: int = 200) -> logging.LogRecord:
+    """Create a log record shaped like the uvicorn access log records."""
+    args: Tuple[Any, ...] = ("127.0.0.1:5000", "GET", path, "1.1", status)
+    return logging.LogRecord(
+        "uvicorn.access",
+        logging.INFO,
+        __file__,
+        1,
+        '%s - "%s %s HTTP/%s" %d',
+        args,
+        None,
+    )
+
+
+class FixedSampler:
+    """Sampler returning the same number every time, and counting its calls."""
+
+    def __init__(self, value: float) -> None:
+        self.value = value
+        self.calls = 0
+
+    def __call__(self) -> float:
+        self.calls += 1
+        return self.value
+
+
+def make_filter(
+    suppressed=(), sample_rates=None, sampler: Optional[FixedSampler] = None
+) -> SuppressSpecificLogEntries:
+    return SuppressSpecificLogEntries(
+        list(suppressed), sample_rates, sampler=sampler or FixedSampler(0.5)
+    )
+
+
+def test_exact_paths_are_suppressed():
+    log_filter = make_filter(["/metrics"])
+
+    assert not log_filter.filter(access_record("/metrics"))
+    assert not log_filter.filter(access_record("/metrics?name=up"))
+    assert log_filter.filter(access_record("/metrics/extra"))
+    assert log_filter.filter(access_record("/ollama/invoke"))
+
+
+def test_prefixes_match_on_segment_boundaries():
+    log_filter = make_filter(["/static/*"])
+
+    assert not log_filter.filter(access_record("/static"))
+    assert not log_filter.filter(access_record("/static/js/app.js"))
+    assert log_filter.filter(access_record("/statics"))
+    assert log_filter.filter(access_record("/"))
+
+
+def test_most_specific_rule_wins():
+    log_filter = make_filter(
+        ["/ollama/*"], {"/ollama/c/*": 1.0, "/ollama/c/abc/invoke": 0.0}
+    )
+
+    assert not log_filter.filter(access_record("/ollama/invoke"))
+    assert log_filter.filter(access_record("/ollama/c/abc/stream"))
+    assert not log_filter.filter(access_record("/ollama/c/abc/invoke"))
+
+
+def test_paths_are_sampled():
+    sampler = FixedSampler(0.005)
+    log_filter = make_filter(sample_rates={"/healthcheck": 0.01}, sampler=sampler)
+    assert log_filter.filter(access_record("/healthcheck"))
+
+    sampler.value = 0.5
+    assert not log_filter.filter(access_record("/healthcheck"))
+    assert sampler.calls == 2
+
+    # Paths without a rule never draw a sample
+    assert log_filter.filter(access_record("/ollama/invoke"))
+    assert sampler.calls == 2
+
+
+def test_server_errors_are_always_logged():
+    log_filter = make_filter(["/metrics"], {"/healthcheck": 0.0})
+
+    assert log_filter.filter(access_record("/metrics", status=500))
+    assert log_filter.filter(access_record("/healthcheck", status=503))
+    assert not log_filter.filter(access_record("/healthcheck", status=404))
+
+
+def test_other_records_are_allowed():
+    log_filter = make_filter(["/metrics"])
+    record = logging.LogRecord(
+        "uvicorn.access", logging.INFO, __file__, 1, "GET /metrics", None, None
+    )
+
+    assert log_filter.filter(record)
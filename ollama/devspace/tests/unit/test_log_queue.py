@@ -0,0 +1,121 @@
+"""
+Unit tests for the queue-based logging pipeline.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import logging
+import threading
+from typing import Iterator, List
+
+import pytest
+from fastapi.testclient import TestClient
+from src.prompts import create_app
+from src.prompts.utils.log_queue import BoundedQueueHandler, LogQueue
+from src.prompts.utils.logger import AppLogger
+
+
+class RecordingHandler(logging.Handler):
+    """Handler recording the formatted messages and the threads writing them."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages: List[str] = []
+        self.threads: List[str] = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.gate.wait()
+        self.messages.append(self.format(record))
+        self.threads.append(threading.current_thread().name)
+
+
+@pytest.fixture
+def handler() -> Iterator[RecordingHandler]:
+    """Fixture attaching a recording handler to a test logger."""
+    handler = RecordingHandler()
+    logger = logging.getLogger("test.log_queue")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    yield handler
+    logger.handlers.clear()
+
+
+def test_records_are_written_on_a_background_thread(handler: RecordingHandler):
+    """Test that records are written by the listener thread and flushed on stop."""
+    logger = logging.getLogger("test.log_queue")
+    log_queue = LogQueue([logger], size=100, policy="drop")
+    log_queue.start()
+    assert all(isinstance(h, BoundedQueueHandler) for h in logger.handlers)
+
+    items = ["a"]
+    logger.info("items %s", items)
+    items.append("b")
+    log_queue.stop()
+
+    assert handler.messages == ["items ['a']"]
+    assert threading.current_thread().name not in handler.threads
+    assert handler in logger.handlers
+    assert not any(isinstance(h, BoundedQueueHandler) for h in logger.handlers)
+
+
+def test_full_queue_drops_and_counts(handler: RecordingHandler):
+    """Test that records logged to a full queue are dropped and counted."""
+    logger = logging.getLogger("test.log_queue")
+    log_queue = LogQueue([logger], size=2, policy="drop")
+    handler.gate.clear()
+    log_queue.start()
+
+    for index in range(10):
+        logger.info("record %d", index)
+    handler.gate.set()
+    log_queue.stop()
+
+    dropped = log_queue.queue_handlers[0].dropped
+    assert dropped > 0
+    assert len(handler.messages) + dropped == 10
+
+
+def test_full_queue_blocks_without_dropping(handler: RecordingHandler):
+    """Test that the block policy waits for room instead of dropping."""
+    logger = logging.getLogger("test.log_queue")
+    log_queue = LogQueue([logger], size=2, policy="block")
+    log_queue.start()
+
+    for index in range(50):
+        logger.info("record %d", index)
+    log_queue.stop()
+
+    assert log_queue.dropped == 0
+    assert handler.messages == [f"record {index}" for index in range(50)]
+
+
+def test_app_logging_is_queued_until_shutdown():
+    """Test that the app loggers are queued while the app runs and flushed on shutdown."""
+    app = create_app()
+    app_logger = logging.getLogger("app")
+    assert app.state.log_queue is not None
+    assert all(isinstance(h, BoundedQueueHandler) for h in app_logger.handlers)
+
+    with TestClient(app):
+        pass
+
+    assert not any(isinstance(h, BoundedQueueHandler) for h in app_logger.handlers)
+
+
+def test_application_logger_writes_through_the_queue():
+    """Test that the application logger has no handler of its own writing to a stream."""
+    AppLogger.get_logger()
+    app = create_app()
+    logger = logging.getLogger("kubert")
+
+    with TestClient(app):
+        assert not any(isinstance(h, logging.StreamHandler) for h in logger.handlers)
+        assert logger.propagate
+        assert logger.isEnabledFor(logging.INFO)
+        root_handlers = logging.getLogger().handlers
+        assert all(isinstance(h, BoundedQueueHandler) for h in root_handlers)
@@ -0,0 +1,91 @@
+"""
+Unit tests for the application logger.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import logging
+from typing import Iterator, List
+
+import pytest
+from src.prompts.utils.logger import REQUEST_ID, AppLogger
+from tenacity import RetryCallState, Retrying
+
+
+class CountingArgument:
+    """Message argument counting how many times it is formatted."""
+
+    def __init__(self) -> None:
+        self.formatted = 0
+
+    def __str__(self) -> str:
+        self.formatted += 1
+        return "argument"
+
+
+class RecordingHandler(logging.Handler):
+    """Handler keeping the records it receives."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+@pytest.fixture
+def handler() -> Iterator[RecordingHandler]:
+    """Fixture recording the application logger records at the INFO level."""
+    logger = AppLogger.get_logger()
+    level = logger.level
+    handler = RecordingHandler()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield handler
+    logger.removeHandler(handler)
+    logger.setLevel(level)
+
+
+def test_disabled_level_does_not_format_the_message(handler: RecordingHandler):
+    argument = CountingArgument()
+
+    AppLogger.debug("Value: %s", argument)
+    assert argument.formatted == 0
+    assert not handler.records
+
+    AppLogger.info("Value: %s", argument)
+    assert handler.records[0].getMessage() == "Value: argument"
+
+
+def test_request_id_is_attached_from_the_context(handler: RecordingHandler):
+    token = REQUEST_ID.set("abc")
+    try:
+        AppLogger.info("In a request")
+        AppLogger.info("With an explicit ID", extra={"request_id": "def"})
+    finally:
+        REQUEST_ID.reset(token)
+    AppLogger.info("Outside of a request")
+
+    assert handler.records[0].request_id == "abc"
+    assert handler.records[1].request_id == "def"
+    assert not hasattr(handler.records[2], "request_id")
+
+
+def test_retry_attempt_is_logged_lazily(handler: RecordingHandler):
+    retry_state = RetryCallState(Retrying(), None, (), {})
+    try:
+        raise ValueError("boom")
+    except ValueError as exc:
+        retry_state.set_exception((ValueError, exc, exc.__traceback__))
+
+    AppLogger.log_retry_attempt(retry_state)
+    assert not handler.records
+
+    AppLogger.get_logger().setLevel(logging.DEBUG)
+    AppLogger.log_retry_attempt(retry_state)
+    record = handler.records[0]
+    assert record.getMessage() == "Retrying for 1 time(s) due to: boom"
+    assert record.exc_info and record.exc_info[0] is ValueError
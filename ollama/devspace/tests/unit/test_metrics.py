@@ -0,0 +1,153 @@
+"""
+Unit tests for the Prometheus metrics.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_community.chat_models import ChatOllama
+from prometheus_client import REGISTRY, multiprocess
+from src.prompts import create_app
+from src.prompts.services.ollama_chat import KubertChatOllama
+
+
+def sample(name: str, labels: Dict[str, str]) -> float:
+    """
+    Read the current value of a metric sample, treating a missing sample as zero.
+
+    Args:
+        name (str): The sample name.
+        labels (Dict[str, str]): The sample labels.
+
+    Returns:
+        float: The sample value.
+    """
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def ollama_lines(tokens: List[str], eval_duration: int) -> List[str]:
+    """
+    Build the response lines of an Ollama chat stream.
+
+    Args:
+        tokens (List[str]): The generated tokens.
+        eval_duration (int): The evaluation duration in nanoseconds.
+
+    Returns:
+        List[str]: One JSON line per token followed by the final line.
+    """
+    lines = [
+        json.dumps({"message": {"role": "assistant", "content": token}, "done": False})
+        for token in tokens
+    ]
+    lines.append(
+        json.dumps(
+            {
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "eval_count": len(tokens),
+                "eval_duration": eval_duration,
+            }
+        )
+    )
+    return lines
+
+
+@pytest.fixture
+def client() -> TestClient:
+    """Create and return a test client for the FastAPI application."""
+    return TestClient(create_app())
+
+
+def test_metrics_endpoint_records_route_latency(client: TestClient):
+    """Test that requests are recorded by route template and exposed at /metrics."""
+    labels = {"method": "GET", "route": "/healthcheck", "status_code": "200"}
+    before = sample("http_request_duration_seconds_count", labels)
+
+    client.get("/healthcheck")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "http_requests_in_flight" in response.text
+    assert sample("http_request_duration_seconds_count", labels) == before + 1
+
+
+def test_metrics_unmatched_route(client: TestClient):
+    """Test that unknown paths share a single route label."""
+    labels = {"method": "GET", "route": "unmatched", "status_code": "404"}
+    before = sample("http_request_duration_seconds_count", labels)
+
+    client.get("/does-not-exist/1")
+    client.get("/does-not-exist/2")
+
+    assert sample("http_request_duration_seconds_count", labels) == before + 2
+
+
+def test_model_records_llm_metrics(monkeypatch: pytest.MonkeyPatch):
+    """Test that a generation records time to first token, tokens and speed."""
+    lines = ollama_lines(["Hello", " world"], eval_duration=500_000_000)
+
+    async def fake_stream(self: Any, *args: Any, **kwargs: Any) -> AsyncIterator[str]:
+        for line in lines:
+            yield line
+
+    monkeypatch.setattr(ChatOllama, "_acreate_stream", fake_stream)
+    labels = {"model": "metrics-test"}
+    ttft_before = sample("ollama_time_to_first_token_seconds_count", labels)
+    tokens_before = sample("ollama_generated_tokens_total", labels)
+    speed_before = sample("ollama_tokens_per_second_sum", labels)
+
+    model = KubertChatOllama(model="metrics-test")
+    result = asyncio.run(model.ainvoke("Hi"))
+
+    assert result.content == "Hello world"
+    assert sample("ollama_time_to_first_token_seconds_count", labels) == ttft_before + 1
+    assert sample("ollama_generated_tokens_total", labels) == tokens_before + 2
+    assert sample("ollama_tokens_per_second_sum", labels) == speed_before + 4
+    assert sample("ollama_generations_in_flight", labels) == 0
+
+
+def test_model_records_upstream_errors(monkeypatch: pytest.MonkeyPatch):
+    """Test that failed Ollama requests are counted by error type."""
+
+    async def failing_stream(
+        self: Any, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        raise ValueError("Ollama call failed with status code 500.")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(ChatOllama, "_acreate_stream", failing_stream)
+    labels = {"model": "metrics-test", "error": "ValueError"}
+    before = sample("ollama_upstream_errors_total", labels)
+
+    model = KubertChatOllama(model="metrics-test")
+    with pytest.raises(ValueError):
+        asyncio.run(model.ainvoke("Hi"))
+
+    assert sample("ollama_upstream_errors_total", labels) == before + 1
+    assert sample("ollama_generations_in_flight", {"model": "metrics-test"}) == 0
+
+
+def test_worker_removes_its_live_gauges_on_shutdown(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    """Test that a worker sharing its metrics through files is marked dead on shutdown."""
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    dead: List[int] = []
+    monkeypatch.setattr(multiprocess, "mark_process_dead", dead.append)
+
+    with TestClient(create_app()) as client:
+        assert client.get("/metrics").status_code == 200
+        assert dead == []
+
+    assert dead == [os.getpid()]
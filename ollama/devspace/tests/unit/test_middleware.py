@@ -0,0 +1,207 @@
+"""
+Unit tests for the ASGI middlewares.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from typing import Dict
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from src.prompts.utils.middleware import RequestIDMiddleware, TimeoutMiddleware
+from sse_starlette.sse import AppStatus, EventSourceResponse
+
+
+@pytest.fixture
+def app() -> FastAPI:
+    """
+    Fixture to create a FastAPI application with fast, slow and streaming routes.
+
+    Returns:
+        FastAPI: The FastAPI application instance.
+    """
+    app = FastAPI()
+
+    @app.get("/request_id")
+    async def request_id_route(request: Request):
+        """Route that echoes the request id from the request state."""
+        return {"request_id": request.state.request_id}
+
+    @app.get("/slow")
+    async def slow_route():
+        """Route that takes longer than the timeout to respond."""
+        await asyncio.sleep(5)
+        return {"status": "done"}
+
+    @app.get("/stream")
+    async def stream_route():
+        """Route that keeps streaming after the timeout has elapsed."""
+
+        async def chunks():
+            for index in range(3):
+                await asyncio.sleep(0.1)
+                yield f"chunk-{index};"
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app.add_middleware(TimeoutMiddleware, timeout=0.15)
+    app.add_middleware(RequestIDMiddleware)
+    return app
+
+
+@pytest.fixture
+def client(app: FastAPI) -> TestClient:
+    """
+    Fixture to create a TestClient for the FastAPI application.
+
+    Args:
+        app (FastAPI): The FastAPI application instance.
+
+    Returns:
+        TestClient: The test client for the FastAPI application.
+    """
+    return TestClient(app)
+
+
+def test_request_id_header_matches_request_state(client: TestClient):
+    """Test that the request id is stored in the request state and returned as a header."""
+    response = client.get("/request_id")
+    assert response.status_code == 200
+    assert response.headers["X-Request-ID"] == response.json()["request_id"]
+
+
+def test_request_id_is_unique_per_request(client: TestClient):
+    """Test that every request gets a new request id."""
+    first = client.get("/request_id").headers["X-Request-ID"]
+    second = client.get("/request_id").headers["X-Request-ID"]
+    assert first != second
+
+
+def test_timeout_returns_gateway_timeout(client: TestClient):
+    """Test that a request which does not start its response in time is answered with 504."""
+    response = client.get("/slow")
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Request timed out"}
+    assert "X-Request-ID" in response.headers
+
+
+def test_timeout_does_not_interrupt_started_stream(client: TestClient):
+    """Test that the timeout is lifted once the response headers have been sent."""
+    response = client.get("/stream")
+    assert response.status_code == 200
+    assert response.text == "chunk-0;chunk-1;chunk-2;"
+
+
+@pytest.fixture
+def stream_state() -> Dict[str, bool]:
+    """
+    Fixture to record whether the streaming generators were cancelled.
+
+    Returns:
+        Dict[str, bool]: Route name to cancellation flag.
+    """
+    return {}
+
+
+@pytest.fixture
+def stream_client(stream_state: Dict[str, bool]) -> TestClient:
+    """
+    Fixture to create a TestClient for an application with SSE routes and stream deadlines.
+
+    Args:
+        stream_state (Dict[str, bool]): Records cancellation of the streaming generators.
+
+    Returns:
+        TestClient: The test client for the FastAPI application.
+    """
+    # sse-starlette keeps a global exit event bound to the event loop it was created on
+    AppStatus.should_exit_event = None
+    app = FastAPI()
+
+    def events(name: str, delays):
+        async def generator():
+            try:
+                for index, delay in enumerate(delays):
+                    await asyncio.sleep(delay)
+                    yield {"event": "data", "data": str(index)}
+            except asyncio.CancelledError:
+                stream_state[name] = True
+                raise
+
+        return EventSourceResponse(generator())
+
+    @app.get("/ollama/first_token")
+    async def first_token_route():
+        """Route that never produces a first token in time."""
+        return events("first_token", [5])
+
+    @app.get("/ollama/stall")
+    async def stall_route():
+        """Route that stalls after the first token."""
+        return events("stall", [0, 5])
+
+    @app.get("/ollama/total")
+    async def total_route():
+        """Route that keeps producing tokens past the total duration."""
+        return events("total", [0.1] * 20)
+
+    @app.get("/ollama/ok")
+    async def ok_route():
+        """Route that streams within all deadlines."""
+        return events("ok", [0.05] * 3)
+
+    @app.get("/other/stream")
+    async def other_route():
+        """Route outside of the stream paths."""
+        return events("other", [0.4])
+
+    app.add_middleware(
+        TimeoutMiddleware,
+        timeout=1,
+        stream_paths=["/ollama"],
+        first_token_timeout=0.2,
+        idle_timeout=0.2,
+        total_timeout=0.5,
+    )
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "route, message",
+    [
+        ("first_token", "Stream timed out waiting for the first token"),
+        ("stall", "Stream stalled waiting for the next token"),
+        ("total", "Stream exceeded the maximum duration"),
+    ],
+)
+def test_stream_deadline_ends_with_error_event(
+    stream_client: TestClient, stream_state: Dict[str, bool], route: str, message: str
+):
+    """Test that a stream deadline cancels the route and ends the stream with an error event."""
+    response = stream_client.get(f"/ollama/{route}")
+    assert response.status_code == 200
+    assert response.text.endswith(
+        "event: error\r\n"
+        f'data: {{"status_code": 504, "message": "{message}"}}\r\n\r\n'
+    )
+    assert response.text.count("event: error") == 1
+    assert stream_state[route] is True
+
+
+def test_stream_within_deadlines(stream_client: TestClient):
+    """Test that a stream within its deadlines is not interrupted."""
+    response = stream_client.get("/ollama/ok")
+    assert response.text.count("event: data") == 3
+    assert "event: error" not in response.text
+
+
+def test_stream_deadlines_only_apply_to_stream_paths(stream_client: TestClient):
+    """Test that event streams outside of the stream paths are not bounded."""
+    response = stream_client.get("/other/stream")
+    assert response.text.count("event: data") == 1
+    assert "event: error" not in response.text
@@ -0,0 +1,159 @@
+"""
+Unit tests for the scheduling of the requests of several models.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from contextlib import ExitStack
+
+import pytest
+from config import Settings
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from src.prompts import create_app, model_routes
+from src.prompts.services.model_scheduler import ModelScheduler
+from tests.stubs.ollama import OllamaStub, serve
+
+BACKEND = "http://scheduler-test"
+
+
+def swaps(model: str, backend: str = BACKEND) -> float:
+    """Return the count of the swaps of a model into a backend."""
+    return (
+        REGISTRY.get_sample_value(
+            "ollama_model_swaps_total", {"backend": backend, "model": model}
+        )
+        or 0
+    )
+
+
+def test_cost_prefers_the_backends_holding_the_model():
+    scheduler = ModelScheduler(max_loaded_models=1, load_cost=4)
+    scheduler.observe(BACKEND, ["llama3"])
+
+    assert scheduler.resident(BACKEND) == ["llama3:latest"]
+    assert scheduler.cost(BACKEND, "llama3") == 0
+    assert scheduler.cost(BACKEND, "mistral") == 8
+    assert scheduler.cost("http://empty", "mistral") == 4
+
+
+def test_swap_waits_for_the_idle_model_and_is_batched():
+    """Test that the requests of a model waiting for a swap are admitted together."""
+    scheduler = ModelScheduler(max_loaded_models=1, load_cost=4)
+
+    async def run():
+        assert await scheduler.admit(BACKEND, "a:1")
+        swaps_before = swaps("b:1")
+
+        waiting = [
+            asyncio.create_task(scheduler.admit(BACKEND, "b:1")) for _ in range(3)
+        ]
+        # The unloaded model waits as well, behind the swap
+        late = asyncio.create_task(scheduler.admit(BACKEND, "a:1"))
+        await asyncio.sleep(0.01)
+        assert not any(task.done() for task in (*waiting, late))
+
+        scheduler.release(BACKEND, "a:1")
+        assert await asyncio.gather(*waiting) == [True, False, False]
+        assert swaps("b:1") == swaps_before + 1
+        assert scheduler.resident(BACKEND) == ["b:1"]
+        assert not late.done()
+
+        for _ in waiting:
+            scheduler.release(BACKEND, "b:1")
+        assert await late
+        assert scheduler.resident(BACKEND) == ["a:1"]
+
+    asyncio.run(run())
+
+
+def test_resident_models_are_admitted_while_a_swap_waits():
+    scheduler = ModelScheduler(max_loaded_models=2, load_cost=4)
+
+    async def run():
+        await scheduler.admit(BACKEND, "a:1")
+        await scheduler.admit(BACKEND, "b:1")
+        waiting = asyncio.create_task(scheduler.admit(BACKEND, "c:1"))
+        await asyncio.sleep(0)
+
+        # The most recently used model is not the next one unloaded
+        assert not await scheduler.admit(BACKEND, "b:1")
+        assert not waiting.done()
+
+        scheduler.release(BACKEND, "a:1")
+        assert await waiting
+        assert scheduler.resident(BACKEND) == ["b:1", "c:1"]
+
+    asyncio.run(run())
+
+
+def test_cancelled_request_stops_waiting():
+    scheduler = ModelScheduler(max_loaded_models=1, load_cost=4)
+
+    async def run():
+        await scheduler.admit(BACKEND, "a:1")
+        waiting = asyncio.create_task(scheduler.admit(BACKEND, "b:1"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        # Without the cancelled request, the resident model is admitted at once
+        assert not await scheduler.admit(BACKEND, "a:1")
+
+    asyncio.run(run())
+
+
+def test_observe_keeps_the_models_of_admitted_requests():
+    scheduler = ModelScheduler(max_loaded_models=2, load_cost=4)
+
+    async def run():
+        await scheduler.admit(BACKEND, "a:1")
+        scheduler.observe(BACKEND, ["c:1"])
+        assert scheduler.resident(BACKEND) == ["c:1", "a:1"]
+
+        scheduler.release(BACKEND, "a:1")
+        scheduler.observe(BACKEND, [])
+        assert scheduler.resident(BACKEND) == []
+
+    asyncio.run(run())
+
+
+def test_model_routes_are_slugs(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OLLAMA_MODEL", "llama3.1:8b")
+    monkeypatch.setenv("OLLAMA_MODELS", '["Mistral:7B-Instruct", "library/phi3"]')
+
+    assert model_routes(Settings()) == {
+        "/ollama": "llama3.1:8b",
+        "/ollama/models/mistral-7b-instruct": "Mistral:7B-Instruct",
+        "/ollama/models/library-phi3": "library/phi3",
+    }
+
+
+def test_models_are_routed_to_the_backends_holding_them(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Test that alternating models do not swap the models of the backends."""
+    stubs = [OllamaStub(), OllamaStub()]
+    with ExitStack() as stack:
+        urls = [stack.enter_context(serve(stub)) for stub in stubs]
+        monkeypatch.setenv("OLLAMA_URL", ",".join(urls))
+        monkeypatch.setenv("OLLAMA_MODEL", "first:1")
+        monkeypatch.setenv("OLLAMA_MODELS", '["second:1"]')
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+
+        with TestClient(create_app()) as client:
+            for _ in range(4):
+                for path in ("/ollama", "/ollama/models/second-1"):
+                    response = client.post(path + "/invoke", json={"input": "Hi"})
+                    assert response.status_code == 200
+                    assert response.json()["output"]["content"] == "Hello"
+
+    served = [{request["model"] for request in stub.requests} for stub in stubs]
+    assert sorted(served, key=sorted) == [{"first:1"}, {"second:1"}]
+    assert swaps("first:1", urls[0]) + swaps("first:1", urls[1]) == 1
+    assert swaps("second:1", urls[0]) + swaps("second:1", urls[1]) == 1
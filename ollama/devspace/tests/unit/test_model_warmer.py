@@ -0,0 +1,180 @@
+"""
+Unit tests for the warm-up and keep-alive refresh of the Ollama models.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+from prometheus_client import REGISTRY
+from src.prompts.services.backend_pool import BackendPool
+from src.prompts.services.model_scheduler import ModelScheduler
+from src.prompts.services.model_warmer import ModelWarmer, parse_expiry
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.ollama_client import OllamaClient
+from tests.stubs.ollama import OllamaStub, serve
+
+# Unix time of the tests
+NOW = 1_700_000_000.0
+
+
+def sample(name: str, labels: dict) -> float:
+    """Read a metric sample, treating a missing sample as zero."""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def expiry_in(seconds: float) -> str:
+    """Format an "/api/ps" expiry, with nanoseconds like Ollama."""
+    expiry = datetime.fromtimestamp(NOW + seconds, timezone.utc)
+    return expiry.strftime("%Y-%m-%dT%H:%M:%S.%f") + "123+00:00"
+
+
+def make_client() -> OllamaClient:
+    """Create a pooled HTTP client for the tests."""
+    return OllamaClient(
+        max_connections=10,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=5,
+    )
+
+
+def make_warmer(
+    base_url: str,
+    models: Optional[List[str]] = None,
+    scheduler: Optional[ModelScheduler] = None,
+) -> ModelWarmer:
+    """Create a warmer keeping a model loaded for 30 minutes, refreshed 5 minutes early."""
+    client = make_client()
+    pool = BackendPool(
+        [base_url],
+        client=client,
+        probe_interval=60,
+        probe_timeout=1,
+        failure_threshold=3,
+        ejection_time=10,
+        scheduler=scheduler,
+    )
+    return ModelWarmer(
+        models=models or ["warm-test"],
+        backend_pool=pool,
+        client=client,
+        keep_alive=1800,
+        refresh_margin=300,
+        check_interval=30,
+        timeout=1,
+        max_loaded_models=1,
+        wall_clock=lambda: NOW,
+    )
+
+
+@pytest.fixture
+def stub() -> Iterator[Tuple[OllamaStub, str]]:
+    """Fixture to serve an Ollama stub over a local socket."""
+    stub = OllamaStub()
+    with serve(stub) as base_url:
+        yield stub, base_url
+
+
+def test_parse_expiry():
+    assert parse_expiry("2024-06-04T14:38:31.837530123-07:00") == pytest.approx(
+        datetime(2024, 6, 4, 21, 38, 31, 837530, timezone.utc).timestamp()
+    )
+    assert parse_expiry("not a date") is None
+    assert parse_expiry(None) is None
+
+
+def test_cold_model_is_loaded(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.load_delay = 0.05
+    labels = {"model": "warm-test"}
+    before = sample("ollama_model_load_seconds_count", labels)
+
+    asyncio.run(make_warmer(base_url).check())
+
+    assert ollama.warmups == [{"model": "warm-test", "keep_alive": 1800}]
+    assert ollama.loaded_models == ["warm-test"]
+    assert sample("ollama_model_load_seconds_count", labels) == before + 1
+    assert sample("ollama_model_load_seconds_sum", labels) >= 0.05
+
+
+def test_loaded_model_is_left_alone(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.loaded_models = ["warm-test:latest"]
+    ollama.expires_at = expiry_in(1200)
+
+    asyncio.run(make_warmer(base_url).check())
+
+    assert ollama.warmups == []
+
+
+def test_idle_model_keep_alive_is_refreshed(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.loaded_models = ["warm-test"]
+    ollama.expires_at = expiry_in(120)
+    labels = {"model": "warm-test", "reason": "refresh", "result": "success"}
+    before = sample("ollama_model_warmups_total", labels)
+
+    asyncio.run(make_warmer(base_url).check())
+
+    assert ollama.warmups == [{"model": "warm-test", "keep_alive": 1800}]
+    assert sample("ollama_model_warmups_total", labels) == before + 1
+
+
+def test_unreachable_backend_is_skipped(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.healthy = False
+
+    asyncio.run(make_warmer(base_url).check())
+
+    assert ollama.warmups == []
+
+
+def test_only_the_models_a_backend_keeps_loaded_are_warmed_up(
+    stub: Tuple[OllamaStub, str],
+):
+    ollama, base_url = stub
+    scheduler = ModelScheduler(max_loaded_models=1, load_cost=4)
+
+    asyncio.run(make_warmer(base_url, ["warm-test", "other"], scheduler).check())
+
+    assert ollama.warmups == [{"model": "warm-test", "keep_alive": 1800}]
+    assert scheduler.resident(base_url) == ["warm-test:latest"]
+
+
+def test_warm_up_does_not_swap_out_a_busy_model(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.loaded_models = ["busy:latest"]
+    scheduler = ModelScheduler(max_loaded_models=1, load_cost=4)
+    labels = {"model": "warm-test", "reason": "cold", "result": "skipped"}
+    before = sample("ollama_model_warmups_total", labels)
+
+    async def run():
+        await scheduler.admit(base_url, "busy")
+        await make_warmer(base_url, scheduler=scheduler).check()
+
+    asyncio.run(run())
+
+    assert ollama.warmups == []
+    assert scheduler.resident(base_url) == ["busy:latest"]
+    assert sample("ollama_model_warmups_total", labels) == before + 1
+
+
+def test_model_requests_carry_the_keep_alive(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    model = KubertChatOllama(
+        model="warm-test",
+        base_url=base_url,
+        keep_alive=1800,
+        ollama_client=make_client(),
+    )
+
+    asyncio.run(model.ainvoke("Hi"))
+
+    assert ollama.requests[0]["keep_alive"] == 1800
@@ -0,0 +1,148 @@
+"""
+Unit tests for the pooled Ollama HTTP client.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from prometheus_client import REGISTRY
+from src.prompts import create_app
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.ollama_client import OllamaClient
+from tests.stubs.ollama import OllamaStub, serve
+
+
+def connections(kind: str) -> float:
+    """Read the number of Ollama requests that opened or reused a connection."""
+    return (
+        REGISTRY.get_sample_value("ollama_http_requests_total", {"connection": kind})
+        or 0.0
+    )
+
+
+def make_client() -> OllamaClient:
+    """Create a client with small pool limits."""
+    return OllamaClient(
+        max_connections=4,
+        max_keepalive_connections=2,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=5,
+    )
+
+
+@pytest.fixture
+def stub() -> OllamaStub:
+    """Fixture to create the Ollama stub."""
+    return OllamaStub()
+
+
+@pytest.fixture
+def base_url(stub: OllamaStub) -> Iterator[str]:
+    """Fixture to serve the Ollama stub over a local socket."""
+    with serve(stub) as url:
+        yield url
+
+
+def test_client_reuses_connections(base_url: str):
+    """Test that sequential requests share one kept-alive connection."""
+    new, reused = connections("new"), connections("reused")
+
+    async def run():
+        client = make_client()
+        await client.start()
+        try:
+            for _ in range(3):
+                lines = [
+                    line
+                    async for line in client.stream_lines(
+                        f"{base_url}/api/chat", {"model": "m", "messages": []}
+                    )
+                ]
+                assert len(lines) == 3
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+
+    assert connections("new") - new == 1
+    assert connections("reused") - reused == 2
+
+
+@pytest.mark.parametrize(
+    "status_code, error", [(404, OllamaEndpointNotFoundError), (500, ValueError)]
+)
+def test_client_raises_on_error_status(
+    stub: OllamaStub, base_url: str, status_code: int, error: type
+):
+    """Test that error responses raise the errors of `ChatOllama`."""
+    stub.status_code = status_code
+
+    async def run():
+        client = make_client()
+        try:
+            async for _ in client.stream_lines(f"{base_url}/api/chat", {}):
+                pass
+        finally:
+            await client.aclose()
+
+    with pytest.raises(error):
+        asyncio.run(run())
+
+
+def test_model_sends_requests_through_client(stub: OllamaStub, base_url: str):
+    """Test that the model posts the ChatOllama payload through the pooled client."""
+    model = KubertChatOllama(
+        model="client-test", base_url=base_url, ollama_client=make_client()
+    )
+
+    async def run():
+        try:
+            return await model.ainvoke("Hi", stop=["\n"])
+        finally:
+            await model.ollama_client.aclose()
+
+    result = asyncio.run(run())
+
+    assert result.content == "Hello"
+    request = stub.requests[0]
+    assert request["model"] == "client-test"
+    assert request["messages"] == [{"role": "user", "content": "Hi", "images": []}]
+    assert request["options"]["stop"] == ["\n"]
+
+
+def test_model_sends_its_auth_through_client(stub: OllamaStub, base_url: str):
+    """Test that the auth of the model is applied to the requests of the pooled client."""
+    model = KubertChatOllama(
+        model="client-auth-test",
+        base_url=base_url,
+        ollama_client=make_client(),
+        auth=("user", "secret"),
+    )
+
+    async def run():
+        try:
+            return await model.ainvoke("Hi")
+        finally:
+            await model.ollama_client.aclose()
+
+    assert asyncio.run(run()).content == "Hello"
+    assert stub.authorizations == ["Basic dXNlcjpzZWNyZXQ="]
+
+
+def test_lifespan_starts_and_closes_client():
+    """Test that the client is started with the application and closed on shutdown."""
+    app = create_app()
+    ollama_client = app.state.ollama_client
+
+    with TestClient(app):
+        assert ollama_client._client is not None
+
+    assert ollama_client._client is None
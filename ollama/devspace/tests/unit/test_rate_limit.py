@@ -0,0 +1,176 @@
+"""
+Unit tests for the rate limit of the generation requests of each client.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from src.prompts import create_app
+from src.prompts.utils.rate_limit import (
+    InMemoryRateLimitStore,
+    RateLimitStore,
+    TokenBucket,
+)
+from tests.stubs.ollama import OllamaStub, serve
+
+REQUESTS = TokenBucket("requests", rate=1, burst=2)
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def rejections(budget: str) -> float:
+    """Return the count of the rejections of a budget."""
+    return (
+        REGISTRY.get_sample_value("rate_limit_rejections_total", {"budget": budget})
+        or 0
+    )
+
+
+def test_bucket_allows_the_burst_then_refills():
+    clock = FakeClock()
+    store = InMemoryRateLimitStore(shards=4, max_clients=10, clock=clock)
+
+    async def run():
+        assert await store.take("alice", REQUESTS, 1) == 0
+        assert await store.take("alice", REQUESTS, 1) == 0
+        assert await store.take("alice", REQUESTS, 1) == pytest.approx(1)
+        # The other clients have their own buckets
+        assert await store.take("bob", REQUESTS, 1) == 0
+
+        clock.now += 0.5
+        assert await store.take("alice", REQUESTS, 1) == pytest.approx(0.5)
+        clock.now += 0.5
+        assert await store.take("alice", REQUESTS, 1) == 0
+
+    asyncio.run(run())
+
+
+def test_charged_bucket_waits_until_the_debt_is_paid():
+    clock = FakeClock()
+    store = InMemoryRateLimitStore(shards=4, max_clients=10, clock=clock)
+    tokens = TokenBucket("tokens", rate=10, burst=100)
+
+    async def run():
+        await store.charge("alice", tokens, 130)
+        assert await store.take("alice", tokens, 0) == pytest.approx(3)
+        clock.now += 3
+        assert await store.take("alice", tokens, 0) == 0
+
+    asyncio.run(run())
+
+
+def test_least_recently_used_client_is_evicted():
+    clock = FakeClock()
+    # Room for the buckets of both budgets of one client, two buckets of a budget
+    store = InMemoryRateLimitStore(shards=1, max_clients=1, clock=clock)
+    exhausted = TokenBucket("requests", rate=1, burst=1)
+
+    async def run():
+        for key in ("a", "b"):
+            await store.take(key, exhausted, 1)
+        await store.take("a", exhausted, 0)
+        await store.take("c", exhausted, 1)
+
+        # The bucket of "b" was evicted, it starts again with a full bucket
+        assert await store.take("b", exhausted, 1) == 0
+        assert await store.take("c", exhausted, 1) > 0
+
+    asyncio.run(run())
+
+
+def test_store_must_implement_the_interface():
+    class PartialStore(RateLimitStore):
+        async def take(self, key: str, bucket: TokenBucket, amount: float) -> float:
+            return 0.0
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_clients_over_their_request_budget_are_rejected(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    with serve(OllamaStub()) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "6")
+        monkeypatch.setenv("RATE_LIMIT_REQUEST_BURST", "2")
+        rejections_before = rejections("requests")
+
+        with TestClient(create_app()) as client:
+            alice = {"X-Forwarded-User": "alice"}
+            for _ in range(2):
+                response = client.post(
+                    "/ollama/invoke", json={"input": "Hi"}, headers=alice
+                )
+                assert response.status_code == 200
+
+            response = client.post(
+                "/ollama/invoke", json={"input": "Hi"}, headers=alice
+            )
+            assert response.status_code == 429
+            assert response.json()["name"] == "RateLimitExceededError"
+            assert response.headers["Retry-After"] == "10"
+            assert response.headers["X-RateLimit-Budget"] == "requests"
+
+            # Other clients, identified by the email without a user, are not limited
+            response = client.post(
+                "/ollama/invoke",
+                json={"input": "Hi"},
+                headers={"X-Forwarded-Email": "bob@example.com"},
+            )
+            assert response.status_code == 200
+            # Nor are the requests that do not run a generation
+            assert client.get("/healthcheck", headers=alice).status_code == 200
+
+    assert rejections("requests") == rejections_before + 1
+
+
+def test_clients_over_their_token_budget_are_rejected(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Test that the tokens generated for a client are charged to its token budget."""
+    with serve(OllamaStub(tokens=["a"] * 30)) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("RATE_LIMIT_ENABLED", "true")
+        monkeypatch.setenv("RATE_LIMIT_TOKENS_PER_MINUTE", "60")
+        monkeypatch.setenv("RATE_LIMIT_TOKEN_BURST", "20")
+        charged_before = REGISTRY.get_sample_value("rate_limit_charged_tokens_total")
+
+        with TestClient(create_app()) as client:
+            headers = {"X-Forwarded-User": "carol"}
+            response = client.post(
+                "/ollama/invoke", json={"input": "Hi"}, headers=headers
+            )
+            assert response.status_code == 200
+
+            response = client.post(
+                "/ollama/stream", json={"input": "Hi"}, headers=headers
+            )
+            assert response.status_code == 429
+            assert response.headers["X-RateLimit-Budget"] == "tokens"
+            # 10 tokens in debt, refilled at a token per second
+            assert 9 <= int(response.headers["Retry-After"]) <= 10
+
+    assert (
+        REGISTRY.get_sample_value("rate_limit_charged_tokens_total")
+        == (charged_before or 0) + 30
+    )
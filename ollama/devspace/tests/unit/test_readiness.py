@@ -0,0 +1,200 @@
+"""
+Unit tests for the readiness probe and the "/readyz" endpoint.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import time
+from typing import Iterator, Optional, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from src.prompts import create_app
+from src.prompts.services.backend_pool import BackendPool
+from src.prompts.services.ollama_client import OllamaClient
+from src.prompts.services.readiness import ReadinessProbe
+from tests.stubs.ollama import OllamaStub, serve
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def stub() -> Iterator[Tuple[OllamaStub, str]]:
+    """Fixture to serve an Ollama stub over a local socket."""
+    stub = OllamaStub()
+    with serve(stub) as base_url:
+        yield stub, base_url
+
+
+def make_probe(
+    base_url: str,
+    integrated: bool = True,
+    require_model_loaded: bool = False,
+    clock: Optional[FakeClock] = None,
+) -> ReadinessProbe:
+    """Create a probe of a single backend, requiring at least four requests for the error rate."""
+    client = OllamaClient(
+        max_connections=10,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=5,
+    )
+    pool = BackendPool(
+        [base_url],
+        client=client,
+        probe_interval=60,
+        probe_timeout=1,
+        failure_threshold=3,
+        ejection_time=10,
+    )
+    return ReadinessProbe(
+        model="llama3.1",
+        backend_pool=pool,
+        client=client,
+        is_integrated=lambda: integrated,
+        probe_interval=60,
+        probe_timeout=1,
+        max_error_rate=0.5,
+        min_requests=4,
+        error_window=60,
+        require_model_loaded=require_model_loaded,
+        clock=clock or FakeClock(),
+    )
+
+
+def test_ready_when_backend_reachable(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    probe = make_probe(base_url)
+    assert not probe.ready
+
+    state = asyncio.run(probe.probe())
+
+    assert state["ready"], state["reasons"]
+    assert state["backends"][0]["reachable"]
+    assert not state["model_loaded"]
+    assert ollama.probes == 1
+
+
+def test_not_ready_until_integrated(stub: Tuple[OllamaStub, str]):
+    _, base_url = stub
+    state = asyncio.run(make_probe(base_url, integrated=False).probe())
+
+    assert not state["ready"]
+    assert state["reasons"] == ["The model routes are not integrated yet"]
+
+
+def test_not_ready_when_backend_unreachable(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    ollama.healthy = False
+    state = asyncio.run(make_probe(base_url).probe())
+
+    assert not state["ready"]
+    assert state["reasons"] == ["No Ollama backend is reachable"]
+
+
+def test_model_loaded_is_required_when_configured(stub: Tuple[OllamaStub, str]):
+    ollama, base_url = stub
+    probe = make_probe(base_url, require_model_loaded=True)
+
+    async def scenario() -> None:
+        assert not (await probe.probe())["ready"]
+
+        # The model is listed with its implicit tag
+        ollama.loaded_models = ["llama3.1:latest"]
+        state = await probe.probe()
+        assert state["ready"]
+        assert state["model_loaded"]
+
+    asyncio.run(scenario())
+
+
+def test_not_ready_on_high_recent_error_rate(stub: Tuple[OllamaStub, str]):
+    _, base_url = stub
+    clock = FakeClock()
+    probe = make_probe(base_url, clock=clock)
+    backend = probe._backend_pool.backends[0]  # type: ignore[union-attr]
+
+    async def probe_after(requests: int, failures: int) -> dict:
+        clock.now += 30
+        backend.requests += requests
+        backend.failures += failures
+        return await probe.probe()
+
+    async def scenario() -> None:
+        assert (await probe_after(0, 0))["ready"]
+        # Too few requests for the error rate to count
+        assert (await probe_after(2, 2))["ready"]
+        state = await probe_after(4, 3)
+        assert not state["ready"]
+        assert state["error_rate"] == pytest.approx(5 / 6)
+        # The failures leave the window
+        await probe_after(10, 0)
+        state = await probe_after(10, 0)
+        assert state["ready"]
+        assert state["error_rate"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_readyz_answers_from_the_cached_probe(
+    stub: Tuple[OllamaStub, str], monkeypatch: pytest.MonkeyPatch
+):
+    ollama, base_url = stub
+    monkeypatch.setenv("OLLAMA_URL", base_url)
+    monkeypatch.setenv("READINESS_PROBE_INTERVAL", "60")
+    monkeypatch.setenv("WARMUP_ENABLED", "false")
+    app = create_app()
+
+    response = TestClient(app).get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "Not Ready"
+
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 30
+        while not app.state.readiness.ready:
+            assert time.monotonic() < deadline, app.state.readiness.state
+            time.sleep(0.01)
+
+        probes = ollama.probes
+        for _ in range(20):
+            response = client.get("/readyz")
+            assert response.status_code == 200
+        assert response.json()["status"] == "Ready"
+        assert ollama.probes == probes
+
+
+def test_failed_probe_does_not_stop_the_probes(monkeypatch: pytest.MonkeyPatch):
+    probe = make_probe("http://backend")
+    probe.probe_interval = 0
+    rounds = []
+
+    async def failing_probe():
+        rounds.append(len(rounds))
+        if len(rounds) == 1:
+            raise RuntimeError("probe failed")
+
+    monkeypatch.setattr(probe, "probe", failing_probe)
+
+    async def run():
+        await probe.start()
+        try:
+            while len(rounds) < 3:
+                await asyncio.sleep(0)
+        finally:
+            await probe.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    assert len(rounds) >= 3
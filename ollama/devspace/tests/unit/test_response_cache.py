@@ -0,0 +1,140 @@
+"""
+Unit tests for the response cache.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, AsyncIterator, List, Optional
+
+import pytest
+from langchain_community.chat_models import ChatOllama
+from src.prompts.services.fingerprint import generation_fingerprint, is_deterministic
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.response_cache import ResponseCache, _entry_size
+
+
+class FakeClock:
+    """Manually advanced wall clock."""
+
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def response(text: str) -> dict:
+    """Build a cached response."""
+    return {"text": text, "generation_info": {"done": True}}
+
+
+def test_memory_hit_and_miss():
+    """Test that lookups are answered from memory and counted."""
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+
+    assert asyncio.run(cache.get("a")) is None
+    asyncio.run(cache.set("a", response("A")))
+
+    assert asyncio.run(cache.get("a")) == response("A")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction_by_bytes():
+    """Test that the least recently used entries are evicted to stay under the bound."""
+    entry_size = _entry_size(
+        "a", json.dumps(response("A"), separators=(",", ":")).encode()
+    )
+    cache = ResponseCache(max_bytes=entry_size * 2, ttl=60)
+
+    asyncio.run(cache.set("a", response("A")))
+    asyncio.run(cache.set("b", response("B")))
+    asyncio.run(cache.get("a"))
+    asyncio.run(cache.set("c", response("C")))
+
+    assert asyncio.run(cache.get("b")) is None
+    assert asyncio.run(cache.get("a")) == response("A")
+    assert asyncio.run(cache.get("c")) == response("C")
+    assert cache.size_bytes <= cache.max_bytes
+
+
+def test_entry_larger_than_bound_is_not_cached():
+    """Test that an entry larger than the whole memory bound is skipped."""
+    cache = ResponseCache(max_bytes=100, ttl=60)
+    asyncio.run(cache.set("a", response("A" * 1000)))
+    assert asyncio.run(cache.get("a")) is None
+    assert cache.size_bytes == 0
+
+
+def test_ttl_expiry():
+    """Test that entries expire after the TTL."""
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=10_000, ttl=60, clock=clock)
+    asyncio.run(cache.set("a", response("A")))
+
+    clock.now += 59
+    assert asyncio.run(cache.get("a")) == response("A")
+    clock.now += 2
+    assert asyncio.run(cache.get("a")) is None
+    assert cache.size_bytes == 0
+
+
+def test_disk_tier_survives_restart(tmp_path: Path):
+    """Test that the disk tier answers lookups of a new cache instance."""
+    path = str(tmp_path / "responses.sqlite")
+    first = ResponseCache(max_bytes=10_000, ttl=60, disk_path=path)
+    asyncio.run(first.set("a", response("A")))
+    first.close()
+
+    second = ResponseCache(max_bytes=10_000, ttl=60, disk_path=path)
+    assert asyncio.run(second.get("a")) == response("A")
+    assert second.size_bytes > 0
+    second.close()
+
+
+def test_fingerprint_normalizes_messages():
+    """Test that formatting differences in the messages share a fingerprint."""
+    params = {"model": "m", "options": {"temperature": 0, "stop": None}}
+    first = generation_fingerprint("m", [{"role": "user", "content": "Hi\r\n"}], params)
+    second = generation_fingerprint("m", [{"role": "user", "content": " Hi\n"}], params)
+    other = generation_fingerprint(
+        "m", [{"role": "user", "content": "Hi"}], {"options": {"temperature": 0.5}}
+    )
+
+    assert first == second
+    assert first != other
+    assert is_deterministic(params)
+    assert not is_deterministic({"options": {"temperature": None}})
+
+
+@pytest.mark.parametrize("temperature, upstream_calls", [(0, 1), (None, 2), (0.7, 2)])
+def test_model_caches_only_deterministic_requests(
+    monkeypatch: pytest.MonkeyPatch, temperature: Optional[float], upstream_calls: int
+):
+    """Test that only requests with a zero temperature are answered from the cache."""
+    calls: List[Any] = []
+
+    async def fake_stream(self: Any, *args: Any, **kwargs: Any) -> AsyncIterator[str]:
+        calls.append(kwargs)
+        yield json.dumps(
+            {"message": {"role": "assistant", "content": "Hello"}, "done": True}
+        )
+
+    monkeypatch.setattr(ChatOllama, "_acreate_stream", fake_stream)
+    model = KubertChatOllama(
+        model="cache-test",
+        temperature=temperature,
+        response_cache=ResponseCache(max_bytes=10_000, ttl=60),
+    )
+
+    async def invoke_twice():
+        return [await model.ainvoke("Hi"), await model.ainvoke("Hi ")]
+
+    results = asyncio.run(invoke_twice())
+
+    assert [result.content for result in results] == ["Hello", "Hello"]
+    assert len(calls) == upstream_calls
@@ -0,0 +1,242 @@
+"""
+Unit tests for the semantic response cache.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+from typing import Dict, List, Sequence
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from src.prompts import create_app
+from src.prompts.services.backend_pool import BackendPool
+from src.prompts.services.model_scheduler import ModelScheduler
+from src.prompts.services.ollama_client import OllamaClient
+from src.prompts.services.semantic_cache import (
+    OllamaEmbedder,
+    SemanticCache,
+    SemanticLookup,
+)
+from sse_starlette.sse import AppStatus
+from tests.stubs.ollama import OllamaStub, fake_embedding, serve
+
+SCOPE = SemanticCache.scope("scope")
+
+
+class FakeEmbedder:
+    """Embeds texts with the fake embeddings of the stub, and records the calls."""
+
+    def __init__(self) -> None:
+        self.calls: List[List[str]] = []
+        self.error: Exception = None
+
+    async def __call__(self, texts: List[str]) -> Sequence[Sequence[float]]:
+        self.calls.append(texts)
+        if self.error is not None:
+            raise self.error
+        return [fake_embedding(text) for text in texts]
+
+
+class FakeClock:
+    """Manually advanced wall clock."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def response(text: str) -> Dict[str, object]:
+    """Return a cached response."""
+    return {"text": text, "generation_info": None}
+
+
+def lookup(cache: SemanticCache, text: str, scope: int = SCOPE) -> SemanticLookup:
+    """Look up a text."""
+    return asyncio.run(cache.get(scope, text))
+
+
+def make_cache(capacity: int = 10, clock: FakeClock = None) -> SemanticCache:
+    """Create a cache with a fake embedder, hitting from a similarity of 0.85."""
+    return SemanticCache(
+        FakeEmbedder(),
+        capacity=capacity,
+        threshold=0.85,
+        ttl=60,
+        clock=clock or FakeClock(),
+    )
+
+
+def test_similar_question_hits_in_the_same_scope():
+    cache = make_cache()
+    miss = lookup(cache, "what is kubernetes?")
+    assert miss.response is None
+    cache.set(miss, response("An orchestrator"))
+
+    hit = lookup(cache, "What's Kubernetes")
+    assert hit.response == response("An orchestrator")
+    assert 0.85 <= hit.similarity < 1
+
+    assert lookup(cache, "what is docker?").response is None
+    assert (
+        lookup(cache, "what is kubernetes?", SemanticCache.scope("other")).response
+        is None
+    )
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_concurrent_lookups_are_batched():
+    cache = make_cache()
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get(SCOPE, f"question {index}") for index in range(3))
+        )
+
+    lookups = asyncio.run(run())
+
+    assert cache._embed.calls == [["question 0", "question 1", "question 2"]]
+    assert all(lookup.vector is not None for lookup in lookups)
+
+
+def test_full_cache_evicts_the_least_recently_used_entry():
+    clock = FakeClock()
+    cache = make_cache(capacity=2, clock=clock)
+    for text in ("what is kubernetes?", "how do I bake bread?"):
+        cache.set(lookup(cache, text), response(text))
+        clock.now += 1
+
+    # Use the first entry, so the second one is the least recently used
+    assert lookup(cache, "what is kubernetes").response is not None
+    clock.now += 1
+    cache.set(lookup(cache, "where is the moon?"), response("moon"))
+
+    assert lookup(cache, "what is kubernetes?").response is not None
+    assert lookup(cache, "how do I bake bread?").response is None
+    assert lookup(cache, "where is the moon?").response is not None
+
+
+def test_expired_entry_misses():
+    clock = FakeClock()
+    cache = make_cache(clock=clock)
+    cache.set(lookup(cache, "what is kubernetes?"), response("An orchestrator"))
+
+    clock.now += 61
+    assert lookup(cache, "what is kubernetes?").response is None
+
+
+def test_failed_embedding_is_a_miss_that_is_not_cached():
+    cache = make_cache()
+    cache._embed.error = ValueError("embedding failed")
+    errors_before = REGISTRY.get_sample_value(
+        "semantic_cache_lookups_total", {"result": "error"}
+    )
+
+    failed = lookup(cache, "what is kubernetes?")
+    cache.set(failed, response("An orchestrator"))
+
+    assert failed.response is None and failed.vector is None
+    assert cache._entries == 0
+    assert (
+        REGISTRY.get_sample_value("semantic_cache_lookups_total", {"result": "error"})
+        == (errors_before or 0) + 1
+    )
+
+
+def test_embeddings_go_through_the_backend_pool():
+    """Test that the embedding requests are scheduled, counted and authenticated."""
+    stub = OllamaStub()
+    with serve(stub) as base_url:
+        client = OllamaClient(
+            max_connections=10,
+            max_keepalive_connections=10,
+            keepalive_expiry=30,
+            connect_timeout=1,
+            read_timeout=5,
+        )
+        scheduler = ModelScheduler(max_loaded_models=2, load_cost=4)
+        pool = BackendPool(
+            [base_url],
+            client=client,
+            probe_interval=60,
+            probe_timeout=1,
+            failure_threshold=3,
+            ejection_time=10,
+            scheduler=scheduler,
+        )
+        embedder = OllamaEmbedder(
+            model="embed-test",
+            client=client,
+            timeout=5,
+            base_url=base_url,
+            backend_pool=pool,
+            auth=("user", "secret"),
+        )
+
+        async def run():
+            try:
+                return await embedder(["what is kubernetes?"])
+            finally:
+                await client.aclose()
+
+        embeddings = asyncio.run(run())
+
+    assert embeddings == [fake_embedding("what is kubernetes?")]
+    assert stub.authorizations == ["Basic dXNlcjpzZWNyZXQ="]
+    assert pool.backends[0].requests == 1
+    assert pool.backends[0].outstanding == 0
+    assert scheduler.resident(base_url) == ["embed-test:latest"]
+
+
+def test_routes_answer_similar_questions_from_the_cache(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(AppStatus, "should_exit_event", None)
+    stub = OllamaStub()
+    with serve(stub) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "true")
+        monkeypatch.setenv("SEMANTIC_CACHE_THRESHOLD", "0.85")
+        monkeypatch.setenv("OLLAMA_TEMPERATURE", "0")
+
+        with TestClient(create_app()) as client:
+            for question in ("what is kubernetes?", "What's Kubernetes"):
+                response = client.post("/ollama/invoke", json={"input": question})
+                assert response.status_code == 200
+                assert response.json()["output"]["content"] == "Hello"
+
+            response = client.post(
+                "/ollama/stream", json={"input": "What is Kubernetes"}
+            )
+            assert response.status_code == 200
+            assert "Hello" in response.text
+
+    assert len(stub.requests) == 1
+    assert len(stub.embeddings) == 3
+
+
+def test_sampled_responses_are_not_cached(monkeypatch: pytest.MonkeyPatch):
+    """Test that the requests with a sampling temperature bypass the semantic cache."""
+    stub = OllamaStub()
+    with serve(stub) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "true")
+        monkeypatch.setenv("SEMANTIC_CACHE_THRESHOLD", "0.85")
+        monkeypatch.setenv("OLLAMA_TEMPERATURE", "0.8")
+
+        with TestClient(create_app()) as client:
+            for question in ("what is kubernetes?", "what is kubernetes?"):
+                response = client.post("/ollama/invoke", json={"input": question})
+                assert response.status_code == 200
+
+    assert len(stub.requests) == 2
+    assert stub.embeddings == []
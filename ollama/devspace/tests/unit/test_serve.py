@@ -0,0 +1,114 @@
+"""
+Unit tests for the production server entry point and its graceful drain.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+from config import Settings
+from sse_starlette.sse import AppStatus
+from tests.stubs.ollama import OllamaStub, serve
+from uvicorn.server import Server
+
+import serve as production
+
+# Directory the application is run from
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+
+def free_port() -> int:
+    """Return a free local port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_server_options_follow_the_settings():
+    settings = Settings(
+        workers=4, server_keep_alive=90, server_backlog=512, server_drain_timeout=45
+    )
+
+    options = production.server_options(settings)
+
+    assert options["workers"] == 4
+    assert options["timeout_keep_alive"] == 90
+    assert options["backlog"] == 512
+    assert options["timeout_graceful_shutdown"] == 45
+    assert options["loop"] in ("uvloop", "asyncio")
+    assert options["http"] in ("httptools", "h11")
+
+
+def test_sse_streams_do_not_stop_on_sigterm():
+    """Test that the signal handler of Uvicorn is no longer patched to stop the SSE streams."""
+    assert Server.handle_exit is not AppStatus.handle_exit
+
+
+def test_sigterm_drains_in_flight_streams():
+    """Test that a stream started before SIGTERM finishes, while new connections are refused."""
+    stub = OllamaStub(tokens=[f"tok{index} " for index in range(10)], token_delay=0.1)
+    with serve(stub) as base_url:
+        port = free_port()
+        env = {
+            **os.environ,
+            "OLLAMA_URL": base_url,
+            "OLLAMA_MODEL": "drain-test",
+            "PORT": str(port),
+            "HOST": "127.0.0.1",
+            "WARMUP_ENABLED": "false",
+            "READINESS_PROBE_INTERVAL": "0.1",
+            "SERVER_DRAIN_TIMEOUT": "20",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "serve.py"],
+            cwd=PROJECT_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        service_url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                assert time.monotonic() < deadline, "The server did not become ready"
+                try:
+                    if httpx.get(service_url + "/readyz").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.1)
+
+            with httpx.stream(
+                "POST",
+                service_url + "/ollama/stream",
+                json={"input": "Hi"},
+                timeout=30,
+            ) as response:
+                lines = response.iter_lines()
+                body = [next(lines) for _ in range(2)]
+                server.send_signal(signal.SIGTERM)
+
+                # The listening socket is closed, while the stream goes on
+                time.sleep(0.3)
+                with pytest.raises(httpx.ConnectError):
+                    httpx.get(service_url + "/healthcheck")
+                body.extend(lines)
+
+            assert "event: end" in body
+            assert sum("tok" in line for line in body) == 10
+            # Uvicorn raises the captured signal again once it has shut down
+            assert server.wait(timeout=30) in (0, -signal.SIGTERM)
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
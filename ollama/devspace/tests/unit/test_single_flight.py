@@ -0,0 +1,164 @@
+"""
+Unit tests for the single-flight coalescing of identical concurrent requests.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, List, Optional
+
+import pytest
+from langchain_community.chat_models import ChatOllama
+from src.prompts.services.ollama_chat import KubertChatOllama
+from src.prompts.services.single_flight import SingleFlight
+
+
+async def collect(stream: AsyncIterator[Any]) -> List[Any]:
+    """Collect the items of a stream."""
+    return [item async for item in stream]
+
+
+def test_concurrent_subscribers_share_one_producer():
+    """Test that concurrent streams for a key start the producer once."""
+    calls = 0
+    release = asyncio.Event()
+
+    async def produce() -> AsyncIterator[int]:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        for item in range(3):
+            yield item
+
+    async def run():
+        flights: SingleFlight[int] = SingleFlight()
+        tasks = [
+            asyncio.create_task(collect(flights.stream("k", produce))) for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        assert flights.in_flight == 1
+        release.set()
+        results = await asyncio.gather(*tasks)
+        return flights, results
+
+    flights, results = asyncio.run(run())
+
+    assert calls == 1
+    assert results == [[0, 1, 2]] * 3
+    assert flights.in_flight == 0
+
+
+def test_late_subscriber_replays_produced_items():
+    """Test that a subscriber joining mid-stream receives the items produced before it."""
+    step = asyncio.Event()
+
+    async def produce() -> AsyncIterator[str]:
+        yield "a"
+        await step.wait()
+        yield "b"
+
+    async def run():
+        flights: SingleFlight[str] = SingleFlight()
+        first = flights.stream("k", produce)
+        assert await first.__anext__() == "a"
+        late = asyncio.create_task(collect(flights.stream("k", produce)))
+        await asyncio.sleep(0)
+        step.set()
+        return [item async for item in first], await late
+
+    rest, late = asyncio.run(run())
+
+    assert rest == ["b"]
+    assert late == ["a", "b"]
+
+
+def test_producer_is_cancelled_when_all_subscribers_leave():
+    """Test that the producer stops once nobody follows the stream."""
+    cancelled = False
+
+    async def produce() -> AsyncIterator[int]:
+        nonlocal cancelled
+        try:
+            yield 1
+            await asyncio.sleep(60)
+            yield 2
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def run():
+        flights: SingleFlight[int] = SingleFlight()
+        stream = flights.stream("k", produce)
+        assert await stream.__anext__() == 1
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return flights
+
+    flights = asyncio.run(run())
+
+    assert cancelled
+    assert flights.in_flight == 0
+
+
+def test_error_reaches_every_subscriber():
+    """Test that a producer error is raised to all subscribers after the produced items."""
+
+    async def produce() -> AsyncIterator[int]:
+        yield 1
+        await asyncio.sleep(0)
+        raise ConnectionError("upstream failed")
+
+    async def subscribe(flights: SingleFlight[int], received: List[int]) -> None:
+        async for item in flights.stream("k", produce):
+            received.append(item)
+
+    async def run():
+        flights: SingleFlight[int] = SingleFlight()
+        received: List[List[int]] = [[], []]
+        return received, await asyncio.gather(
+            *(subscribe(flights, items) for items in received),
+            return_exceptions=True,
+        )
+
+    received, errors = asyncio.run(run())
+
+    assert received == [[1], [1]]
+    assert all(isinstance(error, ConnectionError) for error in errors)
+
+
+@pytest.mark.parametrize("temperature, upstream_calls", [(0, 1), (None, 3)])
+def test_model_coalesces_only_deterministic_requests(
+    monkeypatch: pytest.MonkeyPatch, temperature: Optional[float], upstream_calls: int
+):
+    """Test that concurrent identical requests share a generation only at temperature 0."""
+    calls = 0
+
+    async def fake_stream(self: Any, *args: Any, **kwargs: Any) -> AsyncIterator[str]:
+        nonlocal calls
+        calls += 1
+        for token in ("Hel", "lo"):
+            await asyncio.sleep(0.01)
+            yield json.dumps(
+                {"message": {"role": "assistant", "content": token}, "done": False}
+            )
+        yield json.dumps(
+            {"message": {"role": "assistant", "content": ""}, "done": True}
+        )
+
+    monkeypatch.setattr(ChatOllama, "_acreate_stream", fake_stream)
+    model = KubertChatOllama(
+        model="single-flight-test",
+        temperature=temperature,
+        single_flight=SingleFlight(),
+    )
+
+    async def invoke_concurrently():
+        return await asyncio.gather(*(model.ainvoke("Hi") for _ in range(3)))
+
+    results = asyncio.run(invoke_concurrently())
+
+    assert [result.content for result in results] == ["Hello"] * 3
+    assert calls == upstream_calls
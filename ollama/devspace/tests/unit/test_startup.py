@@ -0,0 +1,82 @@
+"""
+Unit tests for the application startup and the lazy model integration.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from config import Settings
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src.prompts import create_app
+
+# Directory the application and the benchmarks are run from
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+
+def route_paths(fast_api: FastAPI) -> set:
+    """Return the paths of the application routes."""
+    return {getattr(route, "path", None) for route in fast_api.routes}
+
+
+def wait_for_model(fast_api: FastAPI, timeout: float = 30) -> None:
+    """Wait for the background model integration to finish."""
+    deadline = time.monotonic() + timeout
+    while fast_api.state.model is None:
+        assert time.monotonic() < deadline, "The model was not integrated in time"
+        time.sleep(0.01)
+
+
+def test_startup_is_within_budget():
+    """Test that importing, creating and starting the application stays within budget."""
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.profile_startup", "--json"],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=120,
+    )
+    profile = json.loads(result.stdout)
+
+    assert profile["modules_loaded_at_startup"] == []
+    assert "setup_model_integration" in profile["steps"]
+    assert profile["startup_seconds"] <= Settings().startup_budget, profile["steps"]
+
+
+def test_model_routes_answer_503_until_integrated():
+    """Test that the model routes are added by the lifespan, after a placeholder."""
+    app = create_app()
+    client = TestClient(app)
+
+    response = client.post("/ollama/invoke", json={"input": "Hi"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert response.json()["name"] == "ModelNotReadyError"
+    assert "/ollama/invoke" not in route_paths(app)
+
+    with client:
+        wait_for_model(app)
+        assert "/ollama/invoke" in route_paths(app)
+        assert "/ollama/{path:path}" not in route_paths(app)
+        assert app.state.startup_profile.steps["setup_model_integration"] >= 0
+
+
+def test_model_is_integrated_on_creation_when_not_lazy(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Test that the model routes are added right away without lazy integration."""
+    monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+    app = create_app()
+
+    assert app.state.model is not None
+    assert "/ollama/invoke" in route_paths(app)
+    assert "/ollama/{path:path}" not in route_paths(app)
@@ -0,0 +1,92 @@
+"""
+Unit tests for the routing of the conversations to the same Ollama backend.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+from collections import Counter
+from contextlib import ExitStack
+from typing import Dict, List
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from src.prompts import create_app
+from src.prompts.services.sticky_routing import StickyRouting
+from tests.stubs.ollama import OllamaStub, serve
+
+URLS = ["http://a", "http://b", "http://c", "http://d"]
+KEYS = [f"conversation-{index}" for index in range(1000)]
+
+
+def idle(urls: List[str]) -> Dict[str, int]:
+    """Return idle backends."""
+    return {url: 0 for url in urls}
+
+
+def test_conversations_spread_evenly():
+    routing = StickyRouting(URLS, replicas=100, load_factor=1.25)
+    counts = Counter(routing.select(key, idle(URLS)) for key in KEYS)
+
+    assert set(counts) == set(URLS)
+    assert all(150 < count < 350 for count in counts.values())
+    # The same conversation always goes to the same backend
+    assert [routing.select(key, idle(URLS)) for key in KEYS[:10]] == [
+        routing.select(key, idle(URLS)) for key in KEYS[:10]
+    ]
+
+
+def test_only_the_conversations_of_a_removed_backend_move():
+    routing = StickyRouting(URLS, replicas=100, load_factor=1.25)
+    before = {key: routing.select(key, idle(URLS)) for key in KEYS}
+    after = {key: routing.select(key, idle(URLS[1:])) for key in KEYS}
+
+    moved = {key for key in KEYS if before[key] != after[key]}
+    assert moved == {key for key in KEYS if before[key] == "http://a"}
+    # The moved conversations spread over the remaining backends
+    assert len(Counter(after[key] for key in moved)) == 3
+
+    # They come back when the backend does
+    assert {key: routing.select(key, idle(URLS)) for key in KEYS} == before
+
+
+def test_overloaded_backend_is_skipped():
+    routing = StickyRouting(URLS, replicas=100, load_factor=1.25)
+    home = routing.select("busy", idle(URLS))
+
+    outstanding = {**idle(URLS), home: 2}
+    # At most 1.25 times the average of 3 / 4 outstanding requests, so 2 at most
+    assert routing.select("busy", outstanding) != home
+    assert routing.select("busy", {url: 1 for url in URLS}) == home
+
+
+def test_conversation_reuses_the_prompt_cache(monkeypatch: pytest.MonkeyPatch):
+    """Test that the turns of a conversation only evaluate their new messages."""
+    stubs = [OllamaStub(), OllamaStub()]
+    with ExitStack() as stack:
+        urls = [stack.enter_context(serve(stub)) for stub in stubs]
+        monkeypatch.setenv("OLLAMA_URL", ",".join(urls))
+        monkeypatch.setenv("OLLAMA_MODEL", "sticky-test")
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+
+        with TestClient(create_app()) as client:
+            messages: List[Dict[str, str]] = []
+            for turn in range(3):
+                messages.append({"type": "human", "content": f"Question {turn}"})
+                response = client.post(
+                    "/ollama/invoke",
+                    json={"input": messages},
+                    headers={"X-Conversation-ID": "conversation-1"},
+                )
+                assert response.status_code == 200
+                messages.append({"type": "ai", "content": "Hello"})
+
+    served = [stub for stub in stubs if stub.requests]
+    assert len(served) == 1
+    assert served[0].prompt_eval_counts == [1, 2, 2]
+    assert REGISTRY.get_sample_value(
+        "ollama_prompt_eval_seconds_sum", {"model": "sticky-test"}
+    ) == pytest.approx(0.05)
@@ -0,0 +1,230 @@
+"""
+Unit tests for the coalescing of the streamed tokens.
+
+Author: Patryk Golabek
+Company: Translucent Computing Inc.
+Copyright: 2024 Translucent Computing Inc.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Iterator, List, Sequence, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from src.prompts import create_app
+from src.prompts.exceptions.custom_exceptions import InvalidRequestParameterError
+from src.prompts.services.stream_coalescing import (
+    CoalescingWindow,
+    StreamCoalescing,
+    coalesce,
+)
+from sse_starlette.sse import AppStatus
+from tests.stubs.ollama import OllamaStub, serve
+
+
+async def tokens(items: Sequence[Tuple[float, str]]) -> AsyncIterator[str]:
+    """Yield each token after its delay."""
+    for delay, token in items:
+        await asyncio.sleep(delay)
+        yield token
+
+
+def run_coalesce(
+    items: Sequence[Tuple[float, str]], max_delay: float, max_bytes: int
+) -> List[str]:
+    """Coalesce the tokens, merging them by concatenation."""
+
+    async def collect() -> List[str]:
+        return [
+            chunk
+            async for chunk in coalesce(
+                tokens(items),
+                CoalescingWindow(max_delay, max_bytes),
+                size=len,
+                merge=lambda first, second: first + second,
+            )
+        ]
+
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def coalescing() -> StreamCoalescing:
+    """Fixture of a 20 ms, 4096 bytes default window, up to 1 s and 65536 bytes."""
+    return StreamCoalescing(
+        default_delay=0.02, default_bytes=4096, max_delay=1, max_bytes=65536
+    )
+
+
+def test_burst_is_coalesced_up_to_the_size():
+    items = [(0, "ab")] * 5
+    assert run_coalesce(items, max_delay=10, max_bytes=4) == ["abab", "abab", "ab"]
+
+
+def test_batch_is_emitted_when_the_delay_expires():
+    """Test that a buffered token does not wait for a stalled source."""
+    items = [(0, "a"), (0, "b"), (0.3, "c")]
+    assert run_coalesce(items, max_delay=0.05, max_bytes=1000) == ["ab", "c"]
+
+
+def test_source_error_is_raised_after_the_buffered_chunks():
+    async def failing() -> AsyncIterator[str]:
+        yield "a"
+        raise ValueError("boom")
+
+    async def collect(chunks: List[str]) -> None:
+        async for chunk in coalesce(
+            failing(), CoalescingWindow(10, 1000), size=len, merge=str.__add__
+        ):
+            chunks.append(chunk)
+
+    chunks: List[str] = []
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(collect(chunks))
+    assert chunks == ["a"]
+
+
+def test_source_is_not_read_ahead_of_a_slow_consumer():
+    produced: List[int] = []
+
+    async def source() -> AsyncIterator[str]:
+        for index in range(100):
+            produced.append(index)
+            yield "a"
+
+    async def run() -> int:
+        stream = coalesce(
+            source(), CoalescingWindow(10, 1), size=len, merge=str.__add__
+        )
+        assert await stream.__anext__() == "a"
+        await asyncio.sleep(0.05)
+        read_ahead = len(produced)
+        await stream.aclose()
+        return read_ahead
+
+    # The emitted chunk, the queued one, and the one waiting for room in the queue
+    assert asyncio.run(run()) <= 3
+
+
+def test_unfinished_source_is_closed():
+    closed: List[bool] = []
+
+    async def source() -> AsyncIterator[str]:
+        try:
+            while True:
+                yield "a"
+        finally:
+            closed.append(True)
+
+    async def run() -> None:
+        stream = coalesce(
+            source(), CoalescingWindow(10, 1), size=len, merge=str.__add__
+        )
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert closed == [True]
+
+    asyncio.run(run())
+
+
+def test_cancellation_during_teardown_is_raised():
+    """Test that the consumer cancelled while the source closes stays cancelled."""
+
+    async def slow_close() -> AsyncIterator[str]:
+        try:
+            yield "a"
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.2)
+
+    async def consume() -> None:
+        stream = coalesce(
+            slow_close(), CoalescingWindow(10, 1), size=len, merge=str.__add__
+        )
+        await stream.__anext__()
+        await stream.aclose()
+
+    async def run() -> None:
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+
+def test_window_is_selected_by_the_query_parameters(coalescing: StreamCoalescing):
+    assert coalescing.window({}) is None
+    assert coalescing.window({"coalesce": "false", "coalesce_ms": "5"}) is None
+
+    window = coalescing.window({"coalesce": "true"})
+    assert (window.max_delay, window.max_bytes) == (0.02, 4096)
+
+    window = coalescing.window({"coalesce_ms": "50"})
+    assert (window.max_delay, window.max_bytes) == (0.05, 4096)
+
+    window = coalescing.window({"coalesce_bytes": "512"})
+    assert (window.max_delay, window.max_bytes) == (0.02, 512)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"coalesce": "maybe"},
+        {"coalesce_ms": "0"},
+        {"coalesce_ms": "5000"},
+        {"coalesce_ms": "nan"},
+        {"coalesce_bytes": "1.5"},
+        {"coalesce_bytes": "100000"},
+    ],
+)
+def test_invalid_window_is_rejected(coalescing: StreamCoalescing, params: dict):
+    with pytest.raises(InvalidRequestParameterError):
+        coalescing.window(params)
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
+    """Fixture of the application streaming ten tokens from an Ollama stub."""
+    # The SSE exit event is bound to the event loop of the first streaming test client
+    monkeypatch.setattr(AppStatus, "should_exit_event", None)
+    stub = OllamaStub(tokens=[f"tok{index} " for index in range(10)])
+    with serve(stub) as base_url:
+        monkeypatch.setenv("OLLAMA_URL", base_url)
+        monkeypatch.setenv("LAZY_ROUTE_INTEGRATION", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        with TestClient(create_app()) as client:
+            yield client
+
+
+def data_events(body: str) -> List[str]:
+    """Return the contents of the data events of an SSE stream."""
+    events = [event for event in body.split("\r\n\r\n") if "event: data" in event]
+    return [json.loads(event.split("data: ", 1)[1])["content"] for event in events]
+
+
+def test_stream_sends_one_event_per_token_by_default(client: TestClient):
+    response = client.post("/ollama/stream", json={"input": "Hi"})
+
+    assert response.status_code == 200
+    contents = data_events(response.text)
+    assert len(contents) == 11
+    assert "".join(contents) == "".join(f"tok{index} " for index in range(10))
+
+
+def test_stream_coalesces_tokens_on_request(client: TestClient):
+    response = client.post("/ollama/stream?coalesce_bytes=20", json={"input": "Hi"})
+
+    assert response.status_code == 200
+    contents = data_events(response.text)
+    assert len(contents) < 11
+    assert "".join(contents) == "".join(f"tok{index} " for index in range(10))
+
+
+def test_stream_rejects_invalid_window(client: TestClient):
+    response = client.post("/ollama/stream?coalesce_ms=-1", json={"input": "Hi"})
+
+    assert response.status_code == 400
+    assert response.json()["name"] == "InvalidRequestParameterError"